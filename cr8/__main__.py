@@ -18,6 +18,8 @@ from cr8.run_crate import run_crate, create_node
 from cr8.run_track import run_track
 from cr8.reindex import reindex
 from cr8.insert_from_sql import insert_from_sql
+from cr8.fake_server import fake_server
+from cr8.saturate import saturate
 
 
 log = logging.getLogger(__name__)
@@ -67,13 +69,15 @@ def main():
     p.add_argument(
         '--version', action='version', version="%(prog)s " + __version__)
     p.add_commands([timeit,
+                    saturate,
                     insert_json,
                     insert_fake_data,
                     insert_from_sql,
                     run_spec,
                     run_crate,
                     run_track,
-                    reindex])
+                    reindex,
+                    fake_server])
     args_groups = list(break_iterable(sys.argv[1:], lambda x: x == '--'))
     if len(args_groups) == 1:
         p.dispatch()
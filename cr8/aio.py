@@ -1,9 +1,13 @@
 
 import functools
+import itertools
 import os
+import time
 import asyncio
 import signal
 import sys
+import aiohttp
+from collections import deque
 try:
     import uvloop
     asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
@@ -11,6 +15,7 @@ except ImportError:
     pass
 
 from tqdm import tqdm
+from cr8.metrics import UniformReservoir, percentile
 tqdm = functools.partial(
     tqdm,
     unit=' requests',
@@ -19,23 +24,207 @@ tqdm = functools.partial(
 )
 
 
+class Progress:
+    """Progress bar which is redrawn on a timer instead of on each update.
+
+    `update` only increments a counter. Every ``interval`` seconds the bar
+    is redrawn with the throughput and, if ``stats`` is given, the 99th
+    percentile of the values measured in the last two intervals. The values
+    of each interval are sampled, so that a redraw sorts at most
+    ``2 * DEFAULT_NUM_SAMPLES`` values regardless of the throughput.
+    """
+
+    def __init__(self, total=None, stats=None, interval=0.5):
+        self.n = 0
+        self.total = total
+        self.stats = stats
+        self.interval = interval
+        self._shown = 0
+        self._recent: deque = deque(maxlen=2)
+        self._bar = None
+        self._timer = None
+
+    def update(self, n=1):
+        self.n += n
+
+    def __enter__(self):
+        self._bar = tqdm(total=self.total)
+        if not self._bar.disable:
+            if self.stats is not None:
+                self.stats.recent = UniformReservoir()
+            self._schedule()
+        return self
+
+    def __exit__(self, *ex):
+        if self._timer:
+            self._timer.cancel()
+        if not self._bar.disable:
+            self._draw()
+        self._bar.close()
+        if self.stats is not None:
+            self.stats.recent = None
+
+    def _schedule(self):
+        loop = asyncio.get_event_loop()
+        self._timer = loop.call_later(self.interval, self._refresh)
+
+    def _refresh(self):
+        self._draw()
+        self._schedule()
+
+    def _draw(self):
+        stats = self.stats
+        if stats is not None and stats.recent is not None:
+            self._recent.append(stats.recent.values)
+            stats.recent = UniformReservoir()
+            values = sorted(itertools.chain.from_iterable(self._recent))
+            if values:
+                self._bar.set_postfix_str(
+                    f'p99={percentile(values, 99):.3f} ms', refresh=False)
+        self._bar.update(self.n - self._shown)
+        self._shown = self.n
+
+
+class LagMonitor:
+    """Measures the scheduling delay of the event loop.
+
+    Every ``interval`` seconds a callback is scheduled to run as soon as
+    possible and the time until it runs is recorded in ms as ``loop_lag``
+    series of ``stats``. If the loop is busy, e.g. because the process
+    generating the load is saturated, responses wait just as long before
+    they're processed, which inflates the measured runtime.
+
+    Does nothing if ``stats`` is None.
+    """
+
+    def __init__(self, stats, interval=0.01):
+        self.stats = stats
+        self.interval = interval
+        self._loop = None
+        self._handle = None
+
+    def __enter__(self):
+        if self.stats is not None:
+            self._loop = asyncio.get_event_loop()
+            self._handle = self._loop.call_soon(self._probe)
+        return self
+
+    def __exit__(self, *ex):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _probe(self):
+        self._handle = self._loop.call_soon(self._record, time.perf_counter())
+
+    def _record(self, scheduled):
+        self.stats.measure_series('loop_lag', (time.perf_counter() - scheduled) * 1000.)
+        self._handle = self._loop.call_later(self.interval, self._probe)
+
+
+def error_category(e):
+    """Return the category of an error raised by a client.
+
+    One of ``sql``, ``connection``, ``rejected``, ``timeout`` or ``other``.
+    Errors can define the category themselves using a ``category`` attribute,
+    like `cr8.clients.SqlException` does to report rejected requests.
+
+    >>> error_category(ConnectionRefusedError())
+    'connection'
+
+    >>> error_category(asyncio.TimeoutError())
+    'timeout'
+
+    >>> error_category(ValueError())
+    'other'
+    """
+    if isinstance(e, asyncio.TimeoutError):
+        return 'timeout'
+    category = getattr(e, 'category', None)
+    if category:
+        return category
+    if isinstance(e, (OSError, aiohttp.ClientConnectionError)):
+        return 'connection'
+    # asyncpg.PostgresError; class 08 is connection exception
+    sqlstate = getattr(e, 'sqlstate', None)
+    if sqlstate:
+        return 'connection' if sqlstate.startswith('08') else 'sql'
+    return 'other'
+
+
 async def measure(stats, f, *args, **kws):
-    r = await f(*args, **kws)
+    return await _measure(stats, None, f, args, kws)
+
+
+async def measure_from(stats, f, intended_start, *args, **kws):
+    """Like `measure`, but measures the latency from ``intended_start``.
+
+    ``intended_start`` is a `time.perf_counter` value. The latency is recorded
+    instead of the duration reported by the client, and the delay until the
+    request was actually sent is recorded as ``send_delay`` series.
+    """
+    return await _measure(stats, intended_start, f, args, kws)
+
+
+async def _measure(stats, intended_start, f, args, kws):
+    start = time.perf_counter()
+    try:
+        r = await f(*args, **kws)
+    except asyncio.TimeoutError:
+        # A separate outcome; the duration would only be the deadline
+        stats.measure_timeout()
+        return None
+    except asyncio.CancelledError:
+        stats.cancelled += 1
+        raise
+    except Exception as e:
+        end = time.perf_counter()
+        since = start if intended_start is None else intended_start
+        stats.measure_error(e, error_category(e), (end - since) * 1000.)
+        if stats.raise_errors:
+            raise
+        return None
+    end = time.perf_counter()
+    client_duration = (end - start) * 1000.
     duration = r['duration']
-    stats.measure(duration)
+    if intended_start is None:
+        stats.measure(duration)
+    else:
+        stats.measure((end - intended_start) * 1000.)
+        stats.measure_series('send_delay', (start - intended_start) * 1000.)
+    stats.measure_series('client', client_duration)
+    # duration is reported by the server, unless a client sets
+    # server_duration to None because it measured the duration itself
+    server_duration = r.get('server_duration', duration)
+    if server_duration is not None:
+        stats.measure_series('server', server_duration)
+        stats.measure_series('overhead', client_duration - server_duration)
+    encode_duration = r.get('encode_duration')
+    if encode_duration is not None:
+        stats.measure_series('encode', encode_duration)
+    compress_duration = r.get('compress_duration')
+    if compress_duration is not None:
+        stats.measure_series('compress', compress_duration)
+    request_size = r.get('request_size')
+    if request_size is not None:
+        stats.measure_series('request_size', request_size)
     return r
 
 
 async def qmap(q, corof, iterable):
     for i in iterable:
         task = asyncio.ensure_future(corof(*i))
-        await q.put(task)
+        try:
+            await q.put(task)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
     await q.put(None)
 
 
 async def consume(q, total=None):
     last_error = None
-    with tqdm(total=total) as t:
+    with Progress(total=total) as t:
         while True:
             task = await q.get()
             if task is None:
@@ -49,6 +238,45 @@ async def consume(q, total=None):
             raise last_error
 
 
+async def _worker(coro, iterator, progress):
+    last_error = None
+    for i in iterator:
+        try:
+            await coro(*i)
+        except Exception as e:
+            last_error = e
+        progress.update(1)
+    return last_error
+
+
+async def run_workers(coro, iterable, concurrency, total=None, stats=None):
+    """Run ``coro`` for each item of ``iterable`` using ``concurrency`` workers.
+
+    The workers are long-lived and pull items from a shared iterator, so
+    there is no task or queue item per request. An error doesn't stop the
+    other items from being processed; the last error is raised at the end.
+
+    If ``stats`` is given, the progress includes the 99th percentile of its
+    recent measurements.
+
+    >>> results = []
+    >>> async def append(x):
+    ...     results.append(x)
+    >>> run(run_workers, append, [(1,), (2,), (3,)], 2)
+    >>> sorted(results)
+    [1, 2, 3]
+    """
+    if concurrency < 1:
+        raise ValueError(f'concurrency must be at least 1, got {concurrency}')
+    iterator = iter(iterable)
+    with Progress(total=total, stats=stats) as t:
+        errors = await asyncio.gather(
+            *(_worker(coro, iterator, t) for _ in range(concurrency)))
+    last_error = next((e for e in reversed(errors) if e), None)
+    if last_error:
+        raise last_error
+
+
 async def map(coro, iterable, total=None):
     for i in tqdm(iterable, total=total):
         await coro(*i)
@@ -77,7 +305,8 @@ def setup_sigint_handling(loop, q, iterable):
     iterable = interruptable(iterable, is_active)
 
     def stop():
-        asyncio.ensure_future(q.put(None))
+        if q is not None:
+            asyncio.ensure_future(q.put(None))
         is_active.clear()
         loop.remove_signal_handler(signal.SIGINT)
     loop.add_signal_handler(signal.SIGINT, stop)
@@ -90,18 +319,125 @@ def remove_sigint_handler(loop):
     loop.remove_signal_handler(signal.SIGINT)
 
 
-def run_many(coro, iterable, concurrency, num_items=None):
+# Seconds in-flight work may take to complete once the timeout of
+# `run_many` or `run_at_rate` is reached, before it gets cancelled.
+GRACE_PERIOD = 5.0
+
+
+def _until(iterable, deadline):
+    """Yield the items of ``iterable`` until the ``time.perf_counter`` deadline"""
+    for item in iterable:
+        if time.perf_counter() >= deadline:
+            return
+        yield item
+
+
+def _run_until_deadline(loop, task, timeout, grace_period):
+    """Run ``task`` and cancel it if it takes longer than ``timeout`` plus
+    ``grace_period``.
+
+    Returns True if the task got cancelled.
+    """
+    if timeout is None:
+        loop.run_until_complete(task)
+        return False
+    deadline = loop.call_later(timeout + grace_period, task.cancel)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        return True
+    finally:
+        deadline.cancel()
+    return False
+
+
+def run_many(coro,
+             iterable,
+             concurrency,
+             num_items=None,
+             timeout=None,
+             stats=None,
+             grace_period=GRACE_PERIOD):
+    """Run ``coro`` for each item of ``iterable`` with ``concurrency``.
+
+    If ``timeout`` (in seconds) is set, no further items are started once
+    it is exceeded. In-flight work can complete within ``grace_period``
+    seconds, afterwards it is cancelled. On SIGINT no further items are
+    started and in-flight work is completed. ``stats`` are used to show the
+    recent 99th percentile in the progress and the event loop lag is
+    recorded in them, see `LagMonitor`.
+    """
     loop = asyncio.get_event_loop()
-    if concurrency == 1:
-        return loop.run_until_complete(map(coro, iterable, total=num_items))
-    q = asyncio.Queue(maxsize=concurrency)
-    iterable = setup_sigint_handling(loop, q, iterable)
-    tasks = asyncio.gather(
-        qmap(q, coro, iterable),
-        consume(q, total=num_items)
-    )
+    iterable = setup_sigint_handling(loop, None, iterable)
+    if timeout is not None:
+        iterable = _until(iterable, time.perf_counter() + timeout)
+    task = asyncio.ensure_future(
+        run_workers(coro, iterable, concurrency, total=num_items, stats=stats))
     try:
-        loop.run_until_complete(tasks)
+        with LagMonitor(stats):
+            _run_until_deadline(loop, task, timeout, grace_period)
     except KeyboardInterrupt:
-        tasks.cancel()
+        task.cancel()
     remove_sigint_handler(loop)
+
+
+async def _schedule(coro, iterable, rate, in_flight, total=None, stats=None):
+    interval = 1.0 / rate
+    last_error = None
+
+    def done(task):
+        nonlocal last_error
+        in_flight.discard(task)
+        t.update(1)
+        if not task.cancelled() and task.exception():
+            last_error = task.exception()
+
+    with Progress(total=total, stats=stats) as t:
+        start = time.perf_counter()
+        for i, item in enumerate(iterable):
+            intended_start = start + i * interval
+            delay = intended_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(coro(intended_start, *item))
+            in_flight.add(task)
+            task.add_done_callback(done)
+        if in_flight:
+            await asyncio.wait(in_flight)
+    if last_error:
+        raise last_error
+
+
+def run_at_rate(coro,
+                iterable,
+                rate,
+                num_items=None,
+                timeout=None,
+                stats=None,
+                grace_period=GRACE_PERIOD):
+    """Start ``coro`` for each item of ``iterable`` at a fixed ``rate``.
+
+    Requests are started ``rate`` times per second, independent of the
+    completion of previous requests (open-loop). ``coro`` is called with the
+    `time.perf_counter` value at which it was supposed to start, followed by
+    the item.
+
+    ``timeout`` and ``grace_period`` work like in `run_many`. If ``stats``
+    are given, the event loop lag is recorded in them, see `LagMonitor`.
+    """
+    loop = asyncio.get_event_loop()
+    in_flight: set = set()
+    if timeout is not None:
+        iterable = _until(iterable, time.perf_counter() + timeout)
+    task = asyncio.ensure_future(
+        _schedule(coro, iterable, rate, in_flight, total=num_items, stats=stats))
+    try:
+        with LagMonitor(stats):
+            _run_until_deadline(loop, task, timeout, grace_period)
+    except KeyboardInterrupt:
+        task.cancel()
+    finally:
+        for pending in list(in_flight):
+            pending.cancel()
+        if in_flight:
+            loop.run_until_complete(asyncio.wait(in_flight))
@@ -0,0 +1,262 @@
+"""Sources for the arguments of each iteration of a statement
+
+Repeating a statement with the same arguments lets the query and filesystem
+caches of the server answer most requests. Argument sources instead provide
+different arguments on every iteration. The arguments are generated into a
+buffer before the measurements start, so that generating them doesn't add
+to the measured runtime.
+
+Sequential sources (``range`` and arguments files) continue where the
+previous buffer stopped, so that the measurements don't replay the
+arguments of the warmup. With multiple worker processes each worker uses its
+own share of them, see ``for_worker``.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import random
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from cr8.misc import get_lines
+
+
+# Number of arguments generated if the number of iterations isn't known.
+# Arguments are re-used in a cycle once the buffer is exhausted.
+DEFAULT_BUFFER_SIZE = 10_000
+MAX_BUFFER_SIZE = 100_000
+
+
+def buffer_size(iterations: Optional[int]) -> int:
+    """Return the number of arguments to generate for ``iterations``
+
+    >>> buffer_size(500)
+    500
+    >>> buffer_size(None)
+    10000
+    >>> buffer_size(10 ** 9)
+    100000
+    """
+    return min(iterations or DEFAULT_BUFFER_SIZE, MAX_BUFFER_SIZE)
+
+
+def _parse_value(line: str):
+    """Parse a line of a file as JSON value, falling back to the string
+
+    >>> _parse_value('42')
+    42
+    >>> _parse_value('Arthur Dent')
+    'Arthur Dent'
+    """
+    line = line.rstrip('\n')
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line
+
+
+async def _randint(client, spec, n):
+    low, high = spec
+    return partial(random.randint, low, high)
+
+
+async def _range(client, spec, n):
+    values = itertools.cycle(range(*spec))
+    return partial(next, values)
+
+
+async def _choice(client, spec, n):
+    return partial(random.choice, spec)
+
+
+async def _file(client, spec, n):
+    values = [_parse_value(line) for line in get_lines(spec) if line.strip()]
+    if not values:
+        raise ValueError(f'Argument source file "{spec}" is empty')
+    return partial(random.choice, values)
+
+
+@contextlib.contextmanager
+def _returning_rows(client):
+    """Let ``client`` return rows even if it's configured to discard them
+
+    Arguments are generated before the measurements, so there are no other
+    requests in-flight that would be affected.
+    """
+    discard_rows = getattr(client, 'discard_rows', False)
+    client.discard_rows = False
+    try:
+        yield client
+    finally:
+        client.discard_rows = discard_rows
+
+
+async def _column(client, spec, n):
+    table, column = spec.rsplit('.', 1)
+    # A random sample instead of the first rows, which are likely cached
+    stmt = f'select {column} from {table} order by random() limit {n}'
+    with _returning_rows(client):
+        result = await client.execute(stmt)
+    values = [row[0] for row in result['rows']]
+    if not values:
+        raise ValueError(f'Argument source column "{spec}" has no values')
+    return partial(random.choice, values)
+
+
+async def _fake(client, spec, n):
+    # Imported here to only require faker if it's used
+    from cr8.insert_fake_data import DataFaker
+    return DataFaker().provider(spec)
+
+
+SOURCES = {
+    'randint': _randint,
+    'range': _range,
+    'choice': _choice,
+    'file': _file,
+    'column': _column,
+    'fake': _fake,
+}
+
+
+class ArgSources:
+    """Generates the arguments of each iteration from one source per parameter.
+
+    Each source is a dict with one of the following keys:
+
+        randint: ``[low, high]``, a random integer within both bounds.
+        range: ``[start, stop]`` or ``[start, stop, step]``, the values of a
+            range, one after another.
+        choice: A list of values, one is picked randomly.
+        file: The path of a file, a random line of it is used. Lines are
+            parsed as JSON if possible. Relative paths are resolved against
+            ``base_dir``.
+        column: ``<table>.<column>``, a random value of the column, taken
+            from a random sample of as many rows as arguments are generated.
+        fake: The name of a faker provider or a list of the name and its
+            arguments, like the mapping of ``insert-fake-data``.
+
+    >>> sources = ArgSources([{'range': [1, 4]}, {'choice': ['a']}])
+    >>> from cr8 import aio
+    >>> aio.run(sources.generate, None, 2)
+    [[1, 'a'], [2, 'a']]
+    >>> aio.run(sources.generate, None, 2)
+    [[3, 'a'], [1, 'a']]
+    >>> aio.run(sources.for_worker(1, 2).generate, None, 2)
+    [[2, 'a'], [2, 'a']]
+    """
+
+    def __init__(self,
+                 sources: List[Dict[str, Any]],
+                 base_dir: Optional[str] = None,
+                 worker: Optional[Tuple[int, int]] = None):
+        for source in sources:
+            if len(source) != 1 or next(iter(source)) not in SOURCES:
+                raise ValueError(
+                    f'Invalid argument source {source}. Must have exactly one of: '
+                    + ', '.join(SOURCES))
+        self.sources = sources
+        self.base_dir = base_dir
+        self.worker = worker
+        # Providers of ranges by position, they continue on the next generate
+        self._ranges: Dict[int, Any] = {}
+
+    def for_worker(self, index: int, count: int) -> 'ArgSources':
+        """Return the sources for worker ``index`` of ``count`` processes.
+
+        Ranges are split so that each worker uses every ``count``-th value.
+        Random sources are independent per process anyway.
+        """
+        return ArgSources(self.sources, self.base_dir, (index, count))
+
+    def _resolve(self, kind, spec):
+        if kind == 'file' and self.base_dir and not spec.startswith(('http://', 'https://')):
+            return os.path.join(self.base_dir, spec)
+        if kind == 'range' and self.worker:
+            index, count = self.worker
+            values = range(*spec)[index::count]
+            if values:
+                return [values.start, values.stop, values.step]
+        return spec
+
+    async def generate(self, client, n: int) -> List[list]:
+        """Generate the arguments for the next ``n`` iterations"""
+        providers = []
+        for i, source in enumerate(self.sources):
+            kind, spec = next(iter(source.items()))
+            provider = self._ranges.get(i)
+            if provider is None:
+                provider = await SOURCES[kind](client, self._resolve(kind, spec), n)
+                if kind == 'range':
+                    self._ranges[i] = provider
+            providers.append(provider)
+        return [[provider() for provider in providers] for _ in range(n)]
+
+
+class ArgsFile:
+    """Reads the arguments of each iteration from a file.
+
+    Each line of the file contains the arguments of one iteration as JSON
+    array. If there are fewer lines than iterations, they're repeated.
+    Each call of ``generate`` continues after the lines read by the previous
+    one, starting over once the end of the file is reached.
+    """
+
+    def __init__(self, path: str, worker: Optional[Tuple[int, int]] = None):
+        self.path = path
+        self.worker = worker
+        self._offset = 0
+
+    def for_worker(self, index: int, count: int) -> 'ArgsFile':
+        """Return the file for worker ``index`` of ``count`` processes.
+
+        Each worker reads every ``count``-th line. Workers without lines of
+        their own (the file is too short) read all lines.
+        """
+        return ArgsFile(self.path, (index, count))
+
+    def _read(self, start, stop):
+        lines = (line for line in get_lines(self.path) if line.strip())
+        if self.worker:
+            index, count = self.worker
+            lines = itertools.islice(lines, index, None, count)
+        return [json.loads(line) for line in itertools.islice(lines, start, stop)]
+
+    async def generate(self, client, n: int) -> List[list]:
+        """Read the arguments of up to ``n`` iterations"""
+        start = self._offset
+        args = self._read(start, start + n)
+        self._offset += len(args)
+        if len(args) < n and start:
+            # Start over, without repeating lines within the buffer
+            head = self._read(0, min(n - len(args), start))
+            args += head
+            self._offset = len(head)
+        if not args:
+            if self.worker:
+                self.worker = None
+                return await self.generate(client, n)
+            raise ValueError(f'Arguments file "{self.path}" is empty')
+        return args
+
+
+def from_spec(spec: Dict[str, Any], base_dir: Optional[str] = None):
+    """Create the argument source of a query or mix entry of a spec, if any
+
+    >>> from_spec({'args_file': 'args.json'}, 'specs').path
+    'specs/args.json'
+    >>> from_spec({'args': [1]})
+    """
+    sources = spec.get('arg_sources')
+    args_file = spec.get('args_file')
+    if sources and args_file:
+        raise ValueError('Only one of `arg_sources` and `args_file` can be used')
+    if sources:
+        return ArgSources(sources, base_dir)
+    if args_file:
+        if base_dir and not args_file.startswith(('http://', 'https://')):
+            args_file = os.path.join(base_dir, args_file)
+        return ArgsFile(args_file)
+    return None
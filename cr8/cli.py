@@ -25,6 +25,17 @@ def to_int(s: str) -> int:
         return int(ast.literal_eval(s))
 
 
+def to_list(convert):
+    """Create a function that converts a comma separated string to a list
+
+    >>> to_list(to_int)('1,2, 1e3')
+    [1, 2, 1000]
+    """
+    def to_list_of(s: str) -> list:
+        return [convert(i.strip()) for i in s.split(',') if i.strip()]
+    return to_list_of
+
+
 def lines_from_stdin(default=None):
     if sys.stdin.isatty():
         if default:
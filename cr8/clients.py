@@ -1,15 +1,21 @@
 import json
+import re
+import gzip
+import zlib
 
 import aiohttp
 import itertools
-import calendar
 import types
 import time
 import contextlib
+import functools
+import logging
+from collections import OrderedDict, Counter
 from urllib.parse import urlparse, parse_qs, urlunparse
 from datetime import datetime, date
-from typing import List, Union, Iterable, Dict, Optional, Any
+from typing import List, Union, Iterable, Dict, Optional, Any, Callable, Tuple
 from decimal import Decimal
+from cr8 import aio
 from cr8.aio import asyncio  # import via aio for uvloop setup
 
 try:
@@ -17,35 +23,177 @@ try:
 except ImportError:
     asyncpg = None  # type: ignore
 
+log = logging.getLogger(__name__)
+
 try:
-    import simdjson  # type: ignore
-    dumps = simdjson.dumps
+    import orjson
 except ImportError:
-    dumps = json.dumps
+    orjson = None
 
 
 HTTP_DEFAULT_HDRS = {'Content-Type': 'application/json'}
 
+# Content-Encoding → function used to compress request bodies
+compressors = {
+    'gzip': functools.partial(gzip.compress, compresslevel=6),
+    'deflate': zlib.compress,
+}
+
+# Size of the start and end of a response that is kept if rows are discarded
+_SUMMARY_WINDOW = 1024
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+
+
+def _datetime_to_millis(o: datetime) -> int:
+    """Convert a datetime to milliseconds since epoch, ignoring the timezone.
+
+    >>> _datetime_to_millis(datetime(2017, 1, 26, 23, 33, 1))
+    1485473581000
+    """
+    if o.tzinfo is not None:
+        o = o.replace(tzinfo=None)
+    return int((o - EPOCH).total_seconds() * 1000)
+
+
+def _date_to_millis(o: date) -> int:
+    """Convert a date to milliseconds since epoch
+
+    >>> _date_to_millis(date(2017, 1, 26))
+    1485388800000
+
+    >>> _date_to_millis(date(1969, 12, 31))
+    -86400000
+    """
+    return (o.toordinal() - _EPOCH_ORDINAL) * 86400000
+
+
+# Conversions for types that aren't natively JSON serializable.
+# Extend it using `register_type`
+type_conversions: Dict[type, Callable[[Any], Any]] = {
+    Decimal: str,
+    datetime: _datetime_to_millis,
+    date: _date_to_millis,
+}
+
+
+def register_type(type_: type, conversion: Callable[[Any], Any]):
+    """Register a function that converts values of ``type_`` to a JSON type"""
+    type_conversions[type_] = conversion
+
+
+def _convert(o):
+    """Convert `o` using the conversion registered for its type.
+
+    Conversions of parent types are used for subclasses.
+
+    >>> _convert(Decimal('1.2'))
+    '1.2'
+
+    >>> _convert(object())
+    Traceback (most recent call last):
+        ...
+    TypeError: Object of type object is not JSON serializable
+    """
+    conversion = type_conversions.get(type(o))
+    if conversion:
+        return conversion(o)
+    for cls in type(o).__mro__[1:]:
+        conversion = type_conversions.get(cls)
+        if conversion:
+            return conversion(o)
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
 
 class CrateJsonEncoder(json.JSONEncoder):
 
-    epoch = datetime(1970, 1, 1)
+    epoch = EPOCH
 
     def default(self, o):
-        if isinstance(o, Decimal):
-            return str(o)
-        if isinstance(o, datetime):
-            delta = o.replace(tzinfo=None) - self.epoch
-            return int(delta.total_seconds() * 1000)
-        if isinstance(o, date):
-            return calendar.timegm(o.timetuple()) * 1000
-        return json.JSONEncoder.default(self, o)
+        try:
+            return _convert(o)
+        except TypeError:
+            return json.JSONEncoder.default(self, o)
+
+
+class StdlibEncoder:
+    """Encodes payloads using the C accelerated encoder of the json module.
+
+    Output is identical to ``json.dumps(payload, cls=CrateJsonEncoder)``
+    """
+
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(check_circular=False, default=_convert)
+
+    def encode(self, payload) -> bytes:
+        return self._encoder.encode(payload).encode('utf-8')
+
+
+class OrjsonEncoder:
+    """Encodes payloads using orjson.
+
+    The output is compact (no whitespace between separators) but otherwise
+    equivalent to the output of `StdlibEncoder`.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        if not orjson:
+            raise ValueError('Cannot use the "orjson" encoder if orjson is not available')
+        self._option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def encode(self, payload) -> bytes:
+        return orjson.dumps(payload, default=_convert, option=self._option)
+
+
+json_encoders = {
+    StdlibEncoder.name: StdlibEncoder,
+    OrjsonEncoder.name: OrjsonEncoder,
+}
+
+
+def get_json_encoder(name: Optional[str] = None):
+    """Return an instance of the JSON encoder with the given name
+
+    >>> get_json_encoder().name
+    'json'
+
+    >>> get_json_encoder('msgpack')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid json_encoder: msgpack. Must be one of: json, orjson
+    """
+    name = name or StdlibEncoder.name
+    encoder = json_encoders.get(name)
+    if not encoder:
+        raise ValueError(
+            f'Invalid json_encoder: {name}. Must be one of: ' + ', '.join(json_encoders))
+    return encoder()
 
 
 class SqlException(Exception):
 
-    def __init__(self, message):
+    def __init__(self, message, status=None):
         self.message = message
+        self.status = status
+
+    @property
+    def category(self):
+        """``rejected`` if the server rejected the request due to load, else ``sql``
+
+        >>> SqlException('Table unknown', 404).category
+        'sql'
+        >>> SqlException('EsRejectedExecutionException[...]', 500).category
+        'rejected'
+        """
+        if self.status in (429, 503) or 'RejectedExecution' in str(self.message):
+            return 'rejected'
+        return 'sql'
 
 
 client_errors = [
@@ -89,21 +237,94 @@ def _to_http_hosts(hosts: Union[Iterable[str], str]) -> List[str]:
     return [_to_http_uri(i) for i in hosts]
 
 
-async def _exec(session, url, data):
+def _as_str(data: Union[str, bytes]) -> str:
+    if isinstance(data, bytes):
+        return data.decode('utf-8')
+    return data
+
+
+def _decompress(data: bytes) -> bytes:
+    # wbits=47 detects both gzip and zlib headers
+    return zlib.decompress(data, wbits=47)
+
+
+_NO_TIMEOUT = aiohttp.ClientTimeout(total=None)
+
+
+async def _exec(session, url, data, headers=HTTP_DEFAULT_HDRS, timeout=_NO_TIMEOUT):
     async with session.post(url,
                             data=data,
-                            headers=HTTP_DEFAULT_HDRS,
-                            timeout=None) as resp:
+                            headers=headers,
+                            timeout=timeout) as resp:
         if resp.status == 401:
             t = await resp.text()
-            raise SqlException(t)
+            raise SqlException(t, resp.status)
         r = await resp.json()
         if 'error' in r:
+            if 'Content-Encoding' in headers:
+                data = _decompress(data)
             raise SqlException(
-                r['error']['message'] + ' occurred using: ' + str(data))
+                r['error']['message'] + ' occurred using: ' + _as_str(data),
+                resp.status)
         return r
 
 
+_ROWCOUNT_RE = re.compile(rb'"rowcount"\s*:\s*(-?\d+)')
+_DURATION_RE = re.compile(rb'"duration"\s*:\s*(-?[0-9.eE+-]+)')
+
+
+def _parse_summary(head: bytes, tail: bytes) -> Dict[str, Any]:
+    """Extract rowcount and duration from the start and end of a response
+
+    The matches closest to the end win, because rows may contain objects
+    with the same keys.
+
+    >>> _parse_summary(b'{"cols":["x"],"rows":[[{"rowcount":4}]', b'],"rowcount":1,"duration":0.53}')
+    {'duration': 0.53, 'rowcount': 1}
+    """
+    result: Dict[str, Any] = {}
+    for key, regex, convert in (('duration', _DURATION_RE, float),
+                                ('rowcount', _ROWCOUNT_RE, int)):
+        for part in (tail, head):
+            matches = regex.findall(part)
+            if matches:
+                result[key] = convert(matches[-1])
+                break
+    return result
+
+
+async def _exec_discard_rows(session, url, data, timeout=_NO_TIMEOUT):
+    """Like `_exec`, but streams the response and discards the rows.
+
+    Only ``duration``, ``rowcount`` and errors are extracted. If the
+    ``duration`` can't be found, the duration measured by the client is used
+    instead and ``server_duration`` is None.
+    """
+    start = time.perf_counter()
+    async with session.post(url,
+                            data=data,
+                            headers=HTTP_DEFAULT_HDRS,
+                            timeout=timeout) as resp:
+        if resp.status >= 400:
+            t = await resp.text()
+            try:
+                message = json.loads(t)['error']['message']
+            except (ValueError, KeyError, TypeError):
+                raise SqlException(t, resp.status)
+            raise SqlException(message + ' occurred using: ' + _as_str(data), resp.status)
+        head = b''
+        tail = b''
+        async for chunk in resp.content.iter_chunked(_STREAM_CHUNK_SIZE):
+            if len(head) < _SUMMARY_WINDOW:
+                head += chunk[:_SUMMARY_WINDOW - len(head)]
+            tail = (tail + chunk[-_SUMMARY_WINDOW:])[-_SUMMARY_WINDOW:]
+        result = _parse_summary(head, tail)
+        if 'duration' not in result:
+            result['duration'] = (time.perf_counter() - start) * 1000.
+            result['server_duration'] = None
+        return result
+
+
 def _plain_or_callable(obj):
     """Returns the value of the called object of obj is a callable,
     otherwise the plain object.
@@ -138,6 +359,68 @@ def _plain_or_callable(obj):
         return obj
 
 
+def _is_dynamic(obj) -> bool:
+    """Returns True if obj is a callable or generator, see `_plain_or_callable`
+
+    >>> _is_dynamic('select 1')
+    False
+
+    >>> _is_dynamic(lambda: [1])
+    True
+    """
+    return callable(obj) or isinstance(obj, types.GeneratorType)
+
+
+def _timed_encode(encode, stmt, args):
+    """Return the encoded payload and the time it took to encode it in ms"""
+    start = time.perf_counter()
+    data = encode(stmt, args)
+    return data, (time.perf_counter() - start) * 1000.
+
+
+class _PayloadCache:
+    """LRU cache for request payloads encoded as bytes.
+
+    Entries are keyed by the statement and the identity of the arguments, so
+    arguments must not be mutated after they've been passed to a client.
+
+    If the statement or arguments are callables or generators the payload is
+    encoded on every call.
+
+    `get` returns the payload and the time it took to encode it in ms, or
+    None if the payload was cached.
+
+    >>> cache = _PayloadCache(lambda stmt, args: f'{stmt}:{args}'.encode())
+    >>> args = [1, 2]
+    >>> cache.get('select ?', args)  # doctest: +ELLIPSIS
+    (b'select ?:[1, 2]', ...)
+    >>> cache.get('select ?', args)
+    (b'select ?:[1, 2]', None)
+    >>> cache.get('select ?', lambda: [3])  # doctest: +ELLIPSIS
+    (b'select ?:[3]', ...)
+    """
+
+    def __init__(self, encode, maxsize=16):
+        self.encode = encode
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, stmt, args):
+        if _is_dynamic(stmt) or _is_dynamic(args):
+            return _timed_encode(
+                self.encode, _plain_or_callable(stmt), _plain_or_callable(args))
+        key = (stmt, id(args))
+        entry = self._entries.get(key)
+        if entry and entry[0] is args:
+            self._entries.move_to_end(key)
+            return entry[1], None
+        data, encode_duration = _timed_encode(self.encode, stmt, args)
+        self._entries[key] = (args, data)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return data, encode_duration
+
+
 def _date_or_none(d: str) -> Optional[str]:
     """Return a date as if, if valid, otherwise None
 
@@ -217,13 +500,147 @@ def _verify_ssl_from_first(hosts: List[str]) -> bool:
     return True
 
 
+def _rowcount_from_status(status: str) -> int:
+    """Parse the rowcount from a command status tag
+
+    >>> _rowcount_from_status('SELECT 3')
+    3
+
+    >>> _rowcount_from_status('INSERT 0 1')
+    1
+
+    >>> _rowcount_from_status('SET')
+    -1
+    """
+    last = status.rsplit(' ', 1)[-1]
+    return int(last) if last.isdigit() else -1
+
+
+_IDENT = r'"(?:[^"]|"")+"|[A-Za-z_][\w$]*'
+_INSERT_RE = re.compile(
+    r'^\s*insert\s+into\s+'
+    rf'(?:(?P<schema>{_IDENT})\s*\.\s*)?(?P<table>{_IDENT})\s*'
+    rf'\((?P<columns>\s*(?:{_IDENT})(?:\s*,\s*(?:{_IDENT}))*)\s*\)\s*'
+    r'values\s*\((?P<params>\s*\$\d+(?:\s*,\s*\$\d+)*)\s*\)\s*;?\s*$',
+    re.IGNORECASE
+)
+
+
+def _unquote_ident(ident: str) -> str:
+    if ident.startswith('"'):
+        return ident[1:-1].replace('""', '"')
+    return ident.lower()
+
+
+@functools.lru_cache(maxsize=16)
+def _copy_target(stmt: str) -> Optional[Tuple[Optional[str], str, List[str]]]:
+    """Parse schema, table and columns from a plain insert statement.
+
+    Returns None unless the statement only inserts positional parameters in
+    order, so that it can be replaced by a COPY.
+
+    >>> _copy_target('insert into "doc"."Foo" ("name", id) values ($1, $2)')
+    ('doc', 'Foo', ['name', 'id'])
+
+    >>> _copy_target('INSERT INTO t ("x") VALUES ($1)')
+    (None, 't', ['x'])
+
+    >>> _copy_target('insert into t (x) values ($1) on conflict do nothing')
+    >>> _copy_target('insert into t (x, y) values ($2, $1)')
+    >>> _copy_target('insert into t (x) (select 1)')
+    """
+    m = _INSERT_RE.match(stmt)
+    if not m:
+        return None
+    params = [p.strip() for p in m.group('params').split(',')]
+    columns = re.findall(_IDENT, m.group('columns'))
+    if params != [f'${i + 1}' for i in range(len(columns))]:
+        return None
+    schema = m.group('schema')
+    return (
+        schema and _unquote_ident(schema),
+        _unquote_ident(m.group('table')),
+        [_unquote_ident(c) for c in columns]
+    )
+
+
+async def _is_cratedb(conn) -> bool:
+    try:
+        await conn.fetchval('select 1 from sys.nodes limit 1')
+        return True
+    except asyncpg.exceptions.UndefinedTableError:
+        return False
+
+
+class _PreparedStatementCache:
+    """LRU cache of prepared statements of a single connection.
+
+    Hits and misses are counted in the shared ``counter``.
+    """
+
+    def __init__(self, conn, counter: Counter, maxsize=100):
+        self.conn = conn
+        self.counter = counter
+        self.maxsize = maxsize
+        self._statements: OrderedDict = OrderedDict()
+
+    async def get(self, stmt):
+        prepared_stmt = self._statements.get(stmt)
+        if prepared_stmt:
+            self.counter['hits'] += 1
+            self._statements.move_to_end(stmt)
+            return prepared_stmt
+        self.counter['misses'] += 1
+        prepared_stmt = await self.conn.prepare(stmt)
+        self._statements[stmt] = prepared_stmt
+        if len(self._statements) > self.maxsize:
+            self._statements.popitem(last=False)
+        return prepared_stmt
+
+
 class AsyncpgClient:
-    def __init__(self, hosts, pool_size=25, session_settings=None):
+    """Client using the PostgreSQL wire protocol.
+
+    ``prepare`` controls how statements are prepared:
+
+    - None: asyncpg's implicit statement cache is used
+    - 'always': statements are prepared explicitly and kept in a LRU cache
+      per connection. Hits and misses are counted in ``prepared_statements``.
+      Prepared statements become invalid once a connection is released to
+      the pool, so connections are kept acquired until the client is closed.
+    - 'never': statements are parsed and described on every execution
+
+    ``timeout`` is the deadline for a single request in seconds. Requests
+    exceeding it are cancelled and raise ``asyncio.TimeoutError``.
+    """
+
+    def __init__(self,
+                 hosts,
+                 pool_size=25,
+                 session_settings=None,
+                 lazy_pool=False,
+                 discard_rows=False,
+                 prepare=None,
+                 statement_cache_size=100,
+                 timeout=None):
+        if prepare not in (None, 'always', 'never'):
+            raise ValueError(f'Invalid prepare mode: {prepare}')
         self.dsn = _to_dsn(hosts)
         self.pool_size = pool_size
+        self.lazy_pool = lazy_pool
+        self.discard_rows = discard_rows
+        self.prepare = prepare
+        self.statement_cache_size = statement_cache_size
+        self.timeout = timeout
+        self.prepared_statements: Counter = Counter(hits=0, misses=0)
+        self._statement_caches: Dict[Any, _PreparedStatementCache] = {}
+        # Idle connections held by the client, or None for a free slot
+        self._held_connections: asyncio.Queue = asyncio.Queue()
+        self._num_slots = 0
         self._pool = None
         self.is_cratedb = True
         self.session_settings = session_settings or {}
+        self.pool_setup_duration = 0.0
 
     async def _get_pool(self):
 
@@ -232,40 +649,118 @@ class AsyncpgClient:
                 await conn.execute(f'set {setting}={value}')
 
         if not self._pool:
+            start = time.perf_counter()
             self._pool = await asyncpg.create_pool(
                 self.dsn,
-                min_size=self.pool_size,
+                min_size=0 if self.lazy_pool else self.pool_size,
                 max_size=self.pool_size,
-                init=set_session_settings
+                init=set_session_settings,
+                statement_cache_size=0 if self.prepare == 'never' else self.statement_cache_size
             )
+            async with self._pool.acquire() as conn:
+                self.is_cratedb = await _is_cratedb(conn)
+            self.pool_setup_duration += (time.perf_counter() - start) * 1000.
         return self._pool
 
+    async def connect(self):
+        """Establish the connection pool.
+
+        The time it took is added to ``pool_setup_duration`` (in ms).
+        """
+        await self._get_pool()
+
+    @contextlib.asynccontextmanager
+    async def _acquire(self):
+        pool = await self._get_pool()
+        if self.prepare != 'always':
+            async with pool.acquire() as conn:
+                yield conn
+            return
+        held = self._held_connections
+        if held.empty() and self._num_slots < self.pool_size:
+            # Reserve the slot before awaiting so that concurrent callers
+            # can't exceed the pool size
+            self._num_slots += 1
+            conn = None
+        else:
+            conn = await held.get()
+        if conn is None:
+            try:
+                conn = await pool.acquire()
+            except BaseException:
+                held.put_nowait(None)
+                raise
+            self._statement_caches[conn] = _PreparedStatementCache(
+                conn, self.prepared_statements, self.statement_cache_size)
+        try:
+            yield conn
+        finally:
+            if conn.is_closed():
+                del self._statement_caches[conn]
+                held.put_nowait(None)
+                await pool.release(conn)
+            else:
+                held.put_nowait(conn)
+
     async def execute(self, stmt, args=None):
         start = time.perf_counter()
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
-            if args:
-                rows = await conn.fetch(stmt, *args)
+        async with self._acquire() as conn:
+            if self.prepare == 'always':
+                prepared_stmt = await self._statement_caches[conn].get(stmt)
+                rows = await prepared_stmt.fetch(*(args or ()), timeout=self.timeout)
+            elif self.discard_rows:
+                # execute doesn't return rows and doesn't decode them using
+                # the simple query protocol (if there are no args)
+                status = await conn.execute(stmt, *(args or ()), timeout=self.timeout)
+                return {
+                    'duration': (time.perf_counter() - start) * 1000.,
+                    # Not available via the PostgreSQL protocol
+                    'server_duration': None,
+                    'rowcount': _rowcount_from_status(status)
+                }
             else:
-                rows = await conn.fetch(stmt)
+                rows = await conn.fetch(stmt, *(args or ()), timeout=self.timeout)
+            duration = (time.perf_counter() - start) * 1000.
+            if self.discard_rows:
+                return {
+                    'duration': duration,
+                    'server_duration': None,
+                    'rowcount': len(rows)
+                }
             return {
-                'duration': (time.perf_counter() - start) * 1000.,
+                'duration': duration,
+                'server_duration': None,
                 'rows': rows
             }
 
     async def execute_many(self, stmt, bulk_args):
         start = time.perf_counter()
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
-            await conn.executemany(stmt, bulk_args)
+        await self._get_pool()
+        copy_target = None if self.is_cratedb else _copy_target(stmt)
+        async with self._acquire() as conn:
+            if copy_target:
+                # COPY is a lot faster than executemany on PostgreSQL
+                schema, table, columns = copy_target
+                await conn.copy_records_to_table(
+                    table,
+                    records=bulk_args,
+                    columns=columns,
+                    schema_name=schema,
+                    timeout=self.timeout
+                )
+            elif self.prepare == 'always':
+                prepared_stmt = await self._statement_caches[conn].get(stmt)
+                await prepared_stmt.executemany(bulk_args, timeout=self.timeout)
+            else:
+                await conn.executemany(stmt, bulk_args, timeout=self.timeout)
             return {
                 'duration': (time.perf_counter() - start) * 1000.,
+                'server_duration': None,
                 'rows': []
             }
 
     async def get_server_version(self):
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             try:
                 for (version,) in await conn.fetch('select version from sys.nodes'):
                     version = json.loads(version)
@@ -283,6 +778,13 @@ class AsyncpgClient:
 
     async def _close_pool(self):
         if self._pool:
+            held = self._held_connections
+            while not held.empty():
+                conn = held.get_nowait()
+                if conn is not None:
+                    await self._pool.release(conn)
+            self._num_slots = 0
+            self._statement_caches.clear()
             await self._pool.close()
             self._pool = None
 
@@ -316,73 +818,476 @@ def _append_sql(host: str) -> str:
     return urlunparse(tuple(p))
 
 
+class RoundRobin:
+    """Host selection that cycles through the urls
+
+    >>> rr = RoundRobin(['n1', 'n2'])
+    >>> [rr.acquire() for _ in range(3)]
+    ['n1', 'n2', 'n1']
+    """
+
+    name = 'round-robin'
+
+    def __init__(self, urls: List[str]):
+        self.urls = urls
+        self._urls = itertools.cycle(urls)
+
+    def acquire(self) -> str:
+        return next(self._urls)
+
+    def release(self, url: str, connection_error=False):
+        pass
+
+    def set_urls(self, urls: List[str]):
+        self.urls = urls
+        self._urls = itertools.cycle(urls)
+
+
+class LeastOutstanding:
+    """Host selection that picks the url with the fewest in-flight requests.
+
+    Urls that had a connection error are ejected for ``backoff`` seconds,
+    doubling with each consecutive error up to ``max_backoff``. If all urls
+    are ejected they're used regardless. Ties are broken round-robin.
+
+    >>> lo = LeastOutstanding(['n1', 'n2', 'n3'])
+    >>> lo.acquire(), lo.acquire()
+    ('n1', 'n2')
+    >>> lo.release('n1')
+    >>> lo.acquire()
+    'n3'
+    >>> lo.acquire()
+    'n1'
+
+    >>> lo = LeastOutstanding(['n1', 'n2'])
+    >>> lo.release(lo.acquire(), connection_error=True)
+    >>> lo.acquire(), lo.acquire()
+    ('n2', 'n2')
+    """
+
+    name = 'least-outstanding'
+
+    def __init__(self, urls: List[str], backoff=1.0, max_backoff=30.0):
+        self.urls = urls
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_flight = {url: 0 for url in urls}
+        self._failures: Dict[str, int] = {}
+        self._ejected_until: Dict[str, float] = {}
+        self._next = 0
+
+    def _is_available(self, url, now):
+        ejected_until = self._ejected_until.get(url)
+        return ejected_until is None or ejected_until <= now
+
+    def acquire(self) -> str:
+        urls = self.urls
+        num_urls = len(urls)
+        start = self._next
+        self._next = (start + 1) % num_urls
+        now = time.monotonic()
+        in_flight = self.in_flight
+        best = None
+        for i in range(num_urls):
+            url = urls[(start + i) % num_urls]
+            if not self._is_available(url, now):
+                continue
+            if best is None or in_flight[url] < in_flight[best]:
+                best = url
+        if best is None:
+            best = min(urls, key=in_flight.__getitem__)
+        in_flight[best] += 1
+        return best
+
+    def eject(self, url: str):
+        failures = self._failures[url] = self._failures.get(url, 0) + 1
+        backoff = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+        self._ejected_until[url] = time.monotonic() + backoff
+
+    def release(self, url: str, connection_error=False):
+        self.in_flight[url] -= 1
+        if connection_error:
+            self.eject(url)
+        elif url in self._failures:
+            del self._failures[url]
+            del self._ejected_until[url]
+
+    def set_urls(self, urls: List[str]):
+        # Keep counters of removed urls, requests to them may be in-flight
+        for url in urls:
+            self.in_flight.setdefault(url, 0)
+        self.urls = urls
+        self._next = 0
+
+
+load_balancers = {
+    RoundRobin.name: RoundRobin,
+    LeastOutstanding.name: LeastOutstanding,
+}
+
+
+class _SessionPool:
+    """Pool of sessions to a single `/_sql` endpoint.
+
+    Each session is backed by a connector with a limit of 1 connection, so
+    that session settings apply to every request made via the session.
+
+    If ``lazy`` is False ``fill`` opens all sessions concurrently, otherwise
+    sessions are created on demand until ``size`` is reached. If ``fill``
+    fails, all sessions are closed and ``acquire`` raises the error.
+
+    Sessions which are discarded after a failed `release` with ``reopen``
+    are replaced on demand as well.
+    """
+
+    def __init__(self,
+                 url,
+                 size,
+                 connector_params,
+                 session_settings,
+                 encoder,
+                 lazy=False):
+        self.url = url
+        self.size = size
+        self.encoder = encoder
+        self.lazy = lazy
+        self.connector_params = connector_params
+        self.session_settings = session_settings
+        self.sessions: List[aiohttp.ClientSession] = []
+        self.idle: asyncio.Queue = asyncio.Queue()
+        self.error: Optional[BaseException] = None
+        self.filled = False
+
+    async def _open(self, session):
+        if not self.session_settings:
+            # Send a request to establish the connection up-front
+            urlparts = urlparse(self.url)
+            url = urlunparse((urlparts.scheme, urlparts.netloc, '/', '', '', ''))
+            async with session.get(url) as resp:
+                await resp.read()
+            return
+        for setting, value in self.session_settings.items():
+            payload = {'stmt': f'set {setting}={value}'}
+            await _exec(session, self.url, self.encoder.encode(payload))
+
+    async def _create_session(self, establish=True):
+        tcp_connector = aiohttp.TCPConnector(**self.connector_params)
+        session = aiohttp.ClientSession(connector=tcp_connector)
+        self.sessions.append(session)
+        if establish or self.session_settings:
+            try:
+                await self._open(session)
+            except Exception:
+                self.sessions.remove(session)
+                await session.close()
+                raise
+        return session
+
+    async def fill(self):
+        num_missing = self.size - len(self.sessions)
+        results = await asyncio.gather(
+            *(self._create_session() for _ in range(num_missing)),
+            return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            await self.close()
+            self.error = errors[0]
+            # Wakes up callers waiting in acquire
+            self.idle.put_nowait(None)
+            raise self.error
+        for session in results:
+            self.idle.put_nowait(session)
+        self.filled = True
+
+    async def acquire(self):
+        can_grow = self.lazy or self.filled
+        if can_grow and self.idle.empty() and len(self.sessions) < self.size:
+            return await self._create_session(establish=not self.lazy)
+        session = await self.idle.get()
+        if session is None:
+            self.idle.put_nowait(None)
+            raise self.error
+        return session
+
+    def release(self, session, reopen=False):
+        """Return a session to the pool.
+
+        ``reopen`` is used if a request was aborted, which closes the
+        connection. Session settings are applied again before the session
+        becomes available. If that fails, the session is closed and
+        discarded.
+        """
+        if reopen and self.session_settings:
+            asyncio.ensure_future(self._reopen(session))
+        else:
+            self.idle.put_nowait(session)
+
+    async def _reopen(self, session):
+        try:
+            await self._open(session)
+        except Exception:
+            # Without its settings the session must not be used again
+            if session in self.sessions:
+                self.sessions.remove(session)
+            await session.close()
+        else:
+            self.idle.put_nowait(session)
+
+    async def close(self):
+        sessions = self.sessions
+        self.sessions = []
+        for session in sessions:
+            await session.close()
+
+
+def _node_url(url, endpoint):
+    """Return the `/_sql` url of ``endpoint`` with the scheme, credentials and
+    query of ``url``
+
+    >>> _node_url('https://crate:secret@n1:4200/_sql?verify_ssl=false', 'n2:4200')
+    'https://crate:secret@n2:4200/_sql?verify_ssl=false'
+    >>> _node_url('http://n1:4200/_sql', 'n2:4200')
+    'http://n2:4200/_sql'
+    """
+    parts = urlparse(url)
+    userinfo, _, _ = parts.netloc.rpartition('@')
+    netloc = f'{userinfo}@{endpoint}' if userinfo else endpoint
+    return urlunparse((parts.scheme, netloc, '/_sql', '', parts.query, ''))
+
+
+async def _sniff_urls(session, url, timeout=_NO_TIMEOUT) -> List[str]:
+    """Return the `/_sql` urls of all nodes with an HTTP endpoint.
+
+    The scheme, credentials and query of ``url`` are used for the discovered
+    nodes.
+    """
+    payload = json.dumps({'stmt': 'select http_endpoint from sys.nodes'})
+    result = await _exec(session, url, payload.encode('utf-8'), timeout=timeout)
+    endpoints = sorted(row[0] for row in result['rows'] if row[0])
+    return [_node_url(url, endpoint) for endpoint in endpoints]
+
+
 class HttpClient:
+    """Client using the HTTP endpoint of CrateDB.
+
+    If ``sniff_interval`` is set the nodes of the cluster are discovered via
+    ``sys.nodes`` and requests are spread across all of them instead of only
+    the given ``hosts``. The nodes are discovered again in the background
+    every ``sniff_interval`` seconds.
+
+    ``compression`` can be one of ``compressors`` to compress the bodies of
+    ``execute_many`` requests. Compression runs in the default executor of
+    the event loop.
+
+    ``timeout`` is the deadline for a single request in seconds. Requests
+    exceeding it are aborted and raise ``asyncio.TimeoutError``.
+
+    With ``load_balancing='least-outstanding'`` hosts which can't be reached
+    are ejected instead of failing ``connect``, as long as one host is
+    reachable. The connection pool of an ejected host is dropped and
+    re-created once the host is used again.
+    """
+
     def __init__(self,
                  hosts: List[str],
                  conn_pool_limit=25,
-                 session_settings: Optional[Dict[str, Any]] = None):
+                 session_settings: Optional[Dict[str, Any]] = None,
+                 lazy_pool=False,
+                 json_encoder: Optional[str] = None,
+                 discard_rows=False,
+                 load_balancing: Optional[str] = None,
+                 sniff_interval: Optional[float] = None,
+                 compression: Optional[str] = None,
+                 timeout: Optional[float] = None):
         self.hosts = hosts
-        self.urls = itertools.cycle(list(map(_append_sql, hosts)))
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        if compression and compression not in compressors:
+            raise ValueError(f'Invalid compression: {compression}')
+        self.compression = compression
+        self._compressed_hdrs = {**HTTP_DEFAULT_HDRS, 'Content-Encoding': compression}
+        self.discard_rows = discard_rows
+        load_balancer = load_balancers.get(load_balancing or RoundRobin.name)
+        if not load_balancer:
+            raise ValueError(f'Invalid load_balancing: {load_balancing}')
+        self.load_balancer = load_balancer(list(map(_append_sql, hosts)))
         self.conn_pool_limit = conn_pool_limit
+        self.lazy_pool = lazy_pool
         self.is_cratedb = True
-        self._pools: Dict[str, asyncio.Queue] = {}
+        self._pools: Dict[str, _SessionPool] = {}
+        # Pools of ejected hosts; requests may still use them until they fail
+        self._dropped_pools: List[_SessionPool] = []
         self.session_settings = session_settings or {}
+        self.pool_setup_duration = 0.0
+        self.encoder = get_json_encoder(json_encoder)
+        # Bulk requests usually differ on each call, so only statements are cached
+        self._payloads = _PayloadCache(self._encode_stmt)
+        self.sniff_interval = sniff_interval
+        self._next_sniff = 0.0
+        self._sniff_task: Optional[asyncio.Future] = None
+
+    def _encode_stmt(self, stmt, args) -> bytes:
+        payload = {'stmt': stmt}
+        if args:
+            payload['args'] = args
+        return self.encoder.encode(payload)
 
-    @contextlib.asynccontextmanager
-    async def _session(self, url):
-        pool = self._pools.get(url)
-        if not pool:
-            pool = asyncio.Queue(maxsize=self.conn_pool_limit)
+    def _encode_bulk_stmt(self, stmt, bulk_args) -> bytes:
+        return self.encoder.encode({'stmt': stmt, 'bulk_args': bulk_args})
+
+    async def _connect(self, urls) -> Dict[str, BaseException]:
+        """Create the pools for ``urls`` and return the errors of failed ones."""
+        start = time.perf_counter()
+        pools = []
+        for url in urls:
+            pool = _SessionPool(
+                url,
+                self.conn_pool_limit,
+                {'limit': 1, 'verify_ssl': _verify_ssl_from_first(self.hosts)},
+                self.session_settings,
+                self.encoder,
+                lazy=self.lazy_pool
+            )
             self._pools[url] = pool
-            _connector_params = {
-                'limit': 1,
-                'verify_ssl': _verify_ssl_from_first(self.hosts)
-            }
-            for n in range(0, self.conn_pool_limit):
-                tcp_connector = aiohttp.TCPConnector(**_connector_params)
-                session = aiohttp.ClientSession(connector=tcp_connector)
-                for setting, value in self.session_settings.items():
-                    payload = {'stmt': f'set {setting}={value}'}
-                    await _exec(
-                        session,
-                        url,
-                        dumps(payload, cls=CrateJsonEncoder)
-                    )
-                pool.put_nowait(session)
-
-        session = await pool.get()
+            pools.append(pool)
+        errors = {}
+        if not self.lazy_pool:
+            results = await asyncio.gather(
+                *(pool.fill() for pool in pools), return_exceptions=True)
+            # Failed pools are dropped so that the next request tries again
+            for pool, result in zip(pools, results):
+                if not isinstance(result, BaseException):
+                    continue
+                errors[pool.url] = result
+                if self._pools.get(pool.url) is pool:
+                    del self._pools[pool.url]
+        self.pool_setup_duration += (time.perf_counter() - start) * 1000.
+        return errors
+
+    async def connect(self):
+        """Establish the connection pools for all hosts concurrently.
+
+        The time it took is added to ``pool_setup_duration`` (in ms).
+        """
+        if self.sniff_interval:
+            await self._sniff()
+        urls = self.load_balancer.urls
+        unique_urls = list(dict.fromkeys(urls))
+        missing = [url for url in unique_urls if url not in self._pools]
+        if not missing:
+            return
+        errors = await self._connect(missing)
+        if not errors:
+            return
+        load_balancer = self.load_balancer
+        can_eject = (
+            isinstance(load_balancer, LeastOutstanding)
+            and len(errors) < len(unique_urls)
+            and all(isinstance(e, aiohttp.ClientConnectionError) for e in errors.values())
+        )
+        if not can_eject:
+            raise next(iter(errors.values()))
+        for url in errors:
+            load_balancer.eject(url)
+
+    async def _sniff(self):
+        self._next_sniff = time.monotonic() + self.sniff_interval
+        # A discovery must not take longer than its interval
+        timeout = self.timeout
+        if timeout.total is None or timeout.total > self.sniff_interval:
+            timeout = aiohttp.ClientTimeout(total=self.sniff_interval)
+        # Any known node can answer; the seed hosts might be gone by now
+        for url in self.load_balancer.urls:
+            try:
+                async with self._session(url) as session:
+                    urls = await _sniff_urls(session, url, timeout)
+            except Exception as e:
+                # Runs in the background, nobody would see the error otherwise
+                log.warning('Discovering nodes via %s failed: %r', url, e)
+                continue
+            if urls:
+                self.load_balancer.set_urls(urls)
+            return
+
+    def _maybe_sniff(self):
+        if (time.monotonic() >= self._next_sniff
+                and (not self._sniff_task or self._sniff_task.done())):
+            self._next_sniff = time.monotonic() + self.sniff_interval
+            self._sniff_task = asyncio.ensure_future(self._sniff())
+
+    @contextlib.asynccontextmanager
+    async def _session(self, url, drop_unreachable=False):
+        if url not in self._pools:
+            errors = await self._connect([url])
+            if errors:
+                raise errors[url]
+        pool = self._pools[url]
+        session = await pool.acquire()
+        aborted = False
         try:
             yield session
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            aborted = True
+            raise
+        except aiohttp.ClientConnectionError:
+            if drop_unreachable and self._pools.get(url) is pool:
+                del self._pools[url]
+                self._dropped_pools.append(pool)
+            raise
+        finally:
+            pool.release(session, reopen=aborted)
+
+    @contextlib.asynccontextmanager
+    async def _next_session(self):
+        if self.sniff_interval:
+            self._maybe_sniff()
+        url = self.load_balancer.acquire()
+        drop_unreachable = isinstance(self.load_balancer, LeastOutstanding)
+        connection_error = False
+        try:
+            async with self._session(url, drop_unreachable) as session:
+                yield url, session
+        except aiohttp.ClientConnectionError:
+            connection_error = True
+            raise
         finally:
-            await pool.put(session)
+            self.load_balancer.release(url, connection_error)
 
     async def execute(self, stmt, args=None):
-        payload = {'stmt': _plain_or_callable(stmt)}
-        if args:
-            payload['args'] = _plain_or_callable(args)
-        url = next(self.urls)
-        async with self._session(url) as session:
-            result = await _exec(
-                session,
-                url,
-                dumps(payload, cls=CrateJsonEncoder)
-            )
+        data, encode_duration = self._payloads.get(stmt, args)
+        exec_ = _exec_discard_rows if self.discard_rows else _exec
+        async with self._next_session() as (url, session):
+            result = await exec_(session, url, data, timeout=self.timeout)
+        if encode_duration is not None:
+            result['encode_duration'] = encode_duration
         return result
 
+    async def _compress(self, data):
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        data = await loop.run_in_executor(None, compressors[self.compression], data)
+        return data, (time.perf_counter() - start) * 1000.
+
     async def execute_many(self, stmt, bulk_args):
-        data = dumps(dict(
-            stmt=_plain_or_callable(stmt),
-            bulk_args=_plain_or_callable(bulk_args)
-        ), cls=CrateJsonEncoder)
-        url = next(self.urls)
-        async with self._session(url) as session:
-            result = await _exec(session, url, data)
+        data, encode_duration = _timed_encode(
+            self._encode_bulk_stmt, _plain_or_callable(stmt), _plain_or_callable(bulk_args))
+        headers = HTTP_DEFAULT_HDRS
+        compress_duration = None
+        if self.compression:
+            data, compress_duration = await self._compress(data)
+            headers = self._compressed_hdrs
+        async with self._next_session() as (url, session):
+            result = await _exec(session, url, data, headers, self.timeout)
+        if encode_duration is not None:
+            result['encode_duration'] = encode_duration
+        if compress_duration is not None:
+            result['compress_duration'] = compress_duration
+        result['request_size'] = len(data)
         return result
 
     async def get_server_version(self):
         urlparts = urlparse(self.hosts[0])
         url = urlunparse((urlparts.scheme, urlparts.netloc, '/', '', '', ''))
-        async with self._session(url) as session:
+        async with self._session(_append_sql(self.hosts[0])) as session:
             async with session.get(url) as resp:
                 r = await resp.json()
                 version = r['version']
@@ -394,13 +1299,16 @@ class HttpClient:
                 return result
 
     async def _close(self):
-        pools = self._pools
+        sniff_task = self._sniff_task
+        if sniff_task and not sniff_task.done():
+            sniff_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await sniff_task
+        pools = list(self._pools.values()) + self._dropped_pools
         self._pools = {}
-        for url, pool in pools.items():
-            for i in range(0, self.conn_pool_limit):
-                session = await pool.get()
-                await session.close()
-        pools.clear()
+        self._dropped_pools = []
+        for pool in pools:
+            await pool.close()
 
     def close(self):
         asyncio.get_event_loop().run_until_complete(self._close())
@@ -412,10 +1320,111 @@ class HttpClient:
         self.close()
 
 
-def client(hosts, session_settings=None, concurrency=25):
+# rowcount of an entry in the bulk response if the row failed
+BULK_ROW_FAILED = -2
+
+
+class BulkRetry:
+    """Wrap ``execute_many`` to re-submit rows that failed in bulk requests.
+
+    CrateDB reports a rowcount per entry of ``bulk_args``, failed rows have a
+    rowcount of -2. These rows are re-submitted up to ``retries`` times in
+    batches half the size of the previous attempt, sleeping ``backoff``
+    seconds before the first retry and doubling it on each further attempt.
+
+    If ``stats`` are given, the first attempt is measured like `aio.measure`
+    does. The runtime of the retry requests is recorded as ``retry`` series;
+    the backoff isn't measured.
+
+    ``rows`` counts the rows that have been retried and the rows that still
+    failed after all retries.
+
+    Responses without per-row results (asyncpg) are returned as is.
+    """
+
+    def __init__(self, execute_many, retries=0, backoff=0.5, stats=None):
+        self.execute_many = execute_many
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = stats
+        self.rows: Counter = Counter(retried=0, failed=0)
+
+    @staticmethod
+    def _failed(r, bulk_args):
+        results = r and r.get('results')
+        if not results:
+            return []
+        return [args for args, result in zip(bulk_args, results)
+                if result['rowcount'] == BULK_ROW_FAILED]
+
+    async def _retry(self, stmt, bulk_args):
+        start = time.perf_counter()
+        r = await self.execute_many(stmt, bulk_args)
+        if self.stats is not None:
+            self.stats.measure_series('retry', (time.perf_counter() - start) * 1000.)
+        return self._failed(r, bulk_args)
+
+    async def __call__(self, stmt, bulk_args):
+        bulk_args = list(bulk_args)
+        if self.stats is None:
+            r = await self.execute_many(stmt, bulk_args)
+        else:
+            r = await aio.measure(self.stats, self.execute_many, stmt, bulk_args)
+        failed = self._failed(r, bulk_args)
+        batch_size = len(bulk_args)
+        for attempt in range(self.retries):
+            if not failed:
+                break
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            self.rows['retried'] += len(failed)
+            batch_size = max(1, batch_size // 2)
+            still_failed = []
+            for i in range(0, len(failed), batch_size):
+                still_failed.extend(await self._retry(stmt, failed[i:i + batch_size]))
+            failed = still_failed
+        self.rows['failed'] += len(failed)
+        return r
+
+
+def client(hosts,
+           session_settings=None,
+           concurrency=25,
+           lazy_pool=False,
+           json_encoder=None,
+           discard_rows=False,
+           prepare=None,
+           load_balancing=None,
+           sniff_interval=None,
+           compression=None,
+           timeout=None):
     hosts = hosts or 'localhost:4200'
     if hosts.startswith('asyncpg://'):
         if not asyncpg:
             raise ValueError('Cannot use "asyncpg" scheme if asyncpg is not available')
-        return AsyncpgClient(hosts, pool_size=concurrency, session_settings=session_settings)
-    return HttpClient(_to_http_hosts(hosts), conn_pool_limit=concurrency, session_settings=session_settings)
+        if sniff_interval:
+            raise ValueError('Node discovery is not supported with the "asyncpg" scheme')
+        if compression:
+            raise ValueError('Compression is not supported with the "asyncpg" scheme')
+        return AsyncpgClient(
+            hosts,
+            pool_size=concurrency,
+            session_settings=session_settings,
+            lazy_pool=lazy_pool,
+            discard_rows=discard_rows,
+            prepare=prepare,
+            timeout=timeout
+        )
+    if prepare:
+        raise ValueError('Prepared statements are only supported with the "asyncpg" scheme')
+    return HttpClient(
+        _to_http_hosts(hosts),
+        conn_pool_limit=concurrency,
+        session_settings=session_settings,
+        lazy_pool=lazy_pool,
+        json_encoder=json_encoder,
+        discard_rows=discard_rows,
+        load_balancing=load_balancing,
+        sniff_interval=sniff_interval,
+        compression=compression,
+        timeout=timeout
+    )
@@ -1,14 +1,105 @@
 import itertools
+import multiprocessing
+import pickle
+import queue
+import random
+import statistics
+import threading
 from functools import partial
 from time import time, perf_counter
-from collections import namedtuple
+from collections import namedtuple, Counter
 
 from cr8 import aio
-from cr8.metrics import Stats, get_sampler
+from cr8.aio import asyncio
+from cr8.arg_sources import buffer_size
+from cr8.cli import to_int
+from cr8.metrics import Stats, Timeline, get_sampler
 from cr8.clients import client
 
 TimedStats = namedtuple('TimedStats', ['started', 'ended', 'stats'])
 
+# A statement of a mixed workload, drawn according to its weight
+WeightedStatement = namedtuple(
+    'WeightedStatement',
+    ['stmt', 'weight', 'args', 'bulk_args', 'args_source'],
+    defaults=(1.0, None, None, None)
+)
+
+# Bounds of runs which stop once the error margin is below a target
+DEFAULT_MIN_ITERATIONS = 30
+DEFAULT_MAX_ITERATIONS = 10_000
+
+# Warmup until the median of consecutive windows of ``window`` measurements
+# changed by less than ``threshold`` ``stable_windows`` times in a row
+AutoWarmup = namedtuple(
+    'AutoWarmup',
+    ['max_iterations', 'window', 'threshold', 'stable_windows'],
+    defaults=(1000, 20, 0.05, 3)
+)
+
+
+def to_warmup(value):
+    """Convert a warmup option to a number of iterations or an `AutoWarmup`
+
+    >>> to_warmup('1_000')
+    1000
+
+    >>> to_warmup('auto')
+    AutoWarmup(max_iterations=1000, window=20, threshold=0.05, stable_windows=3)
+
+    >>> to_warmup('auto:200').max_iterations
+    200
+    """
+    if isinstance(value, (int, AutoWarmup)):
+        return value
+    mode = value.split(':')
+    if mode[0] == 'auto':
+        if len(mode) == 2:
+            return AutoWarmup(max_iterations=to_int(mode[1]))
+        return AutoWarmup()
+    return to_int(value)
+
+
+class _Convergence:
+    """Tracks if windows of measurements have stabilized
+
+    >>> c = _Convergence(AutoWarmup(window=2, threshold=0.1, stable_windows=1))
+    >>> for value in [10.0, 20.0, 5.0, 5.0]:
+    ...     c.add(value)
+    >>> c.converged
+    False
+    >>> c.add(5.0)
+    >>> c.add(5.2)
+    >>> c.converged
+    True
+    """
+
+    def __init__(self, warmup):
+        self.warmup = warmup
+        self.values = []
+        self.median = None
+        self.num_stable = 0
+
+    @property
+    def converged(self):
+        return self.num_stable >= self.warmup.stable_windows
+
+    def add(self, value):
+        self.values.append(value)
+        if len(self.values) < self.warmup.window:
+            return
+        median = statistics.median(self.values)
+        self.values = []
+        previous = self.median
+        self.median = median
+        if previous is None:
+            return
+        change = abs(median - previous) / previous if previous else abs(median)
+        if change < self.warmup.threshold:
+            self.num_stable += 1
+        else:
+            self.num_stable = 0
+
 
 class FailIf(SystemExit):
     pass
@@ -34,7 +125,12 @@ class Result:
                  concurrency,
                  meta=None,
                  bulk_size=None,
-                 name=None):
+                 name=None,
+                 pool_setup_duration=None,
+                 prepared_statements=None,
+                 rate=None,
+                 warmup_iterations=None,
+                 weight=None):
         self.version_info = version_info
         self.statement = str(statement)
         self.meta = meta and DotDict(meta) or None
@@ -44,20 +140,64 @@ class Result:
         self.concurrency = concurrency
         self.bulk_size = bulk_size
         self.name = name
+        self.pool_setup_duration = pool_setup_duration
+        self.prepared_statements = prepared_statements
+        self.rate = rate
+        self.warmup_iterations = warmup_iterations
+        # Share of the statement in a mixed workload, 1.0 for the combined result
+        self.weight = weight
+        timeline = timed_stats.stats.timeline
+        self.timeline = timeline.get() if timeline is not None else None
 
     def as_dict(self):
         return self.__dict__
 
 
-def run_and_measure(f, statements, concurrency, num_items=None, sampler=None):
-    stats = Stats(sampler)
-    measure = partial(aio.measure, stats, f)
+def run_and_measure(f,
+                    statements,
+                    concurrency,
+                    num_items=None,
+                    sampler=None,
+                    timeout=None,
+                    rate=None,
+                    timeline_interval=None,
+                    stats=None,
+                    track_failed=False,
+                    continue_on_error=False):
+    """Run ``f`` for each of ``statements`` and measure the runtime.
+
+    Failed requests are counted in the stats. After all statements ran, the
+    last error is raised, unless ``continue_on_error`` is set. Then it's
+    only raised if no request succeeded.
+    """
+    if stats is None:
+        stats = Stats(sampler)
+    stats.track_failed = track_failed
+    stats.raise_errors = not continue_on_error
+    if timeline_interval:
+        stats.timeline = Timeline(timeline_interval, sampler)
     started = int(time() * 1000)
-    aio.run_many(measure, statements, concurrency, num_items=num_items)
+    if rate:
+        measure = partial(aio.measure_from, stats, f)
+        aio.run_at_rate(
+            measure, statements, rate, num_items=num_items, timeout=timeout, stats=stats)
+    else:
+        measure = partial(aio.measure, stats, f)
+        aio.run_many(
+            measure, statements, concurrency, num_items=num_items, timeout=timeout, stats=stats)
     ended = int(time() * 1000)
+    if stats.last_error is not None and stats.sampler.count == 0:
+        raise stats.last_error
     return TimedStats(started, ended, stats)
 
 
+async def _ignore_timeouts(f, *args):
+    try:
+        return await f(*args)
+    except asyncio.TimeoutError:
+        return None
+
+
 def _generate_statements(stmt, args, iterations, duration):
     if duration is None:
         yield from itertools.repeat((stmt, args), iterations or 100)
@@ -67,25 +207,479 @@ def _generate_statements(stmt, args, iterations, duration):
             yield (stmt, args)
 
 
+def _generate_until_confident(stmt,
+                              args,
+                              stats,
+                              error_margin,
+                              min_iterations,
+                              max_iterations,
+                              duration):
+    """Generate statements until the relative error margin of ``stats`` is
+    below ``error_margin``, bounded by the iterations and ``duration``"""
+    now = perf_counter()
+    for i in itertools.count():
+        if max_iterations is not None and i >= max_iterations:
+            return
+        if i >= min_iterations and stats.relative_error_margin() <= error_margin:
+            return
+        if duration is not None and perf_counter() - now >= duration:
+            return
+        yield (stmt, args)
+
+
+def _with_args(statements, args):
+    """Replace the arguments of ``statements`` with ``args``, in a cycle
+
+    >>> list(_with_args([('s', None)] * 3, [[1], [2]]))
+    [('s', [1]), ('s', [2]), ('s', [1])]
+    """
+    for (stmt, _), item_args in zip(statements, itertools.cycle(args)):
+        yield (stmt, item_args)
+
+
+def _weighted_choices(items, weights, batch_size=256):
+    while True:
+        yield from random.choices(items, weights, k=batch_size)
+
+
+def _generate_mixed(items, weights, iterations, duration):
+    """Generate ``items`` drawn according to ``weights``
+
+    >>> items = list(_generate_mixed(['a', 'b'], [1, 0], 3, None))
+    >>> items
+    ['a', 'a', 'a']
+    """
+    choices = _weighted_choices(items, weights)
+    for _ in _generate_statements(None, None, iterations, duration):
+        yield next(choices)
+
+
+async def _measure_from(intended_start, stats, f, *args):
+    return await aio.measure_from(stats, f, intended_start, *args)
+
+
+def _split(total, n):
+    """Split ``total`` into ``n`` nearly equal parts
+
+    >>> _split(10, 3)
+    [4, 3, 3]
+    """
+    return [total // n + (1 if i < total % n else 0) for i in range(n)]
+
+
+def _run_worker(barrier, results, options, stmt, num_warmup, run_kwargs):
+    """Entry point of worker processes used by ``Runner`` if processes > 1"""
+    aio.tqdm = partial(aio.tqdm, disable=True)
+    try:
+        with Runner(**options) as runner:
+            if num_warmup:
+                runner.warmup(stmt,
+                              num_warmup,
+                              options['concurrency'],
+                              run_kwargs['args'],
+                              run_kwargs['args_source'])
+            runner.connect()
+            barrier.wait()
+            timed_stats = runner.run(stmt, **run_kwargs)
+            results.put({
+                'timed_stats': timed_stats,
+                'pool_setup_duration': runner.pool_setup_duration,
+                'prepared_statements': runner.prepared_statements,
+                'warmup_iterations': runner.warmup_iterations
+            })
+    except BaseException as e:
+        barrier.abort()
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            e = RuntimeError(f'{type(e).__name__}: {e}')
+        results.put(e)
+
+
 class Runner:
-    def __init__(self, hosts, concurrency, sample_mode, session_settings=None):
+    """Runs statements and measures their runtime.
+
+    If ``processes`` is larger than 1, ``run`` fans out to that many worker
+    processes, each with its own event loop and client. Concurrency,
+    iterations, warmup iterations and rate are split across them and their
+    measurements are merged. ``warmup`` then only records the warmup to be
+    done by the workers. An `AutoWarmup` isn't split, each worker warms up
+    until its own measurements stabilize.
+    """
+
+    def __init__(self,
+                 hosts,
+                 concurrency,
+                 sample_mode,
+                 session_settings=None,
+                 lazy_pool=False,
+                 discard_rows=False,
+                 prepare=None,
+                 load_balancing=None,
+                 sniff_interval=None,
+                 timeout=None,
+                 processes=1):
         self.concurrency = concurrency
-        self.client = client(hosts, session_settings=session_settings, concurrency=concurrency)
+        self.prepare = prepare
+        self.processes = max(1, min(processes or 1, concurrency))
+        self._options = dict(
+            hosts=hosts,
+            sample_mode=sample_mode,
+            session_settings=session_settings,
+            lazy_pool=lazy_pool,
+            discard_rows=discard_rows,
+            prepare=prepare,
+            load_balancing=load_balancing,
+            sniff_interval=sniff_interval,
+            timeout=timeout
+        )
+        self._warmup = None
+        self._warmup_iterations = None
+        self._worker_results = []
+        # Counts of the prepared statement cache when the last run started
+        self._prepared_statements_start: Counter = Counter()
+        self.client = client(
+            hosts,
+            session_settings=session_settings,
+            concurrency=concurrency,
+            # Only used for the server version if workers do the requests
+            lazy_pool=lazy_pool or self.processes > 1,
+            discard_rows=discard_rows,
+            prepare=prepare,
+            load_balancing=load_balancing,
+            sniff_interval=sniff_interval,
+            timeout=timeout
+        )
         self.sampler = get_sampler(sample_mode)
 
-    def warmup(self, stmt, num_warmup, concurrency=0, args=None):
-        statements = itertools.repeat((stmt, args or ()), num_warmup)
-        aio.run_many(self.client.execute, statements, concurrency, num_items=num_warmup)
+    @property
+    def pool_setup_duration(self):
+        if self._worker_results:
+            return max(r['pool_setup_duration'] for r in self._worker_results)
+        return self.client.pool_setup_duration
+
+    @property
+    def prepared_statements(self):
+        """Hits and misses of the prepared statement cache during the last run
+
+        Warmup iterations and earlier runs aren't included.
+        """
+        if self.prepare != 'always':
+            return None
+        if self._worker_results:
+            total = Counter()
+            for r in self._worker_results:
+                total.update(r['prepared_statements'])
+            return dict(total)
+        start = self._prepared_statements_start
+        return {key: count - start[key]
+                for key, count in self.client.prepared_statements.items()}
+
+    @property
+    def warmup_iterations(self):
+        """Number of iterations used by the last warmup"""
+        if self._worker_results:
+            counts = [r['warmup_iterations'] for r in self._worker_results]
+            if all(c is None for c in counts):
+                return None
+            return sum(c or 0 for c in counts)
+        return self._warmup_iterations
+
+    def connect(self):
+        """Establish the connection pool so that it doesn't affect measurements"""
+        aio.run(self.client.connect)
+
+    def _start_run(self):
+        self.connect()
+        if self.prepare == 'always':
+            self._prepared_statements_start = Counter(self.client.prepared_statements)
+
+    def warmup(self, stmt, num_warmup, concurrency=0, args=None, args_source=None):
+        """Run ``stmt`` without measuring it and return the number of iterations.
+
+        ``num_warmup`` is either a number of iterations or an `AutoWarmup`
+        to run until the server reported durations stabilize, up to
+        ``max_iterations``.
+
+        If ``args_source`` is set, it provides the arguments of each
+        iteration instead of ``args``.
+        """
+        if self.processes > 1:
+            self._warmup = (stmt, num_warmup)
+            return None
+        self.connect()
+        # The connection pool limits the concurrency if none is given
+        concurrency = concurrency or self.concurrency
+        if isinstance(num_warmup, AutoWarmup):
+            iterations = self._warmup_until_stable(
+                stmt, num_warmup, concurrency, args, args_source)
+        else:
+            statements = itertools.repeat((stmt, args or ()), num_warmup)
+            if args_source:
+                statements = self._with_generated_args(statements, args_source, num_warmup)
+            execute = partial(_ignore_timeouts, self.client.execute)
+            aio.run_many(execute, statements, concurrency, num_items=num_warmup)
+            iterations = num_warmup
+        self._warmup_iterations = iterations
+        return iterations
+
+    def _warmup_until_stable(self, stmt, warmup, concurrency, args, args_source):
+        convergence = _Convergence(warmup)
+        num_started = 0
+
+        def generate_statements():
+            nonlocal num_started
+            while num_started < warmup.max_iterations and not convergence.converged:
+                num_started += 1
+                yield (stmt, args or ())
 
-    def run(self, stmt, *, iterations=None, duration=None, args=None, bulk_args=None):
+        statements = generate_statements()
+        if args_source:
+            statements = self._with_generated_args(
+                statements, args_source, warmup.max_iterations)
+
+        async def execute(stmt, args):
+            r = await _ignore_timeouts(self.client.execute, stmt, args)
+            if r:
+                convergence.add(r['duration'])
+
+        aio.run_many(execute, statements, concurrency, num_items=warmup.max_iterations)
+        return num_started
+
+    def _with_generated_args(self, statements, args_source, iterations):
+        args = aio.run(args_source.generate, self.client, buffer_size(iterations))
+        return _with_args(statements, args)
+
+    def run(self,
+            stmt,
+            *,
+            iterations=None,
+            duration=None,
+            args=None,
+            bulk_args=None,
+            args_source=None,
+            rate=None,
+            timeline_interval=None,
+            error_margin=None,
+            min_iterations=None,
+            track_failed=False):
+        """Run ``stmt`` and return the measurements as `TimedStats`.
+
+        If ``args_source`` is set, it provides the arguments of each
+        iteration, see `cr8.arg_sources`. They're generated before the
+        measurements start.
+
+        Failed requests are counted by category. If ``track_failed`` is set,
+        their runtime is recorded as ``failed`` series.
+
+        If ``timeline_interval`` (in seconds) is set, the measurements are
+        also grouped into buckets of that interval, see `Timeline`.
+
+        If ``error_margin`` is set, ``stmt`` runs until the 95% error margin
+        of the mean relative to the mean is below it, but at least
+        ``min_iterations`` times. ``iterations`` and ``duration`` then are
+        upper bounds, with ``DEFAULT_MAX_ITERATIONS`` if neither is given.
+        """
+        if self.processes > 1:
+            return self._run_in_processes(
+                stmt,
+                iterations=iterations,
+                duration=duration,
+                args=args,
+                bulk_args=bulk_args,
+                args_source=args_source,
+                rate=rate,
+                timeline_interval=timeline_interval,
+                error_margin=error_margin,
+                min_iterations=min_iterations,
+                track_failed=track_failed
+            )
+        if bulk_args and args_source:
+            raise ValueError('An args_source cannot be used together with bulk_args')
         if bulk_args:
             args = bulk_args
             f = self.client.execute_many
         else:
             f = self.client.execute
-        statements = _generate_statements(stmt, args, iterations, duration)
+        self._start_run()
+        stats = Stats(self.sampler)
+        if error_margin:
+            if iterations is None and duration is None:
+                iterations = DEFAULT_MAX_ITERATIONS
+            if min_iterations is None:
+                min_iterations = DEFAULT_MIN_ITERATIONS
+            statements = _generate_until_confident(
+                stmt, args, stats, error_margin, min_iterations, iterations, duration)
+        else:
+            statements = _generate_statements(stmt, args, iterations, duration)
+        if args_source:
+            statements = self._with_generated_args(statements, args_source, iterations)
+        # Requests still in-flight once the duration is over are cancelled
         return run_and_measure(
-            f, statements, self.concurrency, iterations, sampler=self.sampler)
+            f,
+            statements,
+            self.concurrency,
+            iterations,
+            sampler=self.sampler,
+            timeout=duration,
+            rate=rate,
+            timeline_interval=timeline_interval,
+            stats=stats,
+            track_failed=track_failed,
+            continue_on_error=True
+        )
+
+    def run_mixed(self,
+                  statements,
+                  *,
+                  iterations=None,
+                  duration=None,
+                  rate=None,
+                  timeline_interval=None,
+                  track_failed=False):
+        """Run a weighted mix of statements concurrently.
+
+        Each request runs one of the `WeightedStatement` ``statements``,
+        drawn according to their weights. All statements share the
+        concurrency or ``rate``. Statements with an ``args_source`` get
+        the arguments of each request from it.
+
+        Returns a `TimedStats` with the combined measurements and a list with
+        the `TimedStats` of each statement.
+        """
+        if self.processes > 1:
+            raise ValueError('Mixed workloads are not supported with multiple processes')
+        self._start_run()
+        items = []
+        for statement in statements:
+            stats = Stats(self.sampler)
+            stats.track_failed = track_failed
+            stats.raise_errors = False
+            if timeline_interval:
+                stats.timeline = Timeline(timeline_interval, self.sampler)
+            if statement.bulk_args and statement.args_source:
+                raise ValueError('An args_source cannot be used together with bulk_args')
+            if statement.bulk_args:
+                f, args = self.client.execute_many, statement.bulk_args
+            else:
+                f, args = self.client.execute, statement.args
+            if statement.args_source:
+                generated = aio.run(
+                    statement.args_source.generate, self.client, buffer_size(iterations))
+                args_iter = itertools.cycle(generated)
+            else:
+                args_iter = itertools.repeat(args)
+            items.append((stats, f, statement.stmt, args_iter))
+        weights = [statement.weight for statement in statements]
+        requests = (
+            (stats, f, stmt, next(args_iter))
+            for stats, f, stmt, args_iter in _generate_mixed(items, weights, iterations, duration)
+        )
+        # Only receives the event loop lag until the statement stats are merged
+        combined = Stats(self.sampler)
+        started = int(time() * 1000)
+        if rate:
+            aio.run_at_rate(_measure_from,
+                            requests,
+                            rate,
+                            num_items=iterations,
+                            timeout=duration,
+                            stats=combined)
+        else:
+            aio.run_many(aio.measure,
+                         requests,
+                         self.concurrency,
+                         num_items=iterations,
+                         timeout=duration,
+                         stats=combined)
+        ended = int(time() * 1000)
+        for item in items:
+            combined.merge(item[0])
+        if combined.last_error is not None and combined.sampler.count == 0:
+            raise combined.last_error
+        return (
+            TimedStats(started, ended, combined),
+            [TimedStats(started, ended, item[0]) for item in items]
+        )
+
+    def _run_in_processes(self,
+                          stmt,
+                          iterations,
+                          duration,
+                          args,
+                          bulk_args,
+                          args_source,
+                          rate,
+                          timeline_interval,
+                          error_margin,
+                          min_iterations,
+                          track_failed):
+        n = self.processes
+        ctx = multiprocessing.get_context('spawn')
+        barrier = ctx.Barrier(n)
+        results = ctx.Queue()
+        num_warmup = 0
+        if self._warmup and self._warmup[0] == stmt:
+            num_warmup = self._warmup[1]
+        self._warmup = None
+        concurrencies = _split(self.concurrency, n)
+        if isinstance(num_warmup, AutoWarmup):
+            warmups = [num_warmup] * n
+        else:
+            warmups = _split(num_warmup, n)
+        if duration is None:
+            default_iterations = DEFAULT_MAX_ITERATIONS if error_margin else 100
+            iterations_per_worker = _split(iterations or default_iterations, n)
+        elif error_margin and iterations:
+            iterations_per_worker = _split(iterations, n)
+        else:
+            iterations_per_worker = [None] * n
+        min_iterations_per_worker = _split(min_iterations or DEFAULT_MIN_ITERATIONS, n)
+        workers = []
+        for i in range(n):
+            options = dict(self._options, concurrency=concurrencies[i])
+            run_kwargs = dict(
+                iterations=iterations_per_worker[i],
+                duration=duration,
+                args=args,
+                bulk_args=bulk_args,
+                args_source=args_source and args_source.for_worker(i, n),
+                rate=rate and rate / n,
+                timeline_interval=timeline_interval,
+                error_margin=error_margin,
+                min_iterations=min_iterations_per_worker[i],
+                track_failed=track_failed
+            )
+            worker = ctx.Process(
+                target=_run_worker,
+                args=(barrier, results, options, stmt, warmups[i], run_kwargs))
+            worker.start()
+            workers.append(worker)
+        outputs = []
+        try:
+            while len(outputs) < n:
+                try:
+                    outputs.append(results.get(timeout=1))
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise RuntimeError('Worker processes exited without reporting a result')
+        finally:
+            for worker in workers:
+                worker.join()
+        errors = [o for o in outputs if isinstance(o, BaseException)]
+        if errors:
+            # Other workers fail with BrokenBarrierError if one fails early
+            errors.sort(key=lambda e: isinstance(e, threading.BrokenBarrierError))
+            raise errors[0]
+        self._worker_results = outputs
+        stats = Stats(self.sampler)
+        for output in outputs:
+            stats.merge(output['timed_stats'].stats)
+        return TimedStats(
+            min(o['timed_stats'].started for o in outputs),
+            max(o['timed_stats'].ended for o in outputs),
+            stats
+        )
 
     def __enter__(self):
         return self
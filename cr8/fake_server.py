@@ -0,0 +1,428 @@
+"""A stand-in for CrateDB which returns canned results.
+
+It can be used to measure how many requests the cr8 clients can drive
+without a database being the bottleneck, and as a fast backend for tests.
+
+Supported are the ``/_sql`` HTTP endpoint, including ``bulk_args``, and a
+minimal subset of the PostgreSQL wire protocol: simple and extended queries
+without authentication or SSL. Parameters and result columns are of type
+``text``.
+"""
+
+import argh
+import json
+import re
+import struct
+import sys
+from typing import Optional, List, Tuple
+
+from aiohttp import web
+
+from cr8 import aio
+from cr8.aio import asyncio
+from cr8.cli import to_int
+
+
+VERSION = {
+    'number': '5.8.0',
+    'build_hash': '0000000000000000000000000000000000000000',
+    'build_timestamp': '2024-01-01T00:00:00Z',
+    'build_snapshot': False,
+    'minimum_wire_compatibility_version': '5.0.0',
+    'minimum_index_compatibility_version': '4.0.0',
+}
+
+_SYS_NODES_HTTP = re.compile(r'^\s*select\s+http_endpoint\s+from\s+sys\.nodes', re.I)
+_SYS_NODES_VERSION = re.compile(r'^\s*select\s+version\s+from\s+sys\.nodes', re.I)
+
+
+class FakeCrate:
+    """Answers statements with canned results after ``latency`` (in ms).
+
+    >>> crate = FakeCrate(rows=2)
+    >>> crate.result('select * from t')
+    (['x'], [[1], [1]], 2)
+    >>> crate.result('insert into t (x) values (?)', bulk_size=3)
+    ([], [], 3)
+    """
+
+    def __init__(self, latency=0.0, rows=1, http_endpoint=None):
+        self.latency = latency
+        self.rows = rows
+        self.http_endpoint = http_endpoint
+
+    async def wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency / 1000.)
+
+    def result(self, stmt: str, bulk_size=None) -> Tuple[List[str], List[list], int]:
+        if bulk_size is not None:
+            return [], [], bulk_size
+        if _SYS_NODES_HTTP.match(stmt):
+            return ['http_endpoint'], [[self.http_endpoint]], 1
+        if _SYS_NODES_VERSION.match(stmt):
+            return ['version'], [[VERSION]], 1
+        if stmt.lstrip()[:6].lower() != 'select':
+            return [], [], 1
+        return ['x'], [[1]] * self.rows, self.rows
+
+
+async def _handle_sql(crate, request):
+    payload = await request.json()
+    stmt = payload.get('stmt', '')
+    bulk_args = payload.get('bulk_args')
+    await crate.wait()
+    if bulk_args is not None:
+        _, _, rowcount = crate.result(stmt, len(bulk_args))
+        return web.json_response({
+            'cols': [],
+            'duration': crate.latency,
+            'results': [{'rowcount': 1}] * rowcount
+        })
+    cols, rows, rowcount = crate.result(stmt)
+    return web.json_response({
+        'cols': cols,
+        'rows': rows,
+        'rowcount': rowcount,
+        'duration': crate.latency
+    })
+
+
+async def _handle_root(request):
+    return web.json_response({
+        'ok': True,
+        'status': 200,
+        'name': 'fake-server',
+        'cluster_name': 'fake',
+        'version': VERSION,
+    })
+
+
+def create_app(crate: FakeCrate) -> web.Application:
+    app = web.Application()
+    app.router.add_get('/', _handle_root)
+
+    async def handle_sql(request):
+        return await _handle_sql(crate, request)
+
+    app.router.add_post('/_sql', handle_sql)
+    return app
+
+
+_SSL_REQUEST = 80877103
+_PROTOCOL_3 = 196608
+_TEXT_OID = 25
+_PARAM_RE = re.compile(r'\$(\d+)')
+
+
+def _msg(type_: bytes, body: bytes = b'') -> bytes:
+    return type_ + struct.pack('!i', len(body) + 4) + body
+
+
+def _cstr(s: str) -> bytes:
+    return s.encode('utf-8') + b'\x00'
+
+
+def _row_description(cols, formats=()) -> bytes:
+    body = struct.pack('!h', len(cols))
+    for i, col in enumerate(cols):
+        fmt = formats[i] if i < len(formats) else (formats[0] if formats else 0)
+        body += _cstr(col) + struct.pack('!ihihih', 0, 0, _TEXT_OID, -1, -1, fmt)
+    return _msg(b'T', body)
+
+
+def _data_row(row) -> bytes:
+    body = struct.pack('!h', len(row))
+    for value in row:
+        if value is None:
+            body += struct.pack('!i', -1)
+            continue
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        data = value.encode('utf-8')
+        body += struct.pack('!i', len(data)) + data
+    return _msg(b'D', body)
+
+
+def _command_complete(stmt, rowcount) -> bytes:
+    words = stmt.split(None, 1)
+    command = words[0].upper() if words else ''
+    if command == 'SELECT':
+        tag = f'SELECT {rowcount}'
+    elif command == 'INSERT':
+        tag = f'INSERT 0 {rowcount}'
+    elif command in ('UPDATE', 'DELETE'):
+        tag = f'{command} {rowcount}'
+    else:
+        tag = command
+    return _msg(b'C', _cstr(tag))
+
+
+def _error(message) -> bytes:
+    body = b'SERROR\x00' + b'C0A000\x00' + b'M' + _cstr(message) + b'\x00'
+    return _msg(b'E', body)
+
+
+_READY_FOR_QUERY = _msg(b'Z', b'I')
+
+
+class _PgProtocol(asyncio.Protocol):
+    """Minimal PostgreSQL wire protocol server backed by ``FakeCrate``"""
+
+    def __init__(self, crate: FakeCrate):
+        self.crate = crate
+        self.transport = None
+        self.buffer = b''
+        self.started = False
+        self.statements = {}
+        self.portals = {}
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.worker = None
+        # after an error, messages are discarded until Sync
+        self.failed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.worker = asyncio.ensure_future(self._process())
+
+    def connection_lost(self, exc):
+        self.worker.cancel()
+
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            if not self.started:
+                if len(self.buffer) < 4:
+                    return
+                length, = struct.unpack('!i', self.buffer[:4])
+                if len(self.buffer) < length:
+                    return
+                body = self.buffer[4:length]
+                self.buffer = self.buffer[length:]
+                self._startup(body)
+                continue
+            if len(self.buffer) < 5:
+                return
+            length, = struct.unpack('!i', self.buffer[1:5])
+            if len(self.buffer) < length + 1:
+                return
+            type_ = self.buffer[:1]
+            body = self.buffer[5:length + 1]
+            self.buffer = self.buffer[length + 1:]
+            self.queue.put_nowait((type_, body))
+
+    def _startup(self, body):
+        code, = struct.unpack('!i', body[:4])
+        if code == _SSL_REQUEST:
+            self.transport.write(b'N')
+            return
+        if code != _PROTOCOL_3:
+            self.transport.close()
+            return
+        self.started = True
+        out = _msg(b'R', struct.pack('!i', 0))
+        for name, value in (('server_version', '14.0'),
+                            ('server_encoding', 'UTF8'),
+                            ('client_encoding', 'UTF8'),
+                            ('DateStyle', 'ISO'),
+                            ('TimeZone', 'UTC'),
+                            ('integer_datetimes', 'on'),
+                            ('standard_conforming_strings', 'on'),
+                            ('crate_version', VERSION['number'])):
+            out += _msg(b'S', _cstr(name) + _cstr(value))
+        out += _msg(b'K', struct.pack('!ii', 1, 1))
+        self.transport.write(out + _READY_FOR_QUERY)
+
+    async def _process(self):
+        while True:
+            type_, body = await self.queue.get()
+            if type_ == b'X':
+                self.transport.close()
+                return
+            if type_ == b'S':
+                self.failed = False
+                self.transport.write(_READY_FOR_QUERY)
+                continue
+            if self.failed:
+                continue
+            handler = self._handlers.get(type_)
+            if handler is None:
+                self.failed = True
+                self.transport.write(_error(f'Unsupported message: {type_!r}'))
+                if type_ == b'Q':
+                    self.transport.write(_READY_FOR_QUERY)
+                continue
+            out = await handler(self, body)
+            if out:
+                self.transport.write(out)
+
+    async def _query(self, body):
+        stmt = body[:-1].decode('utf-8')
+        await self.crate.wait()
+        out = b''
+        for part in filter(None, (s.strip() for s in stmt.split(';'))):
+            cols, rows, rowcount = self.crate.result(part)
+            if cols:
+                out += _row_description(cols)
+            out += b''.join(_data_row(row) for row in rows)
+            out += _command_complete(part, rowcount)
+        if not out:
+            out = _msg(b'I')
+        return out + _READY_FOR_QUERY
+
+    async def _parse(self, body):
+        name, rest = body.split(b'\x00', 1)
+        stmt, _ = rest.split(b'\x00', 1)
+        self.statements[name] = stmt.decode('utf-8')
+        return _msg(b'1')
+
+    async def _bind(self, body):
+        portal, rest = body.split(b'\x00', 1)
+        name, rest = rest.split(b'\x00', 1)
+        num_param_formats, = struct.unpack('!h', rest[:2])
+        offset = 2 + 2 * num_param_formats
+        num_params, = struct.unpack('!h', rest[offset:offset + 2])
+        offset += 2
+        for _ in range(num_params):
+            length, = struct.unpack('!i', rest[offset:offset + 4])
+            offset += 4 + max(length, 0)
+        num_formats, = struct.unpack('!h', rest[offset:offset + 2])
+        formats = struct.unpack(f'!{num_formats}h', rest[offset + 2:offset + 2 + 2 * num_formats])
+        self.portals[portal] = (self.statements[name], formats)
+        return _msg(b'2')
+
+    async def _describe(self, body):
+        kind, name = body[:1], body[1:-1]
+        if kind == b'S':
+            stmt = self.statements[name]
+            num_params = max((int(i) for i in _PARAM_RE.findall(stmt)), default=0)
+            out = _msg(b't', struct.pack(f'!h{num_params}i', num_params, *([_TEXT_OID] * num_params)))
+            formats: Tuple[int, ...] = ()
+        else:
+            stmt, formats = self.portals[name]
+            out = b''
+        cols, _, _ = self.crate.result(stmt)
+        if cols:
+            return out + _row_description(cols, formats)
+        return out + _msg(b'n')
+
+    async def _execute(self, body):
+        name = body.split(b'\x00', 1)[0]
+        stmt, _ = self.portals[name]
+        await self.crate.wait()
+        _, rows, rowcount = self.crate.result(stmt)
+        return b''.join(_data_row(row) for row in rows) + _command_complete(stmt, rowcount)
+
+    async def _close(self, body):
+        kind, name = body[:1], body[1:-1]
+        (self.statements if kind == b'S' else self.portals).pop(name, None)
+        return _msg(b'3')
+
+    async def _flush(self, body):
+        return b''
+
+    _handlers = {
+        b'Q': _query,
+        b'P': _parse,
+        b'B': _bind,
+        b'D': _describe,
+        b'E': _execute,
+        b'C': _close,
+        b'H': _flush,
+    }
+
+
+class FakeServer:
+    """Runs the HTTP and optionally the PostgreSQL endpoint of ``FakeCrate``.
+
+    Use ``port=0`` to listen on a free port. ``http_url`` and ``psql_url``
+    contain the addresses once ``start`` completed.
+    """
+
+    def __init__(self,
+                 host='127.0.0.1',
+                 port=4200,
+                 psql_port: Optional[int] = None,
+                 latency=0.0,
+                 rows=1):
+        self.host = host
+        self.port = port
+        self.psql_port = psql_port
+        self.crate = FakeCrate(latency=latency, rows=rows)
+        self.http_url: Optional[str] = None
+        self.psql_url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._pg_server = None
+
+    async def start(self):
+        self._runner = web.AppRunner(create_app(self.crate), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.crate.http_endpoint = f'{self.host}:{port}'
+        self.http_url = f'http://{self.host}:{port}'
+        if self.psql_port is not None:
+            loop = asyncio.get_event_loop()
+            self._pg_server = await loop.create_server(
+                lambda: _PgProtocol(self.crate), self.host, self.psql_port)
+            port = self._pg_server.sockets[0].getsockname()[1]
+            self.psql_url = f'asyncpg://crate@{self.host}:{port}/doc'
+        return self
+
+    async def close(self):
+        if self._pg_server:
+            self._pg_server.close()
+            await self._pg_server.wait_closed()
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exs):
+        await self.close()
+
+
+@argh.arg('--host', help='Address to listen on')
+@argh.arg('--port', type=to_int, help='Port of the HTTP endpoint')
+@argh.arg('--psql-port', type=to_int, help='Port of the PostgreSQL endpoint. Disabled if not set')
+@argh.arg('-l', '--latency', type=float, help='Artificial latency of each request in ms')
+@argh.arg('-r', '--rows', type=to_int, help='Number of rows returned by select statements')
+def fake_server(*,
+                host='127.0.0.1',
+                port=4200,
+                psql_port=None,
+                latency=0.0,
+                rows=1):
+    """Run a fake CrateDB server which returns canned results.
+
+    Useful to benchmark the overhead of cr8 itself, without a database being
+    the bottleneck. The server answers the `/_sql` endpoint, including bulk
+    requests, and optionally a minimal subset of the PostgreSQL protocol.
+
+    Args:
+        latency: Time in ms each request takes. It is also reported as the
+            duration of the request.
+        rows: Number of rows returned by select statements.
+    """
+    server = FakeServer(host, port, psql_port, latency=latency, rows=rows)
+    loop = asyncio.get_event_loop()
+    aio.run(server.start)
+    print(f'HTTP: {server.http_url}', file=sys.stderr)
+    if server.psql_url:
+        print(f'PostgreSQL: {server.psql_url}', file=sys.stderr)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aio.run(server.close)
+
+
+def main():
+    argh.dispatch_command(fake_server)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,7 @@ from cr8.aio import asyncio, consume
 from cr8.cli import to_int
 from cr8.fake_providers import GeoSpatialProvider, auto_inc
 from cr8 import clients, aio
+from cr8.log import format_bulk_rows
 
 loop = asyncio.get_event_loop()
 
@@ -159,7 +160,14 @@ class DataFaker:
         return alternative(self.fake, column)
 
     def provider_from_mapping(self, column: Column, mapping):
-        key = mapping[column.name]
+        return self.provider(mapping[column.name])
+
+    def provider(self, key):
+        """Return the fake provider named ``key``
+
+        ``key`` can also be a list of the name and the arguments for the
+        provider, e.g. ``["random_int", [1, 10]]``.
+        """
         args = None
         if isinstance(key, list):
             key, args = key
@@ -182,8 +190,8 @@ def create_row_generator(columns, mapping=None):
     return partial(generate_row, fakers)
 
 
-async def _exec_many(client, stmt, args_coro):
-    return await client.execute_many(stmt, await args_coro)
+async def _exec_many(execute_many, stmt, args_coro):
+    return await execute_many(stmt, await args_coro)
 
 
 def _create_bulk_args(row_fun, req_size):
@@ -203,10 +211,10 @@ def _bulk_size_generator(num_records, bulk_size, active):
         yield req_size
 
 
-async def _gen_data_and_insert(q, e, client, stmt, row_fun, size_seq):
+async def _gen_data_and_insert(q, e, execute_many, stmt, row_fun, size_seq):
     for size in size_seq:
         args_coro = loop.run_in_executor(e, _create_bulk_args, row_fun, size)
-        task = asyncio.ensure_future(_exec_many(client, stmt, args_coro))
+        task = asyncio.ensure_future(_exec_many(execute_many, stmt, args_coro))
         await q.put(task)
     await q.put(None)
 
@@ -222,6 +230,7 @@ async def _gen_data_and_insert(q, e, client, stmt, row_fun, size_seq):
 @argh.arg('--mapping-file',
           type=argparse.FileType('r'),
           help='JSON file with a column to fake provider mapping.')
+@argh.arg('--retries', type=to_int, help='How often failed rows are re-submitted')
 @argh.wrap_errors([KeyboardInterrupt] + clients.client_errors)
 def insert_fake_data(*,
                      hosts=None,
@@ -229,7 +238,8 @@ def insert_fake_data(*,
                      num_records=1e5,
                      bulk_size=1000,
                      concurrency=25,
-                     mapping_file=None):
+                     mapping_file=None,
+                     retries=0):
     """Generate random data and insert it into a table.
 
     This will read the table schema and then find suitable random data providers.
@@ -268,6 +278,8 @@ def insert_fake_data(*,
                 "x": ["provider_with_args", ["arg1"]],
                 "y": "provider_without_args"
             }
+        retries: How often rows which failed are re-submitted, in smaller
+            batches and with an exponential backoff.
     """
     with clients.client(hosts, concurrency=1) as client:
         schema, table_name = parse_table(table)
@@ -296,6 +308,7 @@ def insert_fake_data(*,
     print('Generating fake data and executing inserts')
     q = asyncio.Queue(maxsize=concurrency)
     with clients.client(hosts, concurrency=concurrency) as client:
+        execute_many = clients.BulkRetry(client.execute_many, retries=retries)
         active = [True]
 
         def stop():
@@ -307,10 +320,12 @@ def insert_fake_data(*,
         bulk_seq = _bulk_size_generator(num_records, bulk_size, active)
         with ThreadPoolExecutor() as e:
             tasks = asyncio.gather(
-                _gen_data_and_insert(q, e, client, stmt, gen_row, bulk_seq),
+                _gen_data_and_insert(q, e, execute_many, stmt, gen_row, bulk_seq),
                 consume(q, total=num_inserts)
             )
             loop.run_until_complete(tasks)
+    if execute_many.rows['retried']:
+        print(format_bulk_rows(execute_many.rows), file=sys.stderr)
 
 
 def main():
@@ -1,14 +1,14 @@
 
 import argh
+import sys
 import asyncpg
 import asyncio
 
-from functools import partial
 
 from cr8 import aio, clients
 from cr8.cli import to_int
 from cr8.metrics import Stats
-from cr8.log import format_stats
+from cr8.log import format_stats, format_bulk_rows
 
 
 def mk_insert(table, attributes):
@@ -67,6 +67,7 @@ async def async_insert_from_sql(src_uri,
 @argh.arg('--hosts', help='Target CrateDB hosts')
 @argh.arg('-c', '--concurrency', type=to_int)
 @argh.arg('-of', '--output-fmt', choices=['json', 'text'], default='text')
+@argh.arg('--retries', type=to_int, help='How often failed rows are re-submitted')
 @argh.wrap_errors([KeyboardInterrupt, BrokenPipeError] + clients.client_errors)
 def insert_from_sql(*,
                     src_uri=None,
@@ -75,12 +76,18 @@ def insert_from_sql(*,
                     concurrency=25,
                     table=None,
                     hosts=None,
-                    output_fmt=None):
-    """Insert data read from another SQL source into table."""
+                    output_fmt=None,
+                    retries=0):
+    """Insert data read from another SQL source into table.
+
+    Rows which fail are re-submitted up to `retries` times, in smaller
+    batches and with an exponential backoff.
+    """
 
     stats = Stats()
     with clients.client(hosts, concurrency=concurrency) as client:
-        f = partial(aio.measure, stats, client.execute_many)
+        execute_many = clients.BulkRetry(
+            client.execute_many, retries=retries, stats=stats)
         try:
             aio.run(
                 async_insert_from_sql,
@@ -89,10 +96,12 @@ def insert_from_sql(*,
                 query,
                 fetch_size,
                 table,
-                f
+                execute_many
             )
         except clients.SqlException as e:
             raise SystemExit(str(e))
+    if execute_many.rows['retried']:
+        print(format_bulk_rows(execute_many.rows), file=sys.stderr)
     try:
         print(format_stats(stats.get(), output_fmt))
     except KeyError:
@@ -3,14 +3,13 @@
 
 import argh
 import sys
-from functools import partial
 from argparse import FileType
 
 from .cli import dicts_from_lines, to_int
 from .misc import as_bulk_queries
 from cr8 import aio, clients
 from .metrics import Stats
-from .log import format_stats
+from .log import format_stats, format_bulk_rows
 
 
 def to_insert(table, d):
@@ -53,6 +52,11 @@ def print_only(lines, table):
 @argh.arg('-c', '--concurrency', type=to_int)
 @argh.arg('-i', '--infile', type=FileType('r', encoding='utf-8'), default=sys.stdin)
 @argh.arg('-of', '--output-fmt', choices=['json', 'text'], default='text')
+@argh.arg('--json-encoder', choices=list(clients.json_encoders),
+          help='JSON encoder used to encode HTTP requests')
+@argh.arg('--compression', choices=list(clients.compressors),
+          help='Compress the bodies of HTTP requests')
+@argh.arg('--retries', type=to_int, help='How often failed rows are re-submitted')
 @argh.wrap_errors([KeyboardInterrupt, BrokenPipeError] + clients.client_errors)
 def insert_json(*,
                 table=None,
@@ -60,7 +64,10 @@ def insert_json(*,
                 concurrency=25,
                 hosts=None,
                 infile=None,
-                output_fmt=None):
+                output_fmt=None,
+                json_encoder=None,
+                compression=None,
+                retries=0):
     """Insert JSON lines from a file or stdin into a CrateDB cluster.
 
     If no hosts are specified the statements will be printed.
@@ -70,6 +77,12 @@ def insert_json(*,
         bulk_size: Bulk size of the insert statements.
         concurrency: Number of operations to run concurrently.
         hosts: hostname:port pairs of the Crate nodes
+        json_encoder: JSON encoder used for HTTP requests. `orjson` requires
+            the orjson package.
+        compression: Compress HTTP request bodies using gzip or deflate.
+            Compression time and request sizes are included in the result.
+        retries: How often rows which failed are re-submitted, in smaller
+            batches and with an exponential backoff.
     """
     if not hosts:
         return print_only(infile, table)
@@ -80,12 +93,18 @@ def insert_json(*,
         bulk_size, concurrency), file=sys.stderr)
 
     stats = Stats()
-    with clients.client(hosts, concurrency=concurrency) as client:
-        f = partial(aio.measure, stats, client.execute_many)
+    with clients.client(hosts,
+                        concurrency=concurrency,
+                        json_encoder=json_encoder,
+                        compression=compression) as client:
+        execute_many = clients.BulkRetry(
+            client.execute_many, retries=retries, stats=stats)
         try:
-            aio.run_many(f, bulk_queries, concurrency)
+            aio.run_many(execute_many, bulk_queries, concurrency)
         except clients.SqlException as e:
             raise SystemExit(str(e))
+    if execute_many.rows['retried']:
+        print(format_bulk_rows(execute_many.rows), file=sys.stderr)
     try:
         print(format_stats(stats.get(), output_fmt))
     except KeyError:
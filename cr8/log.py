@@ -7,8 +7,18 @@ from functools import partial
 _wopen = partial(open, mode='w', encoding='utf-8')
 to_jsonstr = json.dumps
 
+# Share of the client round-trip time from which on the event loop lag is
+# considered to inflate the results
+LOOP_LAG_WARNING_RATIO = 0.1
+# The 99th percentile of the lag (in ms) must be at least this high as well.
+# Against fast servers, small lags are a large share of the round-trip time
+# without the client being overloaded.
+LOOP_LAG_WARNING_MIN_P99 = 5.0
+
 
 def _format_short(stats):
+    if stats['n'] == 0 and ('error_rate' in stats or 'cancelled' in stats):
+        return _format_aborted(stats)
     output = ('Runtime (in ms):\n'
               '    mean:    {mean:.3f} ± {error_margin:.3f}')
     values = dict(
@@ -33,9 +43,111 @@ def _format_short(stats):
             p95=percentiles['95'],
             p999=percentiles['99_9']
         ))
+    client = stats.get('client')
+    if client and client['n'] > 0:
+        output += (
+            '\n'
+            'Client round-trip (in ms):\n'
+            '    mean:    {client_mean:.3f}'
+        )
+        values['client_mean'] = client['mean']
+        overhead = stats.get('overhead')
+        if overhead and overhead['n'] > 0:
+            output += ' (overhead: {overhead_mean:.3f})'
+            values['overhead_mean'] = overhead['mean']
+    compress = stats.get('compress')
+    if compress and compress['n'] > 0:
+        output += (
+            '\n'
+            'Compression (in ms):\n'
+            '    mean:    {compress_mean:.3f} (request size: {request_size_mean:.0f} bytes)'
+        )
+        values['compress_mean'] = compress['mean']
+        values['request_size_mean'] = stats['request_size']['mean']
+    loop_lag = stats.get('loop_lag')
+    if loop_lag and loop_lag['n'] > 0:
+        output += (
+            '\n'
+            'Event loop lag (in ms):\n'
+            '    mean:    {loop_lag_mean:.3f} (p99: {loop_lag_p99:.3f})'
+        )
+        values['loop_lag_mean'] = loop_lag['mean']
+        values['loop_lag_p99'] = loop_lag.get('percentile', {}).get('99', loop_lag['max'])
+    aborted = _format_aborted(stats)
+    if aborted:
+        output += '\n' + aborted
     return output.format(**values)
 
 
+def _format_aborted(stats):
+    lines = []
+    if 'timeouts' in stats:
+        lines.append('Timeouts: {timeouts}'.format(**stats))
+    errors = stats.get('errors')
+    if errors:
+        lines.append('Errors: ' + ', '.join(
+            f'{category}: {count}' for category, count in sorted(errors.items())))
+    if 'error_rate' in stats:
+        lines.append('Error rate: {error_rate:.2%}'.format(**stats))
+    if 'cancelled' in stats:
+        lines.append('Cancelled at end of run: {cancelled}'.format(**stats))
+    return '\n'.join(lines)
+
+
+def loop_lag_warning(stats):
+    """Return a warning if the event loop lag inflates the measured runtime
+
+    The mean lag must be at least ``LOOP_LAG_WARNING_RATIO`` of the mean
+    client round-trip time and its 99th percentile at least
+    ``LOOP_LAG_WARNING_MIN_P99`` ms.
+
+    >>> stats = {'mean': 20.0, 'n': 10, 'loop_lag': {'n': 10, 'mean': 5.0, 'max': 12.0}}
+    >>> print(loop_lag_warning(stats))
+    Warning: The event loop lag is 25.0% of the client round-trip time (p99: 12.000 ms). The client is likely overloaded, which inflates the measured latencies. Reduce the concurrency or use more processes.
+
+    >>> stats['loop_lag']['mean'] = 0.1
+    >>> loop_lag_warning(stats)
+
+    >>> stats = {'mean': 1.0, 'n': 10, 'loop_lag': {'n': 10, 'mean': 0.2, 'max': 0.7}}
+    >>> loop_lag_warning(stats)
+    """
+    loop_lag = stats.get('loop_lag')
+    if not loop_lag or loop_lag['n'] == 0:
+        return None
+    latency = stats.get('client') or stats
+    if latency['n'] == 0 or latency['mean'] <= 0:
+        return None
+    share = loop_lag['mean'] / latency['mean']
+    p99 = loop_lag.get('percentile', {}).get('99', loop_lag['max'])
+    if share < LOOP_LAG_WARNING_RATIO or p99 < LOOP_LAG_WARNING_MIN_P99:
+        return None
+    return (f'Warning: The event loop lag is {share:.1%} of the client round-trip time '
+            f'(p99: {p99:.3f} ms). '
+            'The client is likely overloaded, which inflates the measured latencies. '
+            'Reduce the concurrency or use more processes.')
+
+
+def format_bulk_rows(rows):
+    return 'Retried rows: {retried}, failed rows: {failed}'.format(**rows)
+
+
+def format_mix_header(result, label=None):
+    elapsed = (result.ended - result.started) / 1000.
+    throughput = result.runtime_stats['n'] / elapsed if elapsed else 0.0
+    return '{statement} (weight: {weight:.1%}, throughput: {throughput:.1f} requests/s):'.format(
+        statement=label or result.statement,
+        weight=result.weight,
+        throughput=throughput
+    )
+
+
+def format_confidence(stats):
+    return 'Iterations: {n} (relative error margin: {margin:.2%})'.format(
+        n=stats.sampler.count,
+        margin=stats.relative_error_margin()
+    )
+
+
 def format_stats(stats, output_fmt=None):
     output_fmt = output_fmt or 'text'
     if output_fmt == 'json':
@@ -54,10 +166,18 @@ class Logger(contextlib.ExitStack):
         result_output = self._open(logfile_result)
         self.info = partial(print, file=info_output)
         presult = partial(print, file=result_output)
-        if output_fmt == 'json':
-            self.result = lambda r: presult(to_jsonstr(r.as_dict()))
+        self.result = partial(self._result, presult, output_fmt == 'json')
+
+    @staticmethod
+    def _result(presult, as_json, result):
+        if as_json:
+            presult(to_jsonstr(result.as_dict()))
         else:
-            self.result = lambda r: presult(_format_short(r.runtime_stats))
+            presult(_format_short(result.runtime_stats))
+        # Not part of the result, so that it can be parsed
+        warning = loop_lag_warning(result.runtime_stats)
+        if warning:
+            print(warning, file=sys.stderr)
 
     def _open(self, filepath):
         if filepath:
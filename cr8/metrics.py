@@ -1,7 +1,10 @@
 import statistics
 import random
 import math
+import time
+from collections import Counter
 from functools import partial
+from typing import Dict, Optional
 
 
 DEFAULT_NUM_SAMPLES = 1000
@@ -49,6 +52,32 @@ class UniformReservoir:
                 self.values[k] = value
         self.count = count + 1
 
+    def merge(self, other):
+        """Merge the samples of another reservoir into this one.
+
+        If the samples don't fit, each reservoir contributes samples in
+        proportion to the number of values it has seen.
+
+        >>> r1, r2 = UniformReservoir(4), UniformReservoir(4)
+        >>> for i in range(12):
+        ...     r1.add(1)
+        >>> for i in range(4):
+        ...     r2.add(2)
+        >>> r1.merge(r2)
+        >>> r1.count, sorted(r1.values)
+        (16, [1, 1, 1, 2])
+        """
+        count = self.count + other.count
+        values = self.values + other.values
+        if len(values) > self.size:
+            num_own = round(self.size * self.count / count)
+            num_own = max(num_own, self.size - len(other.values))
+            num_own = min(num_own, len(self.values))
+            values = (random.sample(self.values, num_own)
+                      + random.sample(other.values, self.size - num_own))
+        self.values = values
+        self.count = count
+
 
 class All:
     """Sampler that keeps all values"""
@@ -59,11 +88,65 @@ class All:
     def add(self, value):
         self.values.append(value)
 
+    def merge(self, other):
+        self.values.extend(other.values)
+
     @property
     def count(self):
         return len(self.values)
 
 
+class RunningVariance:
+    """Mean and variance of all values, updated with each value.
+
+    Uses Welford's algorithm, so unlike the samplers it doesn't need to keep
+    the values.
+
+    >>> r = RunningVariance()
+    >>> for value in [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]:
+    ...     r.add(value)
+    >>> r.count, r.mean, round(r.variance, 3)
+    (8, 5.0, 4.571)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Combine with the values of ``other``
+
+        >>> r1, r2 = RunningVariance(), RunningVariance()
+        >>> for value in [2.0, 4.0, 4.0, 4.0]:
+        ...     r1.add(value)
+        >>> for value in [5.0, 5.0, 7.0, 9.0]:
+        ...     r2.add(value)
+        >>> r1.merge(r2)
+        >>> r1.count, r1.mean, round(r1.variance, 3)
+        (8, 5.0, 4.571)
+        """
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+
 def get_sampler(sample_mode: str):
     """Return a sampler constructor
 
@@ -103,15 +186,159 @@ def error_margin(confidence_level, stdev, sample_size):
 
 
 class Stats:
+    """Runtime statistics of measured values.
+
+    Additional named series (e.g. the time it took to encode a request) can
+    be recorded using `measure_series`. They're included in the output of
+    `get` under their name.
+
+    Requests which exceeded their deadline are counted in `timeouts`,
+    requests which were still in-flight at the end of a run and got
+    cancelled in `cancelled`. Failed requests are counted per category in
+    `errors` and the last error is kept in `last_error`. The measured values
+    are those of successful requests; if `track_failed` is set, the
+    runtime of failed requests is recorded as ``failed`` series. The
+    counters and the ``error_rate`` are included in the output of `get` if
+    there were any. `aio.measure` raises the errors after counting them,
+    unless `raise_errors` is unset.
+
+    If `timeline` is set to a `Timeline`, measured values and timeouts are
+    also recorded per interval. If `recent` is set to a sampler, measured
+    values are also added to it, e.g. for progress reporting.
+
+    >>> stats = Stats()
+    >>> stats.measure(10.0)
+    >>> stats.measure_series('encode', 1.5)
+    >>> stats.get()['encode']['mean']
+    1.5
+    """
     plevels = [50, 75, 90, 95, 99, 99.9]
 
     def __init__(self, sampler=None):
-        self.sampler = sampler() if sampler else UniformReservoir()
+        self._create_sampler = sampler or UniformReservoir
+        self.sampler = self._create_sampler()
+        self.series: Dict[str, Stats] = {}
+        self.timeouts = 0
+        self.cancelled = 0
+        self.errors: Counter = Counter()
+        self.last_error: Optional[Exception] = None
+        self.track_failed = False
+        self.raise_errors = True
+        self.timeline: Optional[Timeline] = None
+        self.recent: Optional[UniformReservoir] = None
+        self._running = RunningVariance()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Not all exceptions can be unpickled
+        state['last_error'] = None
+        return state
 
     def measure(self, value):
         self.sampler.add(value)
+        self._running.add(value)
+        if self.recent is not None:
+            self.recent.add(value)
+        if self.timeline is not None:
+            self.timeline.measure(value)
+
+    def measure_timeout(self):
+        self.timeouts += 1
+        if self.timeline is not None:
+            self.timeline.error()
+
+    def measure_error(self, error, category, duration):
+        """Count a failed request.
+
+        >>> stats = Stats()
+        >>> stats.measure(2.0)
+        >>> stats.measure_error(ValueError('boom'), 'sql', 1.0)
+        >>> r = stats.get()
+        >>> r['n'], r['errors'], r['error_rate']
+        (1, {'sql': 1}, 0.5)
+        """
+        self.errors[category] += 1
+        self.last_error = error
+        if self.track_failed:
+            self.measure_series('failed', duration)
+        if self.timeline is not None:
+            self.timeline.error()
+
+    def merge(self, other):
+        """Merge the measurements of ``other`` into these stats.
+
+        >>> s1, s2 = Stats(All), Stats(All)
+        >>> s1.measure(1.0)
+        >>> s2.measure(3.0)
+        >>> s2.measure_series('client', 4.0)
+        >>> s2.timeouts = 1
+        >>> s1.merge(s2)
+        >>> r = s1.get()
+        >>> r['n'], r['mean'], r['client']['n'], r['timeouts']
+        (2, 2.0, 1, 1)
+        """
+        self.sampler.merge(other.sampler)
+        self._running.merge(other._running)
+        for name, series in other.series.items():
+            own = self.series.get(name)
+            if own is None:
+                own = self.series[name] = Stats(self._create_sampler)
+            own.merge(series)
+        self.timeouts += other.timeouts
+        self.cancelled += other.cancelled
+        self.errors.update(other.errors)
+        self.last_error = other.last_error or self.last_error
+        if other.timeline is not None:
+            if self.timeline is None:
+                self.timeline = Timeline(other.timeline.interval,
+                                         self._create_sampler,
+                                         started=other.timeline.started)
+            self.timeline.merge(other.timeline)
+
+    def relative_error_margin(self, confidence_level=95):
+        """The error margin of the mean relative to the mean.
+
+        Unlike the ``error_margin`` of `get`, it's based on all measured
+        values instead of the samples and cheap to compute.
+
+        >>> stats = Stats()
+        >>> for value in [9.0, 10.0, 11.0]:
+        ...     stats.measure(value)
+        >>> round(stats.relative_error_margin(), 3)
+        0.113
+        """
+        running = self._running
+        if running.count < 2:
+            return math.inf
+        margin = error_margin(confidence_level, math.sqrt(running.variance), running.count)
+        if margin == 0:
+            return 0.0
+        if running.mean == 0:
+            return math.inf
+        return margin / abs(running.mean)
+
+    def measure_series(self, name, value):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = Stats(self._create_sampler)
+        series.measure(value)
 
     def get(self):
+        result = self._get()
+        for name, series in self.series.items():
+            result[name] = series.get()
+        if self.timeouts:
+            result['timeouts'] = self.timeouts
+        if self.cancelled:
+            result['cancelled'] = self.cancelled
+        if self.errors:
+            result['errors'] = dict(self.errors)
+        num_failed = self.timeouts + sum(self.errors.values())
+        if num_failed:
+            result['error_rate'] = num_failed / (self.sampler.count + num_failed)
+        return result
+
+    def _get(self):
         values = sorted(self.sampler.values)
         count = len(values)
         # instead of failing return empty / subset so that json2insert & co
@@ -146,3 +373,98 @@ class Stats:
             n=self.sampler.count,
             samples=self.sampler.values
         )
+
+
+class _TimelineBucket:
+    """Sampled values and the number of errors of one interval of a `Timeline`"""
+
+    def __init__(self, sampler):
+        self.sampler = sampler()
+        self.errors = 0
+
+    def merge(self, other):
+        self.sampler.merge(other.sampler)
+        self.errors += other.errors
+
+    def get(self):
+        values = sorted(self.sampler.values)
+        if not values:
+            return dict(n=0, errors=self.errors, mean=None, p50=None, p99=None)
+        return dict(
+            n=self.sampler.count,
+            errors=self.errors,
+            mean=statistics.mean(values),
+            p50=percentile(values, 50),
+            p99=percentile(values, 99)
+        )
+
+
+class Timeline:
+    """Measured values grouped into buckets of a fixed ``interval`` in seconds.
+
+    Buckets are relative to ``started``, a `time.time` value, so that
+    timelines recorded in different processes can be merged.
+
+    >>> timeline = Timeline(1.0, All, started=100.0)
+    >>> timeline.measure(2.0, now=100.2)
+    >>> timeline.measure(4.0, now=100.9)
+    >>> timeline.error(now=102.5)
+    >>> for bucket in timeline.get():
+    ...     print(bucket)
+    {'elapsed': 0.0, 'n': 2, 'errors': 0, 'mean': 3.0, 'p50': 2.0, 'p99': 4.0}
+    {'elapsed': 1.0, 'n': 0, 'errors': 0, 'mean': None, 'p50': None, 'p99': None}
+    {'elapsed': 2.0, 'n': 0, 'errors': 1, 'mean': None, 'p50': None, 'p99': None}
+    """
+
+    def __init__(self, interval=1.0, sampler=None, started=None):
+        self.interval = interval
+        self.started = time.time() if started is None else started
+        self._create_sampler = sampler or UniformReservoir
+        self.buckets: Dict[int, _TimelineBucket] = {}
+
+    def _bucket(self, now):
+        if now is None:
+            now = time.time()
+        idx = max(0, int((now - self.started) / self.interval))
+        bucket = self.buckets.get(idx)
+        if bucket is None:
+            bucket = self.buckets[idx] = _TimelineBucket(self._create_sampler)
+        return bucket
+
+    def measure(self, value, now=None):
+        self._bucket(now).sampler.add(value)
+
+    def error(self, now=None):
+        self._bucket(now).errors += 1
+
+    def merge(self, other):
+        """Merge the buckets of ``other``, aligned by their start time.
+
+        >>> t1 = Timeline(1.0, All, started=100.0)
+        >>> t1.measure(1.0, now=100.5)
+        >>> t2 = Timeline(1.0, All, started=99.0)
+        >>> t2.measure(3.0, now=100.5)
+        >>> t1.merge(t2)
+        >>> [(b['elapsed'], b['n'], b['mean']) for b in t1.get()]
+        [(0.0, 0, None), (1.0, 2, 2.0)]
+        """
+        shift = round((other.started - self.started) / self.interval)
+        if shift < 0:
+            self.buckets = {idx - shift: b for idx, b in self.buckets.items()}
+            self.started = other.started
+            shift = 0
+        for idx, bucket in other.buckets.items():
+            own = self.buckets.get(idx + shift)
+            if own is None:
+                own = self.buckets[idx + shift] = _TimelineBucket(self._create_sampler)
+            own.merge(bucket)
+
+    def get(self):
+        """Return a list with the stats of each interval, including empty ones"""
+        if not self.buckets:
+            return []
+        result = []
+        for idx in range(max(self.buckets) + 1):
+            bucket = self.buckets.get(idx) or _TimelineBucket(self._create_sampler)
+            result.append(dict(elapsed=idx * self.interval, **bucket.get()))
+        return result
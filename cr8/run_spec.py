@@ -6,10 +6,19 @@ import subprocess
 from functools import partial
 from typing import Iterable
 
-from cr8 import aio, clients
+from cr8 import aio, arg_sources, clients
 from cr8.insert_json import to_insert
 from cr8.bench_spec import load_spec
-from cr8.engine import Runner, Result, run_and_measure, eval_fail_if
+from cr8.engine import (
+    Runner,
+    Result,
+    AutoWarmup,
+    WeightedStatement,
+    DEFAULT_MAX_ITERATIONS,
+    run_and_measure,
+    eval_fail_if,
+    to_warmup,
+)
 from cr8.misc import (
     as_bulk_queries,
     as_statements,
@@ -18,7 +27,8 @@ from cr8.misc import (
     try_len
 )
 from cr8.cli import dicts_from_lines
-from cr8.log import Logger
+from cr8.exceptions import ArgumentError
+from cr8.log import Logger, format_confidence
 
 
 BENCHMARK_TABLE = '''
@@ -37,6 +47,14 @@ create table if not exists benchmarks (
     ended timestamp,
     concurrency int,
     bulk_size int,
+    pool_setup_duration double,
+    prepared_statements object as (
+        hits bigint,
+        misses bigint
+    ),
+    rate double,
+    warmup_iterations integer,
+    weight double,
     runtime_stats object (strict) as (
         avg double,
         min double,
@@ -54,12 +72,63 @@ create table if not exists benchmarks (
         n integer,
         variance double,
         stdev double,
-        samples array(double)
-    )
+        samples array(double),
+        client object,
+        server object,
+        overhead object,
+        encode object,
+        compress object,
+        request_size object,
+        send_delay object,
+        loop_lag object,
+        timeouts integer,
+        cancelled integer,
+        errors object as (
+            sql integer,
+            connection integer,
+            rejected integer,
+            other integer
+        ),
+        error_rate double,
+        failed object
+    ),
+    timeline array(object (strict) as (
+        elapsed double,
+        n integer,
+        errors integer,
+        mean double,
+        p50 double,
+        p99 double
+    ))
 ) clustered into 8 shards with (number_of_replicas = '1-3', column_policy='strict')
 '''
 
 
+# Options of a query which only apply to a single statement. With a mix,
+# arguments are set per statement of the mix.
+_NOT_SUPPORTED_WITH_MIX = (
+    'args', 'bulk_args', 'arg_sources', 'args_file', 'error_margin', 'min_iterations')
+
+
+def validate_queries(queries: Iterable[dict]):
+    """Raise an `ArgumentError` for options that can't be combined with ``mix``
+
+    >>> validate_queries([{'mix': [{'statement': 'select 1'}], 'error_margin': 0.1}])
+    Traceback (most recent call last):
+    ...
+    cr8.exceptions.ArgumentError: Query with `mix` doesn't support: error_margin
+    """
+    for query in queries:
+        if not query.get('mix'):
+            continue
+        unsupported = [key for key in _NOT_SUPPORTED_WITH_MIX if key in query]
+        if unsupported:
+            raise ArgumentError(
+                "Query with `mix` doesn't support: " + ', '.join(unsupported))
+        if query.get('processes', 1) > 1:
+            raise ArgumentError('Query with `mix` cannot use more than one process')
+
+
 def _result_to_crate(log, client):
     table_created = []
 
@@ -81,8 +150,12 @@ class Executor:
                  result_hosts,
                  log,
                  fail_if,
-                 sample_mode):
+                 sample_mode,
+                 load_balancing=None,
+                 sniff_interval=None):
         self.benchmark_hosts = benchmark_hosts
+        self.load_balancing = load_balancing
+        self.sniff_interval = sniff_interval
         self.sample_mode = sample_mode
         self.spec_dir = spec_dir
         self.client = clients.client(benchmark_hosts)
@@ -168,6 +241,7 @@ class Executor:
             timed_stats=timed_stats,
             concurrency=concurrency,
             bulk_size=bulk_size,
+            pool_setup_duration=self.client.pool_setup_duration
         ))
 
     def _skip_message(self, min_version, stmt):
@@ -180,15 +254,42 @@ class Executor:
         return msg
 
     def run_queries(self, queries: Iterable[dict], meta=None, session_settings=None):
+        queries = list(queries)
+        validate_queries(queries)
         for query in queries:
-            stmt = query['statement']
-            iterations = query.get('iterations', 1)
-            warmup = query.get('warmup', 0)
+            mix = query.get('mix')
+            if mix:
+                statements = [
+                    WeightedStatement(
+                        m['statement'],
+                        m.get('weight', 1.0),
+                        m.get('args'),
+                        m.get('bulk_args'),
+                        arg_sources.from_spec(m, self.spec_dir)
+                    )
+                    for m in mix
+                ]
+                stmt = '; '.join(s.stmt for s in statements)
+            else:
+                stmt = query['statement']
+            error_margin = query.get('error_margin')
+            min_iterations = query.get('min_iterations')
+            # With error_margin, iterations is an upper bound
+            iterations = query.get('iterations', None if error_margin else 1)
+            warmup = to_warmup(query.get('warmup', 0))
             duration = query.get('duration')
             name = query.get('name')
             concurrency = query.get('concurrency', 1)
             args = query.get('args')
             bulk_args = query.get('bulk_args')
+            args_source = arg_sources.from_spec(query, self.spec_dir)
+            discard_rows = query.get('discard_rows', False)
+            prepare = query.get('prepare')
+            timeout = query.get('timeout')
+            rate = query.get('rate')
+            processes = query.get('processes', 1)
+            timeline_interval = query.get('timeline_interval')
+            track_failed = query.get('track_failed', False)
             _min_version = query.get('min_version')
             min_version = _min_version and parse_version(_min_version)
             if min_version and min_version > self.server_version:
@@ -196,34 +297,103 @@ class Executor:
                 continue
             mode_desc = 'Duration' if duration else 'Iterations'
             name_line = name and f'   Name: {name}\n' or ''
+            rate_line = rate and f'\n   Rate: {rate}/s' or ''
+            error_margin_line = error_margin and f'\n   Error margin: {error_margin}' or ''
+            if mix:
+                statement_lines = '   Mix:\n' + ''.join(
+                    f'     {s.stmt} (weight: {s.weight})\n' for s in statements)
+            else:
+                statement_lines = f'   Statement:\n     {stmt}\n'
             self.log.info(
                 (f'\n## Running Query:\n'
                  f'{name_line}'
-                 f'   Statement:\n'
-                 f'     {stmt}\n'
+                 f'{statement_lines}'
                  f'   Concurrency: {concurrency}\n'
-                 f'   {mode_desc}: {duration or iterations}')
+                 f'   {mode_desc}: {duration or iterations or DEFAULT_MAX_ITERATIONS}'
+                 f'{rate_line}'
+                 f'{error_margin_line}')
             )
-            with Runner(self.benchmark_hosts, concurrency, self.sample_mode, session_settings) as runner:
-                if warmup > 0:
-                    runner.warmup(stmt, warmup, concurrency, args)
-                timed_stats = runner.run(
-                    stmt,
-                    iterations=iterations,
-                    duration=duration,
-                    args=args,
-                    bulk_args=bulk_args
-                )
-            result = self.create_result(
-                statement=stmt,
+            with Runner(self.benchmark_hosts,
+                        concurrency,
+                        self.sample_mode,
+                        session_settings,
+                        discard_rows=discard_rows,
+                        prepare=prepare,
+                        load_balancing=self.load_balancing,
+                        sniff_interval=self.sniff_interval,
+                        timeout=timeout,
+                        processes=processes) as runner:
+                if mix:
+                    warmup_iterations = []
+                    for statement in statements:
+                        if warmup:
+                            runner.warmup(statement.stmt,
+                                          warmup,
+                                          concurrency,
+                                          statement.args,
+                                          statement.args_source)
+                        warmup_iterations.append(runner.warmup_iterations)
+                    timed_stats, per_statement = runner.run_mixed(
+                        statements,
+                        iterations=iterations,
+                        duration=duration,
+                        rate=rate,
+                        timeline_interval=timeline_interval,
+                        track_failed=track_failed
+                    )
+                else:
+                    if warmup:
+                        runner.warmup(stmt, warmup, concurrency, args, args_source)
+                    timed_stats = runner.run(
+                        stmt,
+                        iterations=iterations,
+                        duration=duration,
+                        args=args,
+                        bulk_args=bulk_args,
+                        args_source=args_source,
+                        rate=rate,
+                        timeline_interval=timeline_interval,
+                        error_margin=error_margin,
+                        min_iterations=min_iterations,
+                        track_failed=track_failed
+                    )
+            if isinstance(warmup, AutoWarmup) and not mix:
+                self.log.info(f'   Warmup iterations: {runner.warmup_iterations}')
+            if error_margin:
+                self.log.info('   ' + format_confidence(timed_stats.stats))
+            create_result = partial(
+                self.create_result,
                 meta=meta,
-                timed_stats=timed_stats,
                 concurrency=concurrency,
-                bulk_size=try_len(bulk_args),
-                name=name
+                name=name,
+                pool_setup_duration=runner.pool_setup_duration,
+                prepared_statements=runner.prepared_statements,
+                rate=rate
             )
-            self.process_result(result)
-            self.fail_if(result)
+            if mix:
+                total_weight = sum(s.weight for s in statements)
+                results = [
+                    create_result(
+                        statement=s.stmt,
+                        timed_stats=statement_stats,
+                        bulk_size=try_len(s.bulk_args),
+                        warmup_iterations=num_warmup,
+                        weight=s.weight / total_weight
+                    )
+                    for s, statement_stats, num_warmup
+                    in zip(statements, per_statement, warmup_iterations)
+                ]
+                results.append(create_result(statement=stmt, timed_stats=timed_stats, weight=1.0))
+            else:
+                results = [create_result(
+                    statement=stmt,
+                    timed_stats=timed_stats,
+                    bulk_size=try_len(bulk_args),
+                    warmup_iterations=runner.warmup_iterations
+                )]
+            for result in results:
+                self.process_result(result)
+                self.fail_if(result)
 
     def __enter__(self):
         return self
@@ -241,16 +411,21 @@ def do_run_spec(spec,
                 result_hosts=None,
                 action=None,
                 fail_if=None,
-                re_name=None):
+                re_name=None,
+                load_balancing=None,
+                sniff_interval=None):
     with Executor(
         spec_dir=os.path.dirname(spec),
         benchmark_hosts=benchmark_hosts,
         result_hosts=result_hosts,
         log=log,
         fail_if=fail_if,
-        sample_mode=sample_mode
+        sample_mode=sample_mode,
+        load_balancing=load_balancing,
+        sniff_interval=sniff_interval
     ) as executor:
         spec = load_spec(spec)
+        validate_queries(spec.queries)
         try:
             if not action or 'setup' in action:
                 log.info('# Running setUp')
@@ -283,7 +458,11 @@ def do_run_spec(spec,
 @argh.arg('--sample-mode', choices=('all', 'reservoir'),
           help='Method used for sampling', default='reservoir')
 @argh.arg('--re-name', type=str, help='Regex used to filter queries executed by name')
-@argh.wrap_errors([KeyboardInterrupt, BrokenPipeError] + clients.client_errors)
+@argh.arg('--load-balancing', choices=list(clients.load_balancers),
+          help='How requests of queries are distributed across hosts. Default: round-robin')
+@argh.arg('--sniff-interval', type=float,
+          help='Discover the nodes of the benchmark cluster via sys.nodes and re-discover them every N seconds')
+@argh.wrap_errors([KeyboardInterrupt, BrokenPipeError, ArgumentError] + clients.client_errors)
 def run_spec(spec,
              benchmark_hosts,
              *,
@@ -294,7 +473,9 @@ def run_spec(spec,
              action=None,
              fail_if=None,
              sample_mode='reservoir',
-             re_name=None):
+             re_name=None,
+             load_balancing=None,
+             sniff_interval=None):
     """Run a spec file, executing the statements on the benchmark_hosts.
 
     Short example of a spec file:
@@ -350,7 +531,9 @@ def run_spec(spec,
             action=action,
             fail_if=fail_if,
             sample_mode=sample_mode,
-            re_name=re_name
+            re_name=re_name,
+            load_balancing=load_balancing,
+            sniff_interval=sniff_interval
         )
 
 
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argh
+import json
+from time import time
+from typing import List, Optional, Dict, Any
+
+from cr8 import aio
+from cr8.cli import lines_from_stdin, to_int, to_list
+from cr8.misc import as_statements
+from cr8.log import Logger
+from cr8.clients import client_errors
+from cr8.metrics import Stats
+from cr8.engine import Runner, Result, TimedStats, to_warmup
+
+
+DEFAULT_CONCURRENCY_STEPS = [1, 2, 4, 8, 16, 32, 64]
+
+
+def to_step(result: Result, error: Optional[str] = None) -> Dict[str, Any]:
+    stats = result.runtime_stats
+    n = stats['n']
+    elapsed = (result.ended - result.started) / 1000.
+    return {
+        'concurrency': result.concurrency,
+        'rate': result.rate,
+        'n': n,
+        'throughput': n / elapsed if elapsed else 0.0,
+        'mean': stats.get('mean'),
+        'p50': stats.get('percentile', {}).get('50'),
+        'p99': stats.get('percentile', {}).get('99'),
+        'timeouts': stats.get('timeouts', 0),
+        'error_ratio': stats.get('error_rate', 0.0),
+        'error': error,
+    }
+
+
+def breach(step, max_p99=None, max_error_ratio=None) -> Optional[str]:
+    """Return why a step crossed a threshold, or None
+
+    >>> breach({'p99': 12.0, 'error_ratio': 0.0, 'error': None}, max_p99=10.0)
+    'p99 12.000 ms > 10.000 ms'
+    >>> breach({'p99': 8.0, 'error_ratio': 0.1, 'error': None}, max_error_ratio=0.05)
+    'error ratio 0.100 > 0.050'
+    >>> breach({'p99': 8.0, 'error_ratio': 0.0, 'error': None}, 10.0, 0.05)
+    """
+    if step['error']:
+        return 'error: ' + step['error']
+    p99 = step['p99']
+    if max_p99 is not None and p99 is not None and p99 > max_p99:
+        return f'p99 {p99:.3f} ms > {max_p99:.3f} ms'
+    error_ratio = step['error_ratio']
+    if max_error_ratio is not None and error_ratio > max_error_ratio:
+        return f'error ratio {error_ratio:.3f} > {max_error_ratio:.3f}'
+    return None
+
+
+def find_knee(curve: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Return the step with the highest throughput within the thresholds
+
+    >>> find_knee([
+    ...     {'throughput': 10, 'breach': None},
+    ...     {'throughput': 18, 'breach': None},
+    ...     {'throughput': 17, 'breach': None},
+    ...     {'throughput': 19, 'breach': 'p99 ...'},
+    ... ])
+    {'throughput': 18, 'breach': None}
+    """
+    within = [step for step in curve if not step['breach']]
+    if not within:
+        return None
+    return max(within, key=lambda step: step['throughput'])
+
+
+def _format_step(step) -> str:
+    rate = step['rate'] and f"{step['rate']:.1f}" or '-'
+    p99 = step['p99'] is not None and f"{step['p99']:.3f}" or '-'
+    return (f"    {step['concurrency']:>11}  {rate:>10}  "
+            f"{step['throughput']:>10.1f}  {p99:>10}  {step['error_ratio']:>11.3f}")
+
+
+def format_curve(curve, knee) -> str:
+    lines = [
+        'Saturation curve:',
+        '    concurrency        rate  throughput    p99 (ms)  error ratio',
+    ]
+    lines.extend(_format_step(step) for step in curve)
+    if curve and curve[-1]['breach']:
+        lines.append('Stopped: ' + curve[-1]['breach'])
+    if knee:
+        lines.append(
+            f"Knee: concurrency={knee['concurrency']} rate={knee['rate']} "
+            f"throughput={knee['throughput']:.1f}/s p99={knee['p99']}")
+    else:
+        lines.append('Knee: none, the first step already crossed a threshold')
+    return '\n'.join(lines)
+
+
+def run_steps(hosts,
+              stmt,
+              concurrency_steps,
+              rate_steps=None,
+              step_duration=10,
+              warmup=30,
+              max_p99=None,
+              max_error_ratio=None,
+              timeout=None,
+              sample_mode='reservoir',
+              on_result=None):
+    """Run ``stmt`` with increasing concurrency or rate until a threshold is
+    crossed and return the curve of all steps.
+
+    If ``rate_steps`` are given the load is increased using an open-loop
+    request rate and the largest concurrency is used for the connection pool.
+    """
+    if rate_steps:
+        steps = [(max(concurrency_steps), rate) for rate in rate_steps]
+    else:
+        steps = [(concurrency, None) for concurrency in concurrency_steps]
+    curve = []
+    version_info = None
+    for concurrency, rate in steps:
+        with Runner(hosts, concurrency, sample_mode, timeout=timeout) as runner:
+            if version_info is None:
+                version_info = aio.run(runner.client.get_server_version)
+            error = None
+            started = int(time() * 1000)
+            try:
+                if warmup:
+                    runner.warmup(stmt, warmup, concurrency)
+                timed_stats = runner.run(stmt, duration=step_duration, rate=rate)
+            except tuple(client_errors) as e:
+                error = str(e) or type(e).__name__
+                timed_stats = TimedStats(started, int(time() * 1000), Stats())
+        result = Result(
+            version_info=version_info,
+            statement=stmt,
+            timed_stats=timed_stats,
+            concurrency=concurrency,
+            pool_setup_duration=runner.pool_setup_duration,
+            rate=rate,
+            warmup_iterations=runner.warmup_iterations
+        )
+        if on_result:
+            on_result(result)
+        step = to_step(result, error)
+        step['breach'] = breach(step, max_p99, max_error_ratio)
+        curve.append(step)
+        if step['breach']:
+            break
+    return curve
+
+
+@argh.arg('--hosts', help='crate hosts', type=str)
+@argh.arg('-s', '--stmt', type=str)
+@argh.arg('-c', '--concurrency', type=to_list(to_int),
+          help='Comma separated concurrency of each step. Default: 1,2,4,8,16,32,64')
+@argh.arg('--rate', type=to_list(float),
+          help='Comma separated request rates per second of each step. Uses open-loop load')
+@argh.arg('-d', '--step-duration', type=to_int, help='Duration of each step in seconds')
+@argh.arg('-w', '--warmup', type=to_warmup,
+          help='Warmup iterations of each step, or "auto[:MAX]" to warm up until the runtime is stable')
+@argh.arg('--max-p99', type=float, help='Stop once the p99 in ms exceeds this value')
+@argh.arg('--max-error-ratio', type=float,
+          help='Stop once the ratio of failed or timed out requests exceeds this value')
+@argh.arg('--timeout', type=float, help='Deadline for a single request in seconds')
+@argh.arg('-of', '--output-fmt', choices=['json', 'text'], default='text')
+@argh.arg('--sample-mode', choices=('all', 'reservoir'),
+          help='Method used for sampling', default='reservoir')
+@argh.arg('--logfile-info', help='Redirect the curve and knee point to a file')
+@argh.arg('--logfile-result', help='Redirect the results of each step to a file')
+@argh.wrap_errors([KeyboardInterrupt, BrokenPipeError] + client_errors)
+def saturate(*,
+             hosts=None,
+             stmt=None,
+             concurrency=None,
+             rate=None,
+             step_duration=10,
+             warmup=30,
+             max_p99=None,
+             max_error_ratio=None,
+             timeout=None,
+             output_fmt=None,
+             sample_mode='reservoir',
+             logfile_info=None,
+             logfile_result=None):
+    """Increase the load in steps until a latency or error threshold is crossed
+
+    Each step runs the statement for `step-duration` seconds and outputs the
+    result, like `timeit`. Afterwards the curve of throughput and
+    percentiles is printed, together with the knee point: the step with the
+    highest throughput that stayed within the thresholds.
+
+    Args:
+        concurrency: Comma separated list of the concurrency of each step.
+            If `rate` is used, the largest value is used as connection pool
+            size.
+        rate: Comma separated list of request rates per second. If set, the
+            load is increased by starting requests at a fixed rate,
+            independent of their completion.
+        max-p99: Threshold for the 99th percentile in ms.
+        max-error-ratio: Threshold for the ratio of requests which failed or
+            timed out. If no request of a step succeeds, the search stops
+            immediately.
+    """
+    concurrency_steps = concurrency or DEFAULT_CONCURRENCY_STEPS
+    num_lines = 0
+    with Logger(output_fmt=output_fmt,
+                logfile_info=logfile_info,
+                logfile_result=logfile_result) as log:
+        for line in as_statements(lines_from_stdin(stmt)):
+            curve = run_steps(
+                hosts,
+                line,
+                concurrency_steps,
+                rate_steps=rate,
+                step_duration=step_duration,
+                warmup=warmup,
+                max_p99=max_p99,
+                max_error_ratio=max_error_ratio,
+                timeout=timeout,
+                sample_mode=sample_mode,
+                on_result=log.result
+            )
+            knee = find_knee(curve)
+            if output_fmt == 'json':
+                log.info(json.dumps({'statement': line, 'curve': curve, 'knee': knee}))
+            else:
+                log.info(format_curve(curve, knee))
+            num_lines += 1
+    if num_lines == 0:
+        raise SystemExit(
+            'No SQL statements provided. Use --stmt or provide statements via stdin')
+
+
+def main():
+    argh.dispatch_command(saturate)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,91 @@
 # -*- coding: utf-8 -*-
 
 import argh
+from functools import partial
 
 from cr8 import aio
-from cr8.cli import lines_from_stdin, to_int
+from cr8.arg_sources import ArgsFile
+from cr8.cli import lines_from_stdin, to_int, to_list
 from cr8.misc import as_statements
-from cr8.log import Logger
+from cr8.log import Logger, format_confidence, format_mix_header
+from cr8 import clients
 from cr8.clients import client_errors
-from cr8.engine import Runner, Result, eval_fail_if
+from cr8.engine import (
+    Runner,
+    Result,
+    AutoWarmup,
+    WeightedStatement,
+    eval_fail_if,
+    to_warmup,
+)
+
+
+def _run_mixed(runner,
+               log,
+               lines,
+               weights,
+               *,
+               version_info,
+               warmup,
+               repeat,
+               duration,
+               rate,
+               timeline_interval,
+               track_failed,
+               args_source,
+               output_fmt,
+               fail_if):
+    lines = list(lines)
+    if len(lines) != len(weights):
+        raise SystemExit(f'Got {len(weights)} weights for {len(lines)} statements')
+    warmup_iterations = []
+    for line in lines:
+        runner.warmup(line, warmup, args_source=args_source)
+        warmup_iterations.append(runner.warmup_iterations)
+    combined, per_statement = runner.run_mixed(
+        [WeightedStatement(line, weight, args_source=args_source)
+         for line, weight in zip(lines, weights)],
+        iterations=repeat,
+        duration=duration,
+        rate=rate,
+        timeline_interval=timeline_interval,
+        track_failed=track_failed
+    )
+    create_result = partial(
+        Result,
+        version_info=version_info,
+        concurrency=runner.concurrency,
+        pool_setup_duration=runner.pool_setup_duration,
+        prepared_statements=runner.prepared_statements,
+        rate=rate
+    )
+    total_weight = sum(weights)
+    results = [
+        create_result(
+            statement=line,
+            timed_stats=timed_stats,
+            weight=weight / total_weight,
+            warmup_iterations=num_warmup
+        )
+        for line, weight, timed_stats, num_warmup
+        in zip(lines, weights, per_statement, warmup_iterations)
+    ]
+    combined_result = create_result(
+        statement='; '.join(lines), timed_stats=combined, weight=1.0)
+    for r in results + [combined_result]:
+        if output_fmt != 'json':
+            label = 'Combined' if r is combined_result else None
+            log.info(format_mix_header(r, label))
+        log.result(r)
+        if fail_if:
+            eval_fail_if(fail_if, r)
+    return len(lines)
 
 
 @argh.arg('--hosts', help='crate hosts', type=str)
 @argh.arg('-s', '--stmt', type=str)
-@argh.arg('-w', '--warmup', type=to_int)
+@argh.arg('-w', '--warmup', type=to_warmup,
+          help='Number of warmup iterations, or "auto[:MAX]" to warm up until the runtime is stable')
 @argh.arg('-r', '--repeat', type=to_int)
 @argh.arg('--duration',
           type=to_int,
@@ -24,6 +97,33 @@ from cr8.engine import Runner, Result, eval_fail_if
           failure if it evaluates to true')
 @argh.arg('--sample-mode', choices=('all', 'reservoir'),
           help='Method used for sampling', default='reservoir')
+@argh.arg('--lazy-pool', action='store_true',
+          help='Open connections on demand instead of up-front')
+@argh.arg('--discard-rows', action='store_true',
+          help='Discard result rows without decoding them')
+@argh.arg('--prepare', choices=('always', 'never'),
+          help='Prepare statements explicitly or never (asyncpg only)')
+@argh.arg('--load-balancing', choices=list(clients.load_balancers),
+          help='How requests are distributed across hosts. Default: round-robin')
+@argh.arg('--sniff-interval', type=float,
+          help='Discover the nodes of the cluster via sys.nodes and re-discover them every N seconds')
+@argh.arg('--timeout', type=float, help='Deadline for a single request in seconds')
+@argh.arg('--rate', type=float,
+          help='Start requests at a fixed rate per second, independent of completions')
+@argh.arg('--processes', type=to_int,
+          help='Number of worker processes generating load. Default: 1')
+@argh.arg('--timeline-interval', type=float,
+          help='Include stats per interval of N seconds in the result')
+@argh.arg('--error-margin', type=float,
+          help='Repeat until the error margin of the mean relative to the mean is below this value')
+@argh.arg('--min-repeat', type=to_int,
+          help='Minimum number of iterations if --error-margin is used. Default: 30')
+@argh.arg('--track-failed', action='store_true',
+          help='Record the runtime of failed requests as separate "failed" series')
+@argh.arg('--weights', type=to_list(float),
+          help='Comma separated weights to run all statements as mixed workload')
+@argh.arg('--args-file',
+          help='File with the arguments of each iteration as JSON array per line')
 @argh.wrap_errors([KeyboardInterrupt, BrokenPipeError] + client_errors)
 def timeit(*,
            hosts=None,
@@ -34,10 +134,29 @@ def timeit(*,
            concurrency=1,
            output_fmt=None,
            fail_if=None,
-           sample_mode='reservoir'):
+           sample_mode='reservoir',
+           lazy_pool=False,
+           discard_rows=False,
+           prepare=None,
+           load_balancing=None,
+           sniff_interval=None,
+           timeout=None,
+           rate=None,
+           processes=1,
+           timeline_interval=None,
+           error_margin=None,
+           min_repeat=None,
+           track_failed=False,
+           weights=None,
+           args_file=None):
     """Run the given statement a number of times and return the runtime stats
 
     Args:
+        warmup: Number of iterations to run before measuring.
+            auto: Run until the median runtime of consecutive windows of 20
+                iterations changed by less than 5 percent three times in a row, up
+                to 1000 iterations. The number of iterations is reported.
+            auto:MAX: Like auto, but with at most MAX iterations.
         fail-if: An expression that causes cr8 to exit with a failure if it
             evaluates to true.
             The expression can contain formatting expressions for:
@@ -48,20 +167,123 @@ def timeit(*,
                 - bulk_size
             For example:
                 --fail-if "{runtime_stats.mean} > 1.34"
+        discard-rows: Skip decoding the result rows and only extract the
+            duration and rowcount. Useful for queries returning large results
+            where decoding would limit the client.
+        prepare: Only applies to the asyncpg scheme.
+            always: Prepare statements explicitly and cache them per
+                connection. The cache hits and misses are included in the
+                result.
+            never: Parse and describe the statements on every execution.
+            By default the implicit statement cache of asyncpg is used.
+        load-balancing: Only applies to HTTP.
+            round-robin: Cycle through the hosts.
+            least-outstanding: Pick the host with the fewest in-flight
+                requests. Hosts with connection errors, including hosts
+                which are down at the start, are ejected temporarily.
+        sniff-interval: Only applies to HTTP. If set, requests are spread
+            across all nodes listed in ``sys.nodes`` instead of only the
+            given hosts. The nodes are discovered again every N seconds.
+        timeout: Deadline for a single request in seconds. Requests exceeding
+            it are aborted and counted as ``timeouts`` in the runtime stats.
+            With ``--duration``, requests still in-flight once the duration
+            is over are cancelled.
+        rate: Number of requests started per second. Requests are started
+            independent of the completion of previous requests and the
+            runtime is measured from the time a request was supposed to
+            start, so that a slow server doesn't lower the offered load.
+            Concurrency then limits the number of connections.
+        processes: Number of worker processes, each with its own event loop
+            and connections. Concurrency, iterations, warmup and rate are
+            split across the workers and their measurements are merged.
+        timeline-interval: If set, the result contains a ``timeline`` with
+            the number of requests, errors, mean, p50 and p99 of each
+            interval of N seconds. Only included in the json output.
+        error-margin: Keep running the statement until the 95 percent error
+            margin of the mean is below this fraction of the mean, for
+            example 0.01. ``--repeat`` (default 10000) and ``--duration``
+            become upper bounds. Fast, stable statements stop early while
+            noisy ones get more samples.
+        weights: Comma separated weights, one per statement. Instead of
+            one after another, all statements are run as one mixed workload:
+            each request runs a statement drawn according to the weights,
+            sharing the concurrency or rate. The result of each statement
+            and the combined result are reported.
+        args-file: Path of a file containing one JSON array per line, for
+            example ``[1, "Arthur"]``. Each iteration uses the arguments of
+            the next line instead of running the statement with the same
+            arguments over and over again, which would mostly measure the
+            caches. The lines are read before the measurements start. If
+            there are more iterations than lines, the lines are repeated.
+
+    Failed requests don't count towards the runtime stats. They're counted
+    per category (sql, connection, rejected, other) in ``errors``, together
+    with ``timeouts`` in the ``error_rate``. The run fails only if no request
+    succeeded.
     """
+    if weights and error_margin:
+        raise SystemExit('--error-margin cannot be used together with --weights')
+    args_source = args_file and ArgsFile(args_file)
     num_lines = 0
     log = Logger(output_fmt)
-    with Runner(hosts, concurrency, sample_mode) as runner:
+    with Runner(hosts,
+                concurrency,
+                sample_mode,
+                lazy_pool=lazy_pool,
+                discard_rows=discard_rows,
+                prepare=prepare,
+                load_balancing=load_balancing,
+                sniff_interval=sniff_interval,
+                timeout=timeout,
+                processes=processes) as runner:
         version_info = aio.run(runner.client.get_server_version)
-        for line in as_statements(lines_from_stdin(stmt)):
-            runner.warmup(line, warmup)
-            timed_stats = runner.run(line, iterations=repeat, duration=duration)
+        lines = as_statements(lines_from_stdin(stmt))
+        if weights:
+            num_lines = _run_mixed(
+                runner,
+                log,
+                lines,
+                weights,
+                version_info=version_info,
+                warmup=warmup,
+                repeat=repeat,
+                duration=duration,
+                rate=rate,
+                timeline_interval=timeline_interval,
+                track_failed=track_failed,
+                args_source=args_source,
+                output_fmt=output_fmt,
+                fail_if=fail_if
+            )
+            lines = []
+        for line in lines:
+            runner.warmup(line, warmup, args_source=args_source)
+            timed_stats = runner.run(
+                line,
+                iterations=repeat,
+                duration=duration,
+                args_source=args_source,
+                rate=rate,
+                timeline_interval=timeline_interval,
+                error_margin=error_margin,
+                min_iterations=min_repeat,
+                track_failed=track_failed
+            )
             r = Result(
                 version_info=version_info,
                 statement=line,
                 timed_stats=timed_stats,
-                concurrency=concurrency
+                concurrency=concurrency,
+                pool_setup_duration=runner.pool_setup_duration,
+                prepared_statements=runner.prepared_statements,
+                rate=rate,
+                warmup_iterations=runner.warmup_iterations
             )
+            if output_fmt != 'json':
+                if isinstance(warmup, AutoWarmup):
+                    log.info(f'Warmup iterations: {r.warmup_iterations}')
+                if error_margin:
+                    log.info(format_confidence(timed_stats.stats))
             log.result(r)
             if fail_if:
                 eval_fail_if(fail_if, r)
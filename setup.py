@@ -32,7 +32,7 @@ setup(
         'asyncpg'
     ],
     extras_require={
-        'extra': ['uvloop', 'pysimdjson'],
+        'extra': ['uvloop', 'pysimdjson', 'orjson'],
         "dev": ["asyncpg-stubs", "mypy"]
     },
     python_requires='>=3.7',
@@ -0,0 +1,68 @@
+"""Micro-benchmark of the executors in ``cr8.aio``
+
+Compares the fixed worker pool used by ``run_many`` with the task-per-item
+queue (``qmap`` + ``consume``) it replaced. The coroutine doesn't do any I/O,
+so the numbers show the overhead of the executor itself.
+
+Run with::
+
+    python -m tests.bench_aio
+"""
+
+import os
+os.environ.setdefault('CR8_NO_TQDM', 'True')
+
+import argparse  # noqa: E402
+import time  # noqa: E402
+
+from cr8 import aio  # noqa: E402
+from cr8.aio import asyncio  # noqa: E402
+
+
+async def _noop():
+    await asyncio.sleep(0)
+
+
+async def _queued(coro, iterable, concurrency, total):
+    q = asyncio.Queue(maxsize=concurrency)
+    await asyncio.gather(
+        aio.qmap(q, coro, iterable),
+        aio.consume(q, total=total)
+    )
+
+
+async def _workers(coro, iterable, concurrency, total):
+    await aio.run_workers(coro, iterable, concurrency, total=total)
+
+
+EXECUTORS = {
+    'queue': _queued,
+    'workers': _workers,
+}
+
+
+def bench(executor, num_items, concurrency):
+    loop = asyncio.get_event_loop()
+    items = (() for _ in range(num_items))
+    start = time.perf_counter()
+    loop.run_until_complete(executor(_noop, items, concurrency, num_items))
+    return num_items / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--num-items', type=int, default=100000)
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+',
+                        default=[1, 10, 100])
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    args = parser.parse_args()
+    print(f'{"executor":<10} {"concurrency":>11} {"items/s":>12}')
+    for concurrency in args.concurrency:
+        for name, executor in EXECUTORS.items():
+            best = max(bench(executor, args.num_items, concurrency)
+                       for _ in range(args.repeats))
+            print(f'{name:<10} {concurrency:>11} {best:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+import io
+import time
+from unittest.mock import patch
+from doctest import DocTestSuite
+from functools import partial
+from unittest import TestCase, main
+
+from cr8 import aio, clients
+from cr8.metrics import DEFAULT_NUM_SAMPLES, Stats
+
+
+class MeasureTest(TestCase):
+
+    def test_measure_records_client_server_and_overhead_series(self):
+        async def execute():
+            await aio.asyncio.sleep(0.01)
+            return {'duration': 2.0}
+
+        stats = Stats()
+        aio.run(aio.measure, stats, execute)
+        result = stats.get()
+        self.assertEqual(result['mean'], 2.0)
+        self.assertEqual(result['server']['mean'], 2.0)
+        self.assertGreaterEqual(result['client']['mean'], 10.0)
+        self.assertAlmostEqual(
+            result['overhead']['mean'],
+            result['client']['mean'] - 2.0)
+
+    def test_measure_skips_server_series_if_not_reported(self):
+        async def execute():
+            return {'duration': 2.0, 'server_duration': None}
+
+        stats = Stats()
+        aio.run(aio.measure, stats, execute)
+        result = stats.get()
+        self.assertEqual(result['client']['n'], 1)
+        self.assertNotIn('server', result)
+        self.assertNotIn('overhead', result)
+
+    def test_measure_counts_timeouts(self):
+        async def execute():
+            raise aio.asyncio.TimeoutError()
+
+        stats = Stats()
+        self.assertIsNone(aio.run(aio.measure, stats, execute))
+        self.assertEqual(stats.get(), {'n': 0, 'timeouts': 1, 'error_rate': 1.0})
+
+    def test_measure_counts_errors_by_category(self):
+        async def execute(e):
+            await aio.asyncio.sleep(0.01)
+            raise e
+
+        stats = Stats()
+        stats.track_failed = True
+        stats.raise_errors = False
+        aio.run(aio.measure, stats, execute, ConnectionRefusedError())
+        aio.run(aio.measure, stats, execute, clients.SqlException('boom', 400))
+        aio.run(aio.measure, stats, execute,
+                clients.SqlException('RejectedExecutionException', 500))
+        result = stats.get()
+        self.assertEqual(result['errors'], {'connection': 1, 'sql': 1, 'rejected': 1})
+        self.assertEqual(result['error_rate'], 1.0)
+        self.assertEqual(result['failed']['n'], 3)
+        self.assertGreaterEqual(result['failed']['min'], 10.0)
+        self.assertIsInstance(stats.last_error, clients.SqlException)
+
+    def test_measure_raises_errors_after_counting_them_by_default(self):
+        async def execute():
+            raise clients.SqlException('Table unknown', 404)
+
+        stats = Stats()
+        with self.assertRaises(clients.SqlException):
+            aio.run(aio.measure, stats, execute)
+        self.assertEqual(stats.get()['errors'], {'sql': 1})
+
+
+class RunManyTest(TestCase):
+
+    def test_in_flight_work_is_cancelled_at_the_deadline(self):
+        stats = Stats()
+
+        async def execute(delay):
+            await aio.asyncio.sleep(delay)
+            return {'duration': delay}
+
+        f = partial(aio.measure, stats, execute)
+        loop = aio.asyncio.get_event_loop()
+        start = loop.time()
+        aio.run_many(f, [(0.01,), (0.01,), (10,), (10,), (0.01,)],
+                     concurrency=2, timeout=0.2, grace_period=0.1)
+        self.assertLess(loop.time() - start, 5)
+        result = stats.get()
+        # the last item is never started: both workers are stuck at that point
+        self.assertEqual(result['n'], 2)
+        self.assertEqual(result['cancelled'], 2)
+
+    def test_deadline_also_applies_without_concurrency(self):
+        stats = Stats()
+
+        async def execute(delay):
+            await aio.asyncio.sleep(delay)
+            return {'duration': delay}
+
+        f = partial(aio.measure, stats, execute)
+        aio.run_many(f, [(0.01,), (10,), (0.01,)], concurrency=1, timeout=0.2, grace_period=0.1)
+        result = stats.get()
+        self.assertEqual(result['n'], 1)
+        self.assertEqual(result['cancelled'], 1)
+
+    def test_in_flight_work_completes_within_the_grace_period(self):
+        stats = Stats()
+
+        async def execute(delay):
+            await aio.asyncio.sleep(delay)
+            return {'duration': delay}
+
+        f = partial(aio.measure, stats, execute)
+        aio.run_many(f, [(0.15,)] * 10, concurrency=2, timeout=0.2, grace_period=1)
+        result = stats.get()
+        self.assertEqual(result['n'], 4)
+        self.assertNotIn('cancelled', result)
+
+
+class RunWorkersTest(TestCase):
+
+    def test_at_most_concurrency_items_are_in_flight(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def execute():
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(in_flight, max_in_flight)
+            await aio.asyncio.sleep(0.001)
+            in_flight -= 1
+
+        aio.run_many(execute, [()] * 20, concurrency=3)
+        self.assertEqual(max_in_flight, 3)
+
+    def test_errors_are_raised_after_all_items_are_processed(self):
+        processed = []
+
+        async def execute(i):
+            processed.append(i)
+            if i == 2:
+                raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            aio.run(aio.run_workers, execute, [(i,) for i in range(5)], 2)
+        self.assertEqual(sorted(processed), [0, 1, 2, 3, 4])
+
+    def test_concurrency_must_be_positive(self):
+        async def execute():
+            pass
+
+        with self.assertRaises(ValueError):
+            aio.run(aio.run_workers, execute, [()], 0)
+
+    def test_slow_item_does_not_block_others(self):
+        done = []
+
+        async def execute(delay):
+            await aio.asyncio.sleep(delay)
+            done.append(delay)
+
+        aio.run_many(execute, [(0.3,)] + [(0.001,)] * 5, concurrency=2)
+        self.assertEqual(done[-1], 0.3)
+
+
+class ProgressTest(TestCase):
+
+    def test_bar_is_refreshed_with_counts_and_p99_on_a_timer(self):
+        stats = Stats()
+        progress = aio.Progress(total=10, stats=stats, interval=0.05)
+
+        async def run():
+            with progress as t:
+                for i in range(10):
+                    stats.measure(float(i))
+                    t.update(1)
+                # updates are only counted until the timer fires
+                self.assertEqual(t._bar.n, 0)
+                await aio.asyncio.sleep(0.08)
+                self.assertEqual(t._bar.n, 10)
+                self.assertIn('p99=9.000 ms', str(t._bar))
+
+        with patch.object(aio, 'tqdm', partial(aio.tqdm, disable=False, file=io.StringIO())):
+            aio.run(run)
+        self.assertIsNone(stats.recent)
+
+    def test_recent_values_are_sampled(self):
+        stats = Stats()
+        progress = aio.Progress(stats=stats, interval=60)
+        with patch.object(aio, 'tqdm', partial(aio.tqdm, disable=False, file=io.StringIO())):
+            with progress:
+                for i in range(5000):
+                    stats.measure(float(i))
+                self.assertEqual(stats.recent.count, 5000)
+                self.assertEqual(len(stats.recent.values), DEFAULT_NUM_SAMPLES)
+
+
+class LagMonitorTest(TestCase):
+
+    def test_blocking_the_loop_is_recorded_as_lag(self):
+        stats = Stats()
+
+        async def execute():
+            # blocks the event loop like a saturated client
+            time.sleep(0.02)
+            await aio.asyncio.sleep(0)
+
+        aio.run_many(execute, [()] * 10, concurrency=2, stats=stats)
+        loop_lag = stats.get()['loop_lag']
+        self.assertGreater(loop_lag['n'], 1)
+        self.assertGreaterEqual(loop_lag['max'], 15.0)
+
+    def test_nothing_is_recorded_without_stats(self):
+        async def run():
+            with aio.LagMonitor(None) as monitor:
+                await aio.asyncio.sleep(0.01)
+            return monitor
+
+        self.assertIsNone(aio.run(run)._handle)
+
+
+class RunAtRateTest(TestCase):
+
+    def test_requests_are_started_independent_of_completions(self):
+        starts = []
+
+        async def execute(intended_start, delay):
+            starts.append(time.perf_counter() - intended_start)
+            await aio.asyncio.sleep(delay)
+
+        start = time.perf_counter()
+        aio.run_at_rate(execute, [(0.2,)] * 5, rate=100)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(starts), 5)
+        # closed-loop with one request at a time would take 1 second
+        self.assertLess(elapsed, 0.6)
+        self.assertLess(max(starts), 0.1)
+
+    def test_measure_from_records_latency_from_intended_start(self):
+        async def execute():
+            return {'duration': 1.0}
+
+        stats = Stats()
+        intended_start = time.perf_counter() - 0.05
+        aio.run(aio.measure_from, stats, execute, intended_start)
+        result = stats.get()
+        self.assertGreaterEqual(result['mean'], 50.0)
+        self.assertGreaterEqual(result['send_delay']['mean'], 50.0)
+        self.assertEqual(result['server']['mean'], 1.0)
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(DocTestSuite(aio))
+    return tests
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+from doctest import DocTestSuite
+from unittest import TestCase, main
+
+from cr8 import aio, arg_sources, clients
+from cr8.arg_sources import ArgSources, ArgsFile
+from cr8.fake_server import FakeServer
+
+
+class ArgSourcesTest(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('1\n"x"\n\nArthur Dent\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_values_of_each_source(self):
+        sources = ArgSources([
+            {'randint': [1, 3]},
+            {'file': os.path.basename(self.path)},
+            {'fake': ['random_int', [10, 20]]},
+        ], base_dir=os.path.dirname(self.path))
+        args = aio.run(sources.generate, None, 50)
+        self.assertEqual(len(args), 50)
+        self.assertEqual({a[0] for a in args}, {1, 2, 3})
+        self.assertEqual({a[1] for a in args}, {1, 'x', 'Arthur Dent'})
+        self.assertTrue(all(10 <= a[2] <= 20 for a in args))
+
+    def test_values_sampled_from_a_column(self):
+        async def generate():
+            async with FakeServer(port=0, rows=3) as server:
+                client = clients.HttpClient([server.http_url])
+                try:
+                    sources = ArgSources([{'column': 'doc.t.x'}])
+                    return await sources.generate(client, 4)
+                finally:
+                    await client._close()
+
+        self.assertEqual(aio.run(generate), [[1], [1], [1], [1]])
+
+    def test_column_values_are_sampled_with_a_client_discarding_rows(self):
+        statements = []
+
+        async def generate():
+            async with FakeServer(port=0, rows=3) as server:
+                client = clients.HttpClient([server.http_url], discard_rows=True)
+                execute = client.execute
+
+                async def record(stmt, args=None):
+                    statements.append(stmt)
+                    return await execute(stmt, args)
+                client.execute = record
+                try:
+                    sources = ArgSources([{'column': 'doc.t.x'}])
+                    args = await sources.generate(client, 2)
+                    self.assertTrue(client.discard_rows)
+                    return args
+                finally:
+                    await client._close()
+
+        self.assertEqual(aio.run(generate), [[1], [1]])
+        self.assertEqual(statements, ['select x from doc.t order by random() limit 2'])
+
+    def test_invalid_source_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ArgSources([{'randint': [1, 2], 'choice': [1]}])
+        with self.assertRaises(ValueError):
+            ArgSources([{'uuid': True}])
+
+    def test_args_file_is_read_up_to_the_number_of_iterations(self):
+        with open(self.path, 'w') as f:
+            f.write('[1, "a"]\n[2, "b"]\n[3, "c"]\n')
+        args = aio.run(ArgsFile(self.path).generate, None, 2)
+        self.assertEqual(args, [[1, 'a'], [2, 'b']])
+
+    def test_args_file_continues_after_the_previous_lines(self):
+        with open(self.path, 'w') as f:
+            f.write('[1]\n[2]\n[3]\n')
+        args_file = ArgsFile(self.path)
+        self.assertEqual(aio.run(args_file.generate, None, 2), [[1], [2]])
+        self.assertEqual(aio.run(args_file.generate, None, 2), [[3], [1]])
+        self.assertEqual(aio.run(args_file.generate, None, 5), [[2], [3], [1]])
+
+    def test_args_file_is_split_between_workers(self):
+        with open(self.path, 'w') as f:
+            f.write('[1]\n[2]\n[3]\n')
+        workers = [ArgsFile(self.path).for_worker(i, 2) for i in range(2)]
+        self.assertEqual(aio.run(workers[0].generate, None, 3), [[1], [3]])
+        self.assertEqual(aio.run(workers[1].generate, None, 3), [[2]])
+        short = ArgsFile(self.path).for_worker(3, 4)
+        self.assertEqual(aio.run(short.generate, None, 3), [[1], [2], [3]])
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(DocTestSuite(arg_sources))
+    return tests
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,43 @@
+import contextlib
 import json
+from collections import Counter
 from datetime import datetime, date
 from decimal import Decimal
-from unittest import main, TestCase
+from unittest import main, TestCase, skipIf
+from unittest.mock import patch
+import aiohttp
 from doctest import DocTestSuite
-from cr8 import clients
-from cr8.clients import CrateJsonEncoder
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cr8 import clients, aio
+from cr8.aio import asyncio
+from cr8.clients import CrateJsonEncoder, HttpClient
+from cr8.fake_server import FakeServer
+from cr8.metrics import Stats
+
+
+@contextlib.asynccontextmanager
+async def _http_client(handler=None, hosts=(), **kwargs):
+    """Yields a ``HttpClient`` for a server which answers with ``handler``.
+
+    Without ``handler`` a ``FakeServer`` is used. ``hosts`` are passed to the
+    client in front of the server url.
+    """
+    if handler is None:
+        server = await FakeServer(port=0).start()
+        url = server.http_url
+    else:
+        app = web.Application()
+        app.router.add_post('/_sql', handler)
+        server = TestServer(app)
+        await server.start_server()
+        url = str(server.make_url(''))
+    client = HttpClient([*hosts, url], **kwargs)
+    try:
+        yield client
+    finally:
+        await client._close()
+        await server.close()
 
 
 class EncoderTest(TestCase):
@@ -24,6 +57,526 @@ class EncoderTest(TestCase):
         self.assertEqual(s, '{"x": 1485388800000}')
 
 
+class JsonEncoderTest(TestCase):
+
+    payload = {
+        'stmt': 'insert into t (d, ts, dt, x) values (?, ?, ?, ?)',
+        'bulk_args': [
+            [Decimal('1.5'), datetime(2017, 1, 26, 23, 33, 1), date(2017, 1, 26), 'x'],
+        ]
+    }
+
+    def test_stdlib_encoder_output_matches_crate_json_encoder(self):
+        encoder = clients.get_json_encoder('json')
+        self.assertEqual(
+            encoder.encode(self.payload),
+            json.dumps(self.payload, cls=CrateJsonEncoder).encode('utf-8'))
+
+    def test_registered_type_conversion_is_used_for_subclasses(self):
+        class Point:
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+        class Point3D(Point):
+            pass
+
+        clients.register_type(Point, lambda o: [o.x, o.y])
+        try:
+            s = json.dumps({'x': Point3D(1, 2)}, cls=CrateJsonEncoder)
+        finally:
+            del clients.type_conversions[Point]
+        self.assertEqual(s, '{"x": [1, 2]}')
+
+    @skipIf(clients.orjson is None, 'orjson is not available')
+    def test_orjson_encoder_output_is_equivalent(self):
+        encoder = clients.get_json_encoder('orjson')
+        self.assertEqual(
+            json.loads(encoder.encode(self.payload)),
+            json.loads(json.dumps(self.payload, cls=CrateJsonEncoder)))
+
+
+class PayloadCacheTest(TestCase):
+
+    def test_payload_is_encoded_once_for_constant_args(self):
+        client = HttpClient(['http://localhost:4200'])
+        args = [1, Decimal(2)]
+        data, encode_duration = client._payloads.get('select ?, ?', args)
+        self.assertEqual(data, b'{"stmt": "select ?, ?", "args": [1, "2"]}')
+        self.assertGreater(encode_duration, 0)
+        self.assertEqual(client._payloads.get('select ?, ?', args), (data, None))
+        data2, _ = client._payloads.get('select ?, ?', [1, Decimal(2)])
+        self.assertIsNot(data2, data)
+
+    def test_bulk_payloads_are_encoded_per_call(self):
+        bodies = []
+
+        async def handler(request):
+            bodies.append(await request.read())
+            return web.json_response({'cols': [], 'results': [], 'duration': 1})
+
+        async def execute_many():
+            async with _http_client(handler, conn_pool_limit=1) as c:
+                bulk_args = [[1]]
+                generated = ([[i]] for i in range(2))
+                results = [await c.execute_many('insert', args)
+                           for args in (bulk_args, bulk_args, generated, generated)]
+                return [r['encode_duration'] for r in results]
+
+        encode_durations = aio.run(execute_many)
+        self.assertTrue(all(d is not None for d in encode_durations))
+        self.assertEqual(bodies, [
+            b'{"stmt": "insert", "bulk_args": [[1]]}',
+            b'{"stmt": "insert", "bulk_args": [[1]]}',
+            b'{"stmt": "insert", "bulk_args": [[0]]}',
+            b'{"stmt": "insert", "bulk_args": [[1]]}',
+        ])
+
+    def test_cache_is_bounded(self):
+        cache = clients._PayloadCache(lambda stmt, args: stmt.encode(), maxsize=2)
+        for i in range(5):
+            cache.get(str(i), None)
+        self.assertEqual(len(cache._entries), 2)
+
+
+class DiscardRowsTest(TestCase):
+
+    def test_discard_rows_extracts_duration_and_rowcount(self):
+        rows = [[i, {'rowcount': 99, 'duration': 99}] for i in range(50000)]
+
+        async def handler(request):
+            return web.json_response({
+                'cols': ['x', 'o'], 'rows': rows, 'rowcount': 50000, 'duration': 12.5})
+
+        async def execute():
+            async with _http_client(handler, conn_pool_limit=1, lazy_pool=True, discard_rows=True) as c:
+                return await c.execute('select x, o from t')
+
+        result = aio.run(execute)
+        self.assertEqual(result['duration'], 12.5)
+        self.assertEqual(result['rowcount'], 50000)
+        self.assertNotIn('rows', result)
+
+    def test_discard_rows_falls_back_to_the_client_duration(self):
+        async def handler(request):
+            return web.json_response({'cols': ['x'], 'rows': [[1]], 'rowcount': 1})
+
+        async def execute():
+            async with _http_client(handler, conn_pool_limit=1, lazy_pool=True, discard_rows=True) as c:
+                return await c.execute('select x from t')
+
+        result = aio.run(execute)
+        self.assertGreater(result['duration'], 0)
+        self.assertIsNone(result['server_duration'])
+        self.assertEqual(result['rowcount'], 1)
+
+    def test_discard_rows_raises_sql_errors(self):
+        async def handler(request):
+            return web.json_response(
+                {'error': {'message': 'RelationUnknown', 'code': 4041}}, status=404)
+
+        async def execute():
+            async with _http_client(handler, conn_pool_limit=1, lazy_pool=True, discard_rows=True) as c:
+                return await c.execute('select x from t')
+
+        with self.assertRaises(clients.SqlException) as cm:
+            aio.run(execute)
+        self.assertTrue(cm.exception.message.startswith('RelationUnknown'))
+
+
+class TimeoutTest(TestCase):
+
+    def test_requests_exceeding_the_timeout_are_aborted(self):
+        stmts = []
+
+        async def handler(request):
+            stmt = (await request.json())['stmt']
+            stmts.append(stmt)
+            if stmt == 'select sleep':
+                await asyncio.sleep(5)
+            return web.json_response({'rows': [[1]], 'rowcount': 1, 'duration': 1})
+
+        async def execute():
+            async with _http_client(handler,
+                                    conn_pool_limit=1,
+                                    session_settings={'search_path': 'x'},
+                                    timeout=0.1) as c:
+                await c.connect()
+                with self.assertRaises(asyncio.TimeoutError):
+                    await c.execute('select sleep')
+                return await c.execute('select 1')
+
+        result = aio.run(execute)
+        self.assertEqual(result['rows'], [[1]])
+        self.assertEqual(stmts, [
+            'set search_path=x',
+            'select sleep',
+            'set search_path=x',
+            'select 1',
+        ])
+
+
+class CompressionTest(TestCase):
+
+    def test_bulk_requests_are_compressed(self):
+        bulk_args = [[i, 'x' * 100] for i in range(1000)]
+        received = []
+
+        async def handler(request):
+            body = await request.json()
+            received.append((request.headers['Content-Encoding'], body))
+            return web.json_response({'results': [{'rowcount': 1}] * 1000, 'duration': 2})
+
+        for compression in clients.compressors:
+            async def execute():
+                async with _http_client(handler, conn_pool_limit=1, lazy_pool=True, compression=compression) as c:
+                    return await c.execute_many('insert into t (x, y) values (?, ?)', bulk_args)
+
+            result = aio.run(execute)
+            encoding, body = received.pop()
+            self.assertEqual(encoding, compression)
+            self.assertEqual(body['bulk_args'], bulk_args)
+            self.assertGreater(result['compress_duration'], 0)
+            self.assertLess(result['request_size'], 10000)
+
+    def test_decompress_detects_gzip_and_deflate(self):
+        data = clients.compressors['gzip'](b'{"stmt": "select 1"}')
+        self.assertEqual(clients._decompress(data), b'{"stmt": "select 1"}')
+        data = clients.compressors['deflate'](b'{"stmt": "select 1"}')
+        self.assertEqual(clients._decompress(data), b'{"stmt": "select 1"}')
+
+
+class BulkRetryTest(TestCase):
+
+    def test_failed_rows_are_retried_in_smaller_batches(self):
+        requests = []
+        failures = {2: 1, 3: 5}
+
+        async def execute_many(stmt, bulk_args):
+            requests.append([args[0] for args in bulk_args])
+            results = []
+            for args in bulk_args:
+                remaining = failures.get(args[0], 0)
+                failures[args[0]] = remaining - 1
+                results.append({'rowcount': -2 if remaining > 0 else 1})
+            return {'duration': 1, 'results': results}
+
+        retry = clients.BulkRetry(execute_many, retries=2, backoff=0)
+        r = aio.run(retry, 'insert into t (x) values (?)', [[i] for i in range(4)])
+        self.assertEqual(r['results'][2:], [{'rowcount': -2}, {'rowcount': -2}])
+        self.assertEqual(requests, [[0, 1, 2, 3], [2, 3], [3]])
+        self.assertEqual(retry.rows, Counter(retried=3, failed=1))
+
+    def test_only_the_first_attempt_is_measured(self):
+        async def execute_many(stmt, bulk_args):
+            results = [{'rowcount': 1 if len(bulk_args) == 1 else -2} for _ in bulk_args]
+            return {'duration': 1, 'results': results}
+
+        stats = Stats()
+        retry = clients.BulkRetry(execute_many, retries=1, backoff=0, stats=stats)
+        aio.run(retry, 'insert into t (x) values (?)', ([i] for i in range(2)))
+        self.assertEqual(stats.sampler.count, 1)
+        self.assertEqual(stats.series['retry'].sampler.count, 2)
+        self.assertEqual(retry.rows, Counter(retried=2, failed=0))
+
+    def test_results_without_rowcounts_are_not_retried(self):
+        async def execute_many(stmt, bulk_args):
+            return {'duration': 1, 'rows': []}
+
+        retry = clients.BulkRetry(execute_many, backoff=0)
+        aio.run(retry, 'insert into t (x) values (?)', [[1]])
+        self.assertEqual(retry.rows, Counter(retried=0, failed=0))
+
+
+class PreparedStatementCacheTest(TestCase):
+
+    def test_statements_are_prepared_once_and_evicted_lru(self):
+        class FakeConnection:
+            def __init__(self):
+                self.prepared = []
+
+            async def prepare(self, stmt):
+                self.prepared.append(stmt)
+                return object()
+
+        conn = FakeConnection()
+        counter = Counter(hits=0, misses=0)
+        cache = clients._PreparedStatementCache(conn, counter, maxsize=2)
+
+        async def prepare_all():
+            for stmt in ('s1', 's1', 's2', 's1', 's3', 's2'):
+                await cache.get(stmt)
+
+        aio.run(prepare_all)
+        self.assertEqual(conn.prepared, ['s1', 's2', 's3', 's2'])
+        self.assertEqual(counter, Counter(hits=2, misses=4))
+
+    def test_connections_are_kept_acquired_up_to_the_pool_size(self):
+        class FakeStatement:
+            def __init__(self, conn):
+                self.conn = conn
+
+            async def fetch(self, *args, **kwargs):
+                # asyncpg invalidates prepared statements on release
+                if self.conn.released:
+                    raise RuntimeError('connection has been released back to the pool')
+                await asyncio.sleep(0.001)
+                return []
+
+        class FakeConnection:
+            released = False
+
+            def is_closed(self):
+                return False
+
+            async def prepare(self, stmt):
+                return FakeStatement(self)
+
+        class FakePool:
+            def __init__(self):
+                self.acquired = []
+
+            async def acquire(self):
+                await asyncio.sleep(0)
+                conn = FakeConnection()
+                self.acquired.append(conn)
+                return conn
+
+            async def release(self, conn):
+                conn.released = True
+
+            async def close(self):
+                pass
+
+        client = clients.AsyncpgClient('asyncpg://localhost:5432', pool_size=2, prepare='always')
+        pool = client._pool = FakePool()
+
+        async def run_concurrently():
+            await asyncio.gather(*(client.execute('select 1') for _ in range(10)))
+
+        aio.run(run_concurrently)
+        aio.run(run_concurrently)
+        self.assertEqual(len(pool.acquired), 2)
+        self.assertEqual(client.prepared_statements, Counter(hits=18, misses=2))
+        client.close()
+        self.assertTrue(all(conn.released for conn in pool.acquired))
+
+    def test_prepare_is_rejected_for_http(self):
+        with self.assertRaises(ValueError):
+            clients.client('localhost:4200', prepare='always')
+
+
+class LeastOutstandingTest(TestCase):
+
+    @patch('cr8.clients.time.monotonic')
+    def test_ejected_url_is_used_again_after_backoff(self, monotonic):
+        monotonic.return_value = 100.0
+        lo = clients.LeastOutstanding(['n1', 'n2'], backoff=1.0)
+        lo.release(lo.acquire(), connection_error=True)
+        self.assertEqual([lo.acquire() for _ in range(3)], ['n2', 'n2', 'n2'])
+
+        monotonic.return_value = 101.0
+        self.assertEqual(lo.acquire(), 'n1')
+
+        lo.release('n1', connection_error=True)
+        monotonic.return_value = 102.5
+        self.assertEqual(lo.acquire(), 'n2', 'backoff doubles on consecutive errors')
+        monotonic.return_value = 103.0
+        self.assertEqual(lo.acquire(), 'n1')
+
+    def test_http_client_releases_url_on_connection_error(self):
+        client = HttpClient(['http://127.0.0.1:1'], lazy_pool=True, load_balancing='least-outstanding')
+        with client:
+            with self.assertRaises(aiohttp.ClientConnectionError):
+                aio.run(client.execute, 'select 1')
+        lo = client.load_balancer
+        self.assertEqual(lo.in_flight, {'http://127.0.0.1:1/_sql': 0})
+        self.assertEqual(lo._failures, {'http://127.0.0.1:1/_sql': 1})
+
+    def test_connect_ejects_unreachable_hosts(self):
+        async def execute():
+            async with _http_client(hosts=['http://127.0.0.1:1'], load_balancing='least-outstanding') as c:
+                await c.connect()
+                for _ in range(3):
+                    await c.execute('select 1')
+                return list(c._pools), c.load_balancer._failures
+
+        pools, failures = aio.run(execute)
+        self.assertEqual(len(pools), 1)
+        self.assertNotEqual(pools, ['http://127.0.0.1:1/_sql'])
+        self.assertEqual(failures, {'http://127.0.0.1:1/_sql': 1})
+
+    def test_connect_fails_if_no_host_is_reachable(self):
+        client = HttpClient(['http://127.0.0.1:1'], load_balancing='least-outstanding')
+        with client:
+            with self.assertRaises(aiohttp.ClientConnectionError):
+                aio.run(client.connect)
+
+    def test_pool_of_ejected_host_is_recreated(self):
+        requests = []
+
+        async def handler(request):
+            requests.append(request)
+            if len(requests) == 1:
+                request.transport.close()
+            return web.json_response({'rows': [], 'rowcount': 0, 'duration': 1})
+
+        async def execute():
+            async with _http_client(handler, conn_pool_limit=1, load_balancing='least-outstanding') as c:
+                c.load_balancer.backoff = 0
+                await c.connect()
+                pool = c._pools[c.load_balancer.urls[0]]
+                with self.assertRaises(aiohttp.ClientConnectionError):
+                    await c.execute('select 1')
+                self.assertEqual(c._pools, {})
+                self.assertEqual(c._dropped_pools, [pool])
+                await c.execute('select 1')
+                self.assertIsNot(c._pools[c.load_balancer.urls[0]], pool)
+
+        aio.run(execute)
+        self.assertEqual(len(requests), 2)
+
+
+class SniffTest(TestCase):
+
+    def test_requests_are_spread_across_sniffed_nodes(self):
+        received = Counter()
+
+        async def handler(request):
+            body = await request.json()
+            if body['stmt'] == 'select http_endpoint from sys.nodes':
+                port = request.url.port
+                return web.json_response({'rows': [
+                    [f'127.0.0.1:{port}'], [f'localhost:{port}'], [None]]})
+            received[request.host] += 1
+            return web.json_response({'rows': [], 'rowcount': 0, 'duration': 1})
+
+        async def execute():
+            async with _http_client(handler, conn_pool_limit=1, lazy_pool=True, sniff_interval=60) as c:
+                await c.connect()
+                for _ in range(4):
+                    await c.execute('select 1')
+                return c.load_balancer.urls
+
+        urls = aio.run(execute)
+        port = urls[0].split(':')[2].split('/')[0]
+        self.assertEqual(urls, [
+            f'http://127.0.0.1:{port}/_sql',
+            f'http://localhost:{port}/_sql',
+        ])
+        self.assertEqual(received, Counter({
+            f'127.0.0.1:{port}': 2,
+            f'localhost:{port}': 2,
+        }))
+
+    def test_failed_discovery_is_logged_and_keeps_the_urls(self):
+        async def handler(request):
+            return web.json_response({'cols': ['http_endpoint']})
+
+        async def sniff():
+            async with _http_client(handler, conn_pool_limit=1, lazy_pool=True, sniff_interval=60) as c:
+                urls = list(c.load_balancer.urls)
+                with self.assertLogs('cr8.clients', 'WARNING') as cm:
+                    await c._sniff()
+                self.assertEqual(c.load_balancer.urls, urls)
+                return cm.output
+
+        output = aio.run(sniff)
+        self.assertIn("KeyError('rows')", output[0])
+
+    def test_sniffing_is_rejected_for_asyncpg(self):
+        with self.assertRaises(ValueError):
+            clients.client('asyncpg://localhost:5432', sniff_interval=60)
+
+
+class SessionPoolTest(TestCase):
+
+    def test_lazy_pool_creates_sessions_on_demand_up_to_limit(self):
+        client = HttpClient(['http://localhost:4200'], conn_pool_limit=2, lazy_pool=True)
+
+        async def acquire_sessions():
+            await client.connect()
+            pool = client._pools['http://localhost:4200/_sql']
+            self.assertEqual(len(pool.sessions), 0)
+            s1 = await pool.acquire()
+            s2 = await pool.acquire()
+            self.assertEqual(len(pool.sessions), 2)
+            pending = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(pending.done())
+            pool.release(s1)
+            self.assertIs(await pending, s1)
+            pool.release(s1)
+            pool.release(s2)
+
+        with client:
+            aio.run(acquire_sessions)
+        self.assertEqual(client._pools, {})
+
+    def test_failed_fill_closes_opened_sessions_and_fails_waiters(self):
+        pool = clients._SessionPool(
+            'http://localhost:4200/_sql', 3, {'limit': 1}, None, clients.get_json_encoder(None))
+        opened = []
+
+        async def open_session(session):
+            opened.append(session)
+            if len(opened) == 2:
+                raise ConnectionRefusedError()
+        pool._open = open_session
+
+        async def fill():
+            waiter = asyncio.ensure_future(pool.acquire())
+            with self.assertRaises(ConnectionRefusedError):
+                await pool.fill()
+            with self.assertRaises(ConnectionRefusedError):
+                await waiter
+
+        aio.run(fill)
+        self.assertEqual(pool.sessions, [])
+        self.assertTrue(all(session.closed for session in opened))
+
+    def test_session_is_discarded_if_settings_cannot_be_applied_again(self):
+        pool = clients._SessionPool(
+            'http://localhost:4200/_sql',
+            1,
+            {'limit': 1},
+            {'search_path': 'doc'},
+            clients.get_json_encoder(None))
+        opened = []
+
+        async def open_session(session):
+            opened.append(session)
+            if len(opened) == 2:
+                raise ConnectionRefusedError()
+        pool._open = open_session
+
+        async def reopen():
+            await pool.fill()
+            session = await pool.acquire()
+            pool.release(session, reopen=True)
+            await asyncio.sleep(0.01)
+            self.assertTrue(session.closed)
+            self.assertEqual(pool.sessions, [])
+            replacement = await pool.acquire()
+            self.assertIsNot(replacement, session)
+            self.assertEqual(opened, [session, session, replacement])
+            await pool.close()
+
+        aio.run(reopen)
+
+    def test_request_after_failed_connect_fails_instead_of_hanging(self):
+        client = HttpClient(['http://127.0.0.1:1'], conn_pool_limit=2)
+
+        async def execute():
+            return await asyncio.wait_for(client.execute('select 1'), 5)
+
+        with client:
+            for _ in range(2):
+                with self.assertRaises(aiohttp.ClientConnectorError):
+                    aio.run(execute)
+            self.assertEqual(client._pools, {})
+
+
 def load_tests(loader, tests, ignore):
     tests.addTests(DocTestSuite(clients))
     return tests
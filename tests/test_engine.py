@@ -1,8 +1,13 @@
 
-from unittest import TestCase
+import threading
+from unittest import TestCase, skipIf
 from doctest import DocTestSuite
-from cr8.engine import eval_fail_if, Result, FailIf, TimedStats
+from cr8.engine import eval_fail_if, Result, FailIf, TimedStats, Runner, AutoWarmup
 from cr8.metrics import Stats
+from cr8 import aio, clients
+from cr8.aio import asyncio
+from cr8.arg_sources import ArgSources
+from cr8.fake_server import FakeServer
 from cr8 import engine
 
 
@@ -37,6 +42,194 @@ class FailIfTest(TestCase):
         eval_fail_if("{bulk_size} < 200", result)
 
 
+class RunAndMeasureTest(TestCase):
+
+    def test_failed_requests_are_counted(self):
+        async def execute(stmt, args):
+            if args:
+                raise ConnectionRefusedError()
+            return {'duration': 1.0}
+
+        statements = [('select 1', i % 4 == 0) for i in range(8)]
+        timed_stats = engine.run_and_measure(
+            execute, statements, 2, track_failed=True, continue_on_error=True)
+        result = timed_stats.stats.get()
+        self.assertEqual(result['n'], 6)
+        self.assertEqual(result['errors'], {'connection': 2})
+        self.assertEqual(result['error_rate'], 0.25)
+        self.assertEqual(result['failed']['n'], 2)
+
+    def test_last_error_is_raised_if_no_request_succeeded(self):
+        async def execute(stmt, args):
+            raise ValueError(stmt)
+
+        with self.assertRaises(ValueError):
+            engine.run_and_measure(
+                execute, [('select 1', None)] * 3, 2, continue_on_error=True)
+
+    def test_errors_are_raised_unless_continue_on_error_is_set(self):
+        async def execute(stmt, args):
+            if args:
+                raise ConnectionRefusedError()
+            return {'duration': 1.0}
+
+        statements = [('insert', i == 3) for i in range(8)]
+        with self.assertRaises(ConnectionRefusedError):
+            engine.run_and_measure(execute, statements, 2)
+
+
+class RunnerTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeServer(port=0, psql_port=0, latency=1)
+        aio.run(self.server.start)
+
+    def tearDown(self):
+        aio.run(self.server.close)
+
+    @skipIf(clients.asyncpg is None, 'asyncpg is not available')
+    def test_prepared_statements_are_counted_per_run(self):
+        with Runner(self.server.psql_url, 1, 'reservoir', prepare='always') as runner:
+            runner.warmup('select 1', 5)
+            runner.run('select 1', iterations=10)
+            self.assertEqual(runner.prepared_statements, {'hits': 10, 'misses': 0})
+            runner.run('select 2', iterations=10)
+            self.assertEqual(runner.prepared_statements, {'hits': 9, 'misses': 1})
+
+    def test_result_contains_buckets_of_the_interval(self):
+        with Runner(self.server.http_url, 2, 'reservoir') as runner:
+            timed_stats = runner.run('select 1', duration=0.5, timeline_interval=0.1)
+        result = Result({}, 'select 1', timed_stats, 2)
+        self.assertIn(len(result.timeline), (5, 6))
+        self.assertEqual(sum(b['n'] for b in result.timeline), result.runtime_stats['n'])
+        first = result.timeline[0]
+        self.assertEqual(first['elapsed'], 0.0)
+        self.assertEqual(first['errors'], 0)
+        self.assertEqual(first['p99'], 1.0)
+
+    def test_result_contains_the_event_loop_lag(self):
+        with Runner(self.server.http_url, 2, 'reservoir') as runner:
+            timed_stats = runner.run('select 1', duration=0.1)
+        result = Result({}, 'select 1', timed_stats, 2)
+        self.assertGreater(result.runtime_stats['loop_lag']['n'], 0)
+
+    def test_warmup_without_concurrency_uses_the_pool_size(self):
+        executed = []
+        with Runner(self.server.http_url, 2, 'reservoir') as runner:
+            execute = runner.client.execute
+
+            async def count(*args):
+                executed.append(args)
+                return await execute(*args)
+            runner.client.execute = count
+            runner.warmup('select 1', 5)
+        self.assertEqual(len(executed), 5)
+
+    def test_args_source_provides_the_arguments_of_each_iteration(self):
+        executed = []
+        with Runner(self.server.http_url, 1, 'reservoir') as runner:
+            execute = runner.client.execute
+
+            async def record(stmt, args):
+                executed.append(args)
+                return await execute(stmt, args)
+            runner.client.execute = record
+            source = ArgSources([{'range': [0, 100]}])
+            runner.warmup('select ?', 2, args_source=source)
+            timed_stats = runner.run('select ?', iterations=5, args_source=source)
+        self.assertEqual(timed_stats.stats.get()['n'], 5)
+        self.assertEqual(executed, [[i] for i in range(7)])
+
+    def test_auto_warmup_stops_once_the_runtime_is_stable(self):
+        with Runner(self.server.http_url, 1, 'reservoir') as runner:
+            iterations = runner.warmup('select 1', AutoWarmup(window=10, stable_windows=2))
+        # the first window only provides the baseline
+        self.assertEqual(iterations, 30)
+        self.assertEqual(runner.warmup_iterations, 30)
+
+    def test_auto_warmup_is_limited_by_max_iterations(self):
+        with Runner(self.server.http_url, 1, 'reservoir') as runner:
+            iterations = runner.warmup('select 1', AutoWarmup(max_iterations=15))
+        self.assertEqual(iterations, 15)
+
+    def test_stable_runtime_stops_after_min_iterations(self):
+        with Runner(self.server.http_url, 1, 'reservoir') as runner:
+            timed_stats = runner.run('select 1', error_margin=0.01, min_iterations=12)
+        self.assertEqual(timed_stats.stats.get()['n'], 12)
+
+    def test_runs_until_error_margin_is_reached_or_iterations_exceeded(self):
+        stats = Stats()
+        statements = engine._generate_until_confident(
+            'select 1', None, stats, 0.05, 2, 100, None)
+        num_statements = 0
+        for i, _ in enumerate(statements):
+            num_statements += 1
+            # alternating values converge with more samples
+            stats.measure(10.0 if i % 2 else 12.0)
+        self.assertGreater(num_statements, 2)
+        self.assertLess(num_statements, 100)
+        self.assertLessEqual(stats.relative_error_margin(), 0.05)
+
+        stats = Stats()
+        statements = engine._generate_until_confident(
+            'select 1', None, stats, 0.0001, 2, 20, None)
+        for i, _ in enumerate(statements):
+            stats.measure(10.0 if i % 2 else 20.0)
+        self.assertEqual(stats.get()['n'], 20)
+
+    def test_mixed_statements_share_the_concurrency(self):
+        statements = [
+            engine.WeightedStatement('select 1', 3),
+            engine.WeightedStatement('select 2', 1, args=['x']),
+        ]
+        with Runner(self.server.http_url, 2, 'reservoir') as runner:
+            combined, per_statement = runner.run_mixed(statements, iterations=200)
+        counts = [timed_stats.stats.get()['n'] for timed_stats in per_statement]
+        self.assertEqual(sum(counts), 200)
+        self.assertGreater(counts[0], counts[1])
+        self.assertEqual(combined.stats.get()['n'], 200)
+
+    def test_timeline_is_none_by_default(self):
+        with Runner(self.server.http_url, 1, 'reservoir') as runner:
+            timed_stats = runner.run('select 1', iterations=5)
+        self.assertIsNone(Result({}, 'select 1', timed_stats, 1).timeline)
+
+
+class MultiProcessRunnerTest(TestCase):
+
+    def setUp(self):
+        # The workers are separate processes, the server must keep serving
+        # while the test waits for them
+        self.loop = asyncio.new_event_loop()
+        self.server = FakeServer(port=0, latency=1)
+        self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+
+    def test_measurements_of_workers_are_merged(self):
+        with Runner(self.server.http_url, 4, 'all', processes=2) as runner:
+            runner.warmup('select 1', 10)
+            timed_stats = runner.run('select 1', iterations=51)
+        result = timed_stats.stats.get()
+        self.assertEqual(result['n'], 51)
+        self.assertEqual(result['client']['n'], 51)
+        self.assertEqual(result['mean'], 1.0)
+        self.assertGreater(runner.pool_setup_duration, 0.0)
+
+    def test_timelines_of_workers_are_merged(self):
+        with Runner(self.server.http_url, 2, 'all', processes=2) as runner:
+            timed_stats = runner.run('select 1', iterations=20, timeline_interval=60)
+        timeline = timed_stats.stats.timeline.get()
+        self.assertEqual(len(timeline), 1)
+        self.assertEqual(timeline[0]['n'], 20)
+
+
 def load_tests(loader, tests, ignore):
     tests.addTests(DocTestSuite(engine))
     return tests
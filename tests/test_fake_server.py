@@ -0,0 +1,78 @@
+from doctest import DocTestSuite
+from unittest import TestCase, main
+
+from cr8 import aio, clients, fake_server
+from cr8.fake_server import FakeServer
+
+
+def _run_with_fake_server(coro_fn, **kwargs):
+    async def run():
+        async with FakeServer(port=0, psql_port=0, **kwargs) as server:
+            return await coro_fn(server)
+    return aio.run(run)
+
+
+class FakeServerTest(TestCase):
+
+    def test_http_execute_and_execute_many(self):
+        async def execute(server):
+            c = clients.HttpClient([server.http_url], conn_pool_limit=2)
+            try:
+                version = await c.get_server_version()
+                result = await c.execute('select x from t')
+                bulk_result = await c.execute_many(
+                    'insert into t (x) values (?)', [[1], [2]])
+                return version, result, bulk_result
+            finally:
+                await c._close()
+
+        version, result, bulk_result = _run_with_fake_server(execute, rows=3, latency=5)
+        self.assertEqual(version['number'], fake_server.VERSION['number'])
+        self.assertEqual(result['rows'], [[1], [1], [1]])
+        self.assertEqual(result['duration'], 5)
+        self.assertEqual(bulk_result['results'], [{'rowcount': 1}, {'rowcount': 1}])
+
+    def test_http_sniffing_returns_own_address(self):
+        async def execute(server):
+            c = clients.HttpClient([server.http_url], sniff_interval=60)
+            try:
+                await c.connect()
+                return server.http_url, c.load_balancer.urls
+            finally:
+                await c._close()
+
+        url, urls = _run_with_fake_server(execute)
+        self.assertEqual(urls, [url + '/_sql'])
+
+    def test_asyncpg_queries(self):
+        async def execute(server):
+            c = clients.AsyncpgClient(server.psql_url,
+                                      pool_size=2,
+                                      session_settings={'search_path': 'doc'})
+            try:
+                version = await c.get_server_version()
+                result = await c.execute('select name from t where name = $1', ['Arthur'])
+                await c.execute_many(
+                    'insert into t (name) values ($1)', [['Arthur'], ['Trillian']])
+                discard = clients.AsyncpgClient(server.psql_url, pool_size=1, discard_rows=True)
+                try:
+                    discarded = await discard.execute('select name from t')
+                finally:
+                    await discard._close_pool()
+                return version, result, discarded
+            finally:
+                await c._close_pool()
+
+        version, result, discarded = _run_with_fake_server(execute, rows=2)
+        self.assertEqual(version['number'], fake_server.VERSION['number'])
+        self.assertEqual([list(r) for r in result['rows']], [['1'], ['1']])
+        self.assertEqual(discarded['rowcount'], 2)
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(DocTestSuite(fake_server))
+    return tests
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
+import io
+from contextlib import redirect_stderr, redirect_stdout
+from doctest import DocTestSuite
 from unittest import TestCase
-from cr8.log import format_stats
+from cr8 import log
+from cr8.engine import Result, TimedStats
+from cr8.log import Logger, format_stats
 from cr8.metrics import Stats
 
 
@@ -30,3 +35,93 @@ class ResultTest(TestCase):
              '    95:   48.700\n'
              '    99.9: 48.700')
         )
+
+    def test_short_result_output_includes_client_round_trip(self):
+        stats = Stats()
+        stats.measure(23.4)
+        stats.measure_series('client', 25.0)
+        stats.measure_series('overhead', 1.6)
+        self.assertEqual(
+            format_stats(stats.get(), 'short'),
+            ('Runtime (in ms):\n'
+             '    mean:    23.400 ± 0.000\n'
+             'Client round-trip (in ms):\n'
+             '    mean:    25.000 (overhead: 1.600)')
+        )
+
+    def test_short_result_output_includes_compression(self):
+        stats = Stats()
+        stats.measure(23.4)
+        stats.measure_series('compress', 3.2)
+        stats.measure_series('request_size', 1024)
+        self.assertEqual(
+            format_stats(stats.get(), 'short'),
+            ('Runtime (in ms):\n'
+             '    mean:    23.400 ± 0.000\n'
+             'Compression (in ms):\n'
+             '    mean:    3.200 (request size: 1024 bytes)')
+        )
+
+    def test_short_result_output_includes_loop_lag(self):
+        stats = Stats()
+        stats.measure(1.0)
+        stats.measure_series('client', 2.0)
+        stats.measure_series('loop_lag', 0.4)
+        self.assertEqual(
+            format_stats(stats.get(), 'short'),
+            ('Runtime (in ms):\n'
+             '    mean:    1.000 ± 0.000\n'
+             'Client round-trip (in ms):\n'
+             '    mean:    2.000\n'
+             'Event loop lag (in ms):\n'
+             '    mean:    0.400 (p99: 0.400)')
+        )
+
+    def test_loop_lag_warning_is_printed_to_stderr(self):
+        stats = Stats()
+        stats.measure(20.0)
+        stats.measure_series('loop_lag', 8.0)
+        result = Result({}, 'select 1', TimedStats(0, 1, stats), 1)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            with Logger() as logger:
+                logger.result(result)
+        self.assertTrue(stdout.getvalue().endswith('(p99: 8.000)\n'))
+        self.assertTrue(stderr.getvalue().startswith('Warning: The event loop lag is 40.0%'))
+
+    def test_short_result_output_includes_timeouts(self):
+        stats = Stats()
+        stats.measure(23.4)
+        stats.timeouts = 2
+        stats.cancelled = 1
+        self.assertEqual(
+            format_stats(stats.get(), 'short'),
+            ('Runtime (in ms):\n'
+             '    mean:    23.400 ± 0.000\n'
+             'Timeouts: 2\n'
+             'Error rate: 66.67%\n'
+             'Cancelled at end of run: 1')
+        )
+
+    def test_short_result_output_includes_errors(self):
+        stats = Stats()
+        stats.measure(23.4)
+        stats.measure(23.4)
+        stats.measure_error(ValueError(), 'sql', 1.0)
+        stats.measure_error(ValueError(), 'connection', 1.0)
+        stats.measure_error(ValueError(), 'sql', 1.0)
+        output = format_stats(stats.get(), 'short')
+        self.assertTrue(output.endswith(
+            'Errors: connection: 1, sql: 2\n'
+            'Error rate: 60.00%'
+        ), output)
+
+    def test_short_result_output_if_all_requests_timed_out(self):
+        stats = Stats()
+        stats.timeouts = 3
+        self.assertEqual(format_stats(stats.get(), 'short'), 'Timeouts: 3\nError rate: 100.00%')
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(DocTestSuite(log))
+    return tests
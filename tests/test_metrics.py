@@ -58,6 +58,21 @@ class StatsTest(TestCase):
         self.assertEqual(hist.get()['n'], 10)
 
 
+class TimelineTest(TestCase):
+
+    def test_errors_of_merged_timelines_are_added(self):
+        t1 = metrics.Timeline(1.0, metrics.All, started=100.0)
+        t1.measure(1.0, now=100.5)
+        t1.error(now=100.6)
+        t2 = metrics.Timeline(1.0, metrics.All, started=100.0)
+        t2.error(now=100.2)
+        t2.error(now=101.2)
+        t1.merge(t2)
+        buckets = t1.get()
+        self.assertEqual([(b['n'], b['errors']) for b in buckets], [(1, 2), (0, 1)])
+        self.assertEqual(buckets[0]['p99'], 1.0)
+
+
 def load_tests(loader, tests, ignore):
     tests.addTests(DocTestSuite(metrics))
     return tests
@@ -0,0 +1,54 @@
+from doctest import DocTestSuite
+from unittest import TestCase, main
+
+from cr8 import aio, saturate
+from cr8.fake_server import FakeServer
+
+
+class RunStepsTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeServer(port=0, latency=10)
+        aio.run(self.server.start)
+
+    def tearDown(self):
+        aio.run(self.server.close)
+
+    def test_steps_stop_once_the_threshold_is_crossed(self):
+        results = []
+        curve = saturate.run_steps(
+            self.server.http_url,
+            'select 1',
+            [1, 4, 8],
+            step_duration=0.3,
+            warmup=0,
+            max_p99=5.0,
+            on_result=results.append
+        )
+        self.assertEqual(len(curve), 1)
+        self.assertEqual(curve[0]['concurrency'], 1)
+        self.assertTrue(curve[0]['breach'].startswith('p99'))
+        self.assertIsNone(saturate.find_knee(curve))
+        self.assertEqual(results[0].concurrency, 1)
+
+    def test_throughput_increases_with_concurrency(self):
+        curve = saturate.run_steps(
+            self.server.http_url,
+            'select 1',
+            [1, 4],
+            step_duration=0.3,
+            warmup=0,
+            max_p99=1000.0,
+        )
+        self.assertEqual([step['concurrency'] for step in curve], [1, 4])
+        self.assertGreater(curve[1]['throughput'], curve[0]['throughput'] * 2)
+        self.assertEqual(saturate.find_knee(curve), curve[1])
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(DocTestSuite(saturate))
+    return tests
+
+
+if __name__ == "__main__":
+    main()
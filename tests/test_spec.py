@@ -3,8 +3,12 @@ from unittest import TestCase
 from doctest import DocTestSuite
 
 from cr8.bench_spec import load_spec
+from cr8.exceptions import ArgumentError
+from cr8.fake_server import FakeServer
+from cr8.log import Logger
+from cr8.run_spec import Executor
 
-from cr8 import engine
+from cr8 import aio, engine, run_spec
 
 
 class SpecTest(TestCase):
@@ -25,6 +29,61 @@ class SpecTest(TestCase):
         return load_spec(os.path.abspath(os.path.join(os.path.dirname(__file__), '../specs/', name)))
 
 
+class ExecutorTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeServer(port=0, latency=1)
+        aio.run(self.server.start)
+
+    def tearDown(self):
+        aio.run(self.server.close)
+
+    def test_mixed_query_reports_each_statement_and_combined_result(self):
+        results = []
+        query = {
+            'name': 'mixed',
+            'mix': [
+                {'statement': 'select 1', 'weight': 70},
+                {'statement': 'select 2', 'weight': 30},
+            ],
+            'iterations': 50,
+            'concurrency': 2,
+        }
+        with Logger(logfile_info=os.devnull) as log:
+            with Executor(spec_dir='.',
+                          benchmark_hosts=self.server.http_url,
+                          result_hosts=None,
+                          log=log,
+                          fail_if=None,
+                          sample_mode='reservoir') as executor:
+                executor.process_result = results.append
+                executor.run_queries([query])
+        self.assertEqual([r.weight for r in results], [0.7, 0.3, 1.0])
+        self.assertEqual(results[2].statement, 'select 1; select 2')
+        self.assertEqual(results[2].runtime_stats['n'], 50)
+        self.assertEqual({r.name for r in results}, {'mixed'})
+
+    def test_mixed_query_rejects_options_of_single_statements(self):
+        mix = [{'statement': 'select 1'}]
+        invalid_queries = [
+            {'mix': mix, 'error_margin': 0.05},
+            {'mix': mix, 'args': [1]},
+            {'mix': mix, 'processes': 2},
+        ]
+        with Logger(logfile_info=os.devnull) as log:
+            with Executor(spec_dir='.',
+                          benchmark_hosts=self.server.http_url,
+                          result_hosts=None,
+                          log=log,
+                          fail_if=None,
+                          sample_mode='reservoir') as executor:
+                executor.process_result = self.fail
+                for query in invalid_queries:
+                    with self.assertRaises(ArgumentError):
+                        executor.run_queries([{'statement': 'select 1'}, query])
+
+
 def load_tests(loader, tests, ignore):
     tests.addTests(DocTestSuite(engine))
+    tests.addTests(DocTestSuite(run_spec))
     return tests